@@ -0,0 +1,256 @@
+# Copyright (C) 2026  agent <agent@local>
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+asyncio versions of the steps of a Guest build.
+"""
+
+import asyncio
+import functools
+import socket
+
+import monotonic
+
+import oz.DomainEvents
+import oz.DomainStats
+import oz.OzException
+import oz.ozutil
+
+
+class AsyncGuestMixin(object):
+    """
+    Mixin for oz.Guest.Guest with the asyncio versions of the steps of a
+    build.  The steps themselves are the blocking code of the guest classes
+    (work on files, libvirt and guestfs), so each step runs in a thread of
+    executor, and each build holds one of its threads for as long as a step
+    runs.  Everything a step waits on is handed back to the event loop: the
+    console and announce sockets, the libvirt lifecycle events, and the ssh
+    and scp subprocesses of all of the builds are multiplexed there, and the
+    thread of the step sleeps on a future until the wait is over.  The
+    executor has to be given explicitly, since it decides how many builds
+    can run at the same time.
+    """
+    async def _run_blocking(self, executor, method, *args):
+        """
+        Internal method to run method(*args) in a thread of executor, and
+        return its result.
+        """
+        if executor is None:
+            raise oz.OzException.OzException("The asyncio methods need an executor to run the build steps in")
+        loop = asyncio.get_running_loop()
+        self.async_loop = loop
+        try:
+            return await loop.run_in_executor(executor, functools.partial(method, *args))
+        finally:
+            self.async_loop = None
+
+    def _wait_on_loop(self, coro):
+        """
+        Internal method for the blocking code of a step to hand the wait in
+        coro to the event loop the step was started from, and return its
+        result.  The thread of the step does nothing until the wait is over.
+        """
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.async_loop:
+            coro.close()
+            raise oz.OzException.OzException("A blocking step can't wait on the event loop it runs on; use the async_* methods")
+        return asyncio.run_coroutine_threadsafe(coro, self.async_loop).result()
+
+    async def async_check_space(self, executor, force_download=False):
+        """
+        asyncio version of check_space().
+        """
+        return await self._run_blocking(executor, self.check_space,
+                                        force_download)
+
+    async def async_generate_install_media(self, executor,
+                                           force_download=False,
+                                           customize_or_icicle=False):
+        """
+        asyncio version of generate_install_media().
+        """
+        return await self._run_blocking(executor, self.generate_install_media,
+                                        force_download, customize_or_icicle)
+
+    async def async_generate_diskimage(self, executor,
+                                       size=10*1024*1024*1024, force=False):
+        """
+        asyncio version of generate_diskimage().
+        """
+        return await self._run_blocking(executor, self.generate_diskimage,
+                                        size, force)
+
+    async def async_install(self, executor, timeout=None, force=False):
+        """
+        asyncio version of install().
+        """
+        return await self._run_blocking(executor, self.install, timeout,
+                                        force)
+
+    async def async_customize(self, executor, libvirt_xml):
+        """
+        asyncio version of customize().
+        """
+        return await self._run_blocking(executor, self.customize, libvirt_xml)
+
+    async def async_generate_icicle(self, executor, libvirt_xml):
+        """
+        asyncio version of generate_icicle().
+        """
+        return await self._run_blocking(executor, self.generate_icicle,
+                                        libvirt_xml)
+
+    async def async_customize_and_generate_icicle(self, executor,
+                                                  libvirt_xml):
+        """
+        asyncio version of customize_and_generate_icicle().
+        """
+        return await self._run_blocking(executor,
+                                        self.customize_and_generate_icicle,
+                                        libvirt_xml)
+
+    async def async_cleanup_install(self, executor):
+        """
+        asyncio version of cleanup_install().
+        """
+        return await self._run_blocking(executor, self.cleanup_install)
+
+    async def async_cleanup_old_guest(self, executor):
+        """
+        asyncio version of cleanup_old_guest().
+        """
+        return await self._run_blocking(executor, self.cleanup_old_guest)
+
+    async def _async_wait_for_install_finish(self, xml, max_time):
+        """
+        asyncio version of _wait_for_install_finish().  The console socket,
+        the lifecycle events of the domain and the timeouts are all waited on
+        in the event loop; only the short libvirt calls run in the default
+        executor.
+        """
+        loop = asyncio.get_running_loop()
+        libvirt_dom = await loop.run_in_executor(None, self.libvirt_conn.createXML, xml, 0)
+        sampler = oz.DomainStats.get_sampler(self.libvirt_conn)
+        sampler.register(libvirt_dom)
+        try:
+            with oz.DomainEvents.DomainWatcher(self.libvirt_conn, libvirt_dom, loop) as watcher:
+                await self._async_wait_for_install_finish_events(libvirt_dom, max_time, watcher)
+        finally:
+            sampler.unregister(libvirt_dom)
+
+    async def _async_log_console(self, sock):
+        """
+        Internal coroutine to log everything the guest writes to its serial
+        console, until it is cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            data = await loop.sock_recv(sock, 65536)
+            if not data:
+                return
+            self.log.debug(data.decode('utf-8', errors='surrogateescape'))
+
+    async def _async_wait_for_install_finish_events(self, libvirt_dom, max_time, watcher):
+        """
+        asyncio version of _wait_for_install_finish_events().
+        """
+        loop = asyncio.get_running_loop()
+        xml = await loop.run_in_executor(None, libvirt_dom.XMLDesc, 0)
+        disks, interfaces = self._get_disks_and_interfaces(xml)
+
+        activity = oz.DomainStats.InstallActivity(self.libvirt_conn, libvirt_dom,
+                                                  disks, interfaces,
+                                                  self.inactivity_timeout)
+        console = None
+        if self.has_consolelog:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setblocking(False)
+            await loop.sock_connect(self.sock, ('127.0.0.1', self.console_listen_port))
+            console = asyncio.ensure_future(self._async_log_console(self.sock))
+
+        async def _finish_cb(self):
+            '''
+            A callback for async_timed_loop to deal with waiting for a guest to finish installing.
+            '''
+            return await loop.run_in_executor(None, activity.check)
+
+        try:
+            finished = await oz.ozutil.async_timed_loop(max_time, _finish_cb, "Waiting for %s to finish installing" % (self.tdl.name), self,
+                                                        watcher.async_stopped)
+        finally:
+            if console is not None:
+                console.cancel()
+
+        await loop.run_in_executor(None, self._check_install_finished,
+                                   libvirt_dom, finished, watcher, activity)
+
+    async def _async_wait_for_guest_boot(self, libvirt_dom):
+        """
+        asyncio version of _wait_for_guest_boot(), reading the announcement
+        of the guest with the event loop.
+        """
+        self.log.info("Waiting for guest %s to boot", self.tdl.name)
+
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+
+        try:
+            await loop.sock_connect(sock, ('127.0.0.1', self.listen_port))
+
+            self.addr = None
+            self.data = b''
+            # three minutes later or at least timeout before the global boot_timeout
+            # potential negative boot_deadline is ok in the check
+            boot_deadline = monotonic.monotonic() + min(3 * 60 , self.boot_timeout - 2)
+
+            async def _boot_cb(self):
+                '''
+                The async_timed_loop callback to look for the guest to boot.
+                '''
+                try:
+                    self.data += await asyncio.wait_for(loop.sock_recv(sock, 8192), 1)
+                except asyncio.TimeoutError:
+                    pass
+
+                return await loop.run_in_executor(None, self._check_announce,
+                                                  libvirt_dom, boot_deadline)
+
+            await oz.ozutil.async_timed_loop(self.boot_timeout, _boot_cb, "Waiting for %s to finish boot" % (self.tdl.name), self)
+
+        finally:
+            sock.close()
+
+        return self._guest_booted()
+
+    async def _async_wait_for_guest_shutdown(self, libvirt_dom):
+        """
+        asyncio version of _wait_for_guest_shutdown().
+        """
+        loop = asyncio.get_running_loop()
+
+        async def _shutdown_cb(self):
+            '''
+            The async_timed_loop callback to wait for the guest to shutdown.
+            '''
+            return await loop.run_in_executor(None, oz.DomainEvents.domain_gone, libvirt_dom)
+
+        with oz.DomainEvents.DomainWatcher(self.libvirt_conn, libvirt_dom, loop) as watcher:
+            return await oz.ozutil.async_timed_loop(self.shutdown_timeout, _shutdown_cb, "Waiting for %s to finish shutdown" % (self.tdl.name), self,
+                                                    watcher.async_stopped)
@@ -0,0 +1,238 @@
+# Copyright (C) 2026  agent <agent@local>
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Support for running many builds in one process: reading build manifests,
+and admitting builds only as long as the host has the CPUs, memory and disk
+space for them.
+"""
+
+import json
+import os
+import threading
+
+import oz.OzException
+import oz.ozutil
+
+
+class BuildEntry(object):
+    """
+    Class to hold one build of a manifest.
+    """
+    def __init__(self, tdl, auto=None, disk=None, timeout=None,
+                 customize=False, generate_icicle=False):
+        self.tdl = tdl
+        self.auto = auto
+        self.disk = disk
+        self.timeout = timeout
+        self.customize = customize
+        self.generate_icicle = generate_icicle
+
+
+def read_manifest(path):
+    """
+    Function to read a build manifest.  The manifest is a JSON list with an
+    entry per build, which is either the path of the TDL, or an object with
+    a "tdl" key and optionally the "auto", "disk", "timeout", "customize"
+    and "generate_icicle" keys (with the meaning of the oz-install options
+    of the same name).  Relative paths are relative to the directory of the
+    manifest.  Returns a list of BuildEntry objects.
+    """
+    with open(path, 'r') as f:
+        try:
+            manifest = json.load(f)
+        except ValueError as err:
+            raise oz.OzException.OzException("Invalid manifest %s: %s" % (path, err))
+
+    if not isinstance(manifest, list):
+        raise oz.OzException.OzException("Invalid manifest %s: expected a list of builds" % (path))
+
+    basedir = os.path.dirname(os.path.abspath(path))
+
+    def _path(value):
+        """
+        Method to make a path of the manifest absolute.
+        """
+        if value is None:
+            return None
+        return os.path.join(basedir, value)
+
+    entries = []
+    for item in manifest:
+        if isinstance(item, str):
+            item = {'tdl': item}
+        if not isinstance(item, dict) or 'tdl' not in item:
+            raise oz.OzException.OzException("Invalid manifest %s: every build needs a tdl" % (path))
+        unknown = set(item) - set(['tdl', 'auto', 'disk', 'timeout',
+                                   'customize', 'generate_icicle'])
+        if unknown:
+            raise oz.OzException.OzException("Invalid manifest %s: unknown keys %s" % (path, ", ".join(sorted(unknown))))
+        timeout = item.get('timeout')
+        if timeout is not None:
+            timeout = int(timeout)
+        entries.append(BuildEntry(_path(item['tdl']), _path(item.get('auto')),
+                                  _path(item.get('disk')), timeout,
+                                  bool(item.get('customize', False)),
+                                  bool(item.get('generate_icicle', False))))
+
+    return entries
+
+
+def host_memory():
+    """
+    Function to return the amount of memory of the host in kilobytes.
+    """
+    return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+class AdmissionPool(object):
+    """
+    Class to limit the builds that run at the same time to the CPUs (in
+    virtual CPUs), memory (in kilobytes, like Guest.install_memory) and disk
+    space the host has.  acquire() blocks until a build fits, and release()
+    gives its share back.  Disk space is accounted per filesystem: a build
+    fits if what is free on it right now, less what the running builds have
+    reserved, covers its needs.  Since the running builds may already have
+    written some of what they reserved, this errs on the safe side.  A build that
+    doesn't fit even on an idle host is still admitted when nothing else
+    is running, so that it can fail (or succeed) on its own.
+    """
+    def __init__(self, cpus, memory):
+        self.cpus = cpus
+        self.memory = memory
+        self.cond = threading.Condition()
+        self.used_cpus = 0
+        self.used_memory = 0
+        self.running = 0
+        # the reserved space per filesystem
+        self.disk_used = {}
+
+    def _disk_needs(self, needs):
+        """
+        Internal method to add up a list of (description, path, bytes) needs
+        per filesystem.  Returns a dictionary of filesystem to (path, bytes).
+        """
+        totals = {}
+        for path, needed, available_unused in oz.ozutil.filesystem_space(needs):
+            totals[oz.ozutil.filesystem_id(path)] = (path, needed)
+        return totals
+
+    def _fits(self, cpus, memory, disk):
+        """
+        Internal method to check whether a build fits next to the ones that
+        are running.  Must be called with the lock held.
+        """
+        if self.running == 0:
+            return True
+        if self.used_cpus + cpus > self.cpus:
+            return False
+        if self.used_memory + memory > self.memory:
+            return False
+        for fsid, (path, needed) in disk.items():
+            # the free space is read again every time, since finished builds
+            # leave their disk images behind
+            available = oz.ozutil.filesystem_space([('', path, 0)])[0][2]
+            if self.disk_used.get(fsid, 0) + needed > available:
+                return False
+        return True
+
+    def acquire(self, cpus, memory, needs=None):
+        """
+        Method to wait until a build with cpus virtual CPUs, memory kilobytes
+        of memory and the disk space needs (a list of (description, path,
+        bytes) tuples) can run, and reserve those for it.  Returns the
+        reservation, to be passed to release().
+        """
+        disk = self._disk_needs(needs or [])
+        with self.cond:
+            while not self._fits(cpus, memory, disk):
+                # space may also be freed outside of this pool, so look again
+                # every once in a while
+                self.cond.wait(10)
+            self.used_cpus += cpus
+            self.used_memory += memory
+            for fsid, (path_unused, needed) in disk.items():
+                self.disk_used[fsid] = self.disk_used.get(fsid, 0) + needed
+            self.running += 1
+        return (cpus, memory, disk)
+
+    def release(self, reservation):
+        """
+        Method to give the resources of a finished build back.
+        """
+        (cpus, memory, disk) = reservation
+        with self.cond:
+            self.used_cpus -= cpus
+            self.used_memory -= memory
+            for fsid, (path_unused, needed) in disk.items():
+                self.disk_used[fsid] -= needed
+            self.running -= 1
+            self.cond.notify_all()
+
+
+def install_guest(guest, force_download=False, cleanup=False, customize=False,
+                  generate_icicle=False, timeout=None, pool=None):
+    """
+    Function to run the steps of an installation of guest, the way that both
+    oz-install and oz-build-many do it: remove (or check for) an old guest of
+    the same name, check the disk space, generate the install media and the
+    disk image, install, and then customize, generate the ICICLE and flatten
+    the disk image as asked for.  If pool (an AdmissionPool) is given, the
+    steps after the disk space check only run once the pool admits the
+    build.  Returns a tuple of the libvirt XML of the guest and the ICICLE
+    (or None if it wasn't generated).
+    """
+    if cleanup:
+        guest.cleanup_old_guest()
+    else:
+        guest.check_for_guest_conflict()
+
+    plan = guest.check_space(force_download)
+
+    reservation = None
+    if pool is not None:
+        needs = [(step, directory, size) for step, directory, size, sparse in plan if not sparse]
+        reservation = pool.acquire(int(guest.install_cpus),
+                                   guest.install_memory, needs)
+    try:
+        try:
+            guest.generate_install_media(force_download,
+                                         customize or generate_icicle)
+            try:
+                guest.generate_diskimage(size=guest.disksize,
+                                         force=force_download)
+                libvirt_xml = guest.install(timeout, force_download)
+            except:
+                guest.cleanup_old_guest()
+                raise
+        finally:
+            guest.cleanup_install()
+
+        icicle_xml = None
+        if customize and generate_icicle:
+            icicle_xml = guest.customize_and_generate_icicle(libvirt_xml)
+        elif customize:
+            guest.customize(libvirt_xml)
+        elif generate_icicle:
+            icicle_xml = guest.generate_icicle(libvirt_xml)
+
+        if guest.jeos_flatten:
+            guest.flatten_diskimage()
+    finally:
+        if reservation is not None:
+            pool.release(reservation)
+
+    return libvirt_xml, icicle_xml
@@ -161,6 +161,12 @@ class DebianGuest(oz.Linux.LinuxCDGuest):
         else:
             shutil.copy(self.auto, outname)
 
+    def _iso_overlay_paths(self, iso):
+        """
+        Method to return the paths on the ISO that Debian guests modify.
+        """
+        return ["isolinux/isolinux.cfg", "preseed/customiso.seed"]
+
     def _modify_iso(self):
         """
         Method to make the boot ISO auto-boot with appropriate parameters.
@@ -590,25 +596,27 @@ critical initrd=%s/initrd.gz --
             # hard-coded path
             initrd = "debian-installer/%s/initrd.gz" % (self.debarch)
 
-        (fd, outdir) = oz.ozutil.open_locked_file(self.kernelcache)
+        (fd, outdir) = oz.ozutil.open_locked_file(self.kernelcache, shared=True)
 
         try:
-            self._get_original_media('/'.join([self.url.rstrip('/'),
-                                               kernel.lstrip('/')]),
-                                     fd, outdir, force_download)
+            self.media.get_original_media('/'.join([self.url.rstrip('/'),
+                                                    kernel.lstrip('/')]),
+                                          fd, outdir, force_download,
+                                          self.kernelcache)
 
             # if we made it here, then we can copy the kernel into place
             shutil.copyfile(self.kernelcache, self.kernelfname)
         finally:
             os.close(fd)
 
-        (fd, outdir) = oz.ozutil.open_locked_file(self.initrdcache)
+        (fd, outdir) = oz.ozutil.open_locked_file(self.initrdcache, shared=True)
 
         try:
             try:
-                self._get_original_media('/'.join([self.url.rstrip('/'),
-                                                   initrd.lstrip('/')]),
-                                         fd, outdir, force_download)
+                self.media.get_original_media('/'.join([self.url.rstrip('/'),
+                                                        initrd.lstrip('/')]),
+                                              fd, outdir, force_download,
+                                              self.initrdcache)
             except:
                 os.unlink(self.kernelfname)
                 raise
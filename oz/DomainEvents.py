@@ -0,0 +1,179 @@
+# Copyright (C) 2026  agent <agent@local>
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Delivery of libvirt domain lifecycle events, so that Oz can react to a guest
+going away as soon as it happens instead of polling for it.
+"""
+
+import asyncio
+import logging
+import threading
+
+import libvirt
+
+_event_loop_lock = threading.Lock()
+_event_loop_started = threading.Event()
+
+# libvirt connections are thread-safe, so all of the guests in a process that
+# use the same URI share a connection
+_connections_lock = threading.Lock()
+_connections = {}
+
+
+def _run_event_loop():
+    """
+    Function that runs the libvirt default event loop forever.
+    """
+    log = logging.getLogger(__name__)
+    while True:
+        try:
+            libvirt.virEventRunDefaultImpl()
+        except libvirt.libvirtError as err:
+            log.debug("libvirt event loop error: %s", err)
+
+
+def start_event_loop():
+    """
+    Function to register the libvirt default event loop implementation and
+    run it in a background thread.  libvirt only delivers events on
+    connections that are opened after this, so it has to be called before
+    the connection is opened.  Calling it more than once is harmless.
+    Returns True if the event loop is running, False if it couldn't be
+    started (in which case events are not available).
+    """
+    with _event_loop_lock:
+        if not _event_loop_started.is_set():
+            try:
+                libvirt.virEventRegisterDefaultImpl()
+            except libvirt.libvirtError as err:
+                logging.getLogger(__name__).debug("Could not register the libvirt event loop: %s", err)
+                return False
+            thread = threading.Thread(target=_run_event_loop,
+                                      name="libvirt events")
+            # the loop never ends, so it must not keep the process alive
+            thread.daemon = True
+            thread.start()
+            _event_loop_started.set()
+    return True
+
+
+def domain_gone(dom):
+    """
+    Function to check whether the domain dom is gone.
+    """
+    try:
+        dom.info()
+    except libvirt.libvirtError as err:
+        # Only VIR_ERR_NO_DOMAIN means that the guest really, truly went
+        # away cleanly; any other error is one we don't understand.
+        return err.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN
+
+    return False
+
+
+def open_connection(uri):
+    """
+    Function to return the libvirt connection to uri shared by all of the
+    users in the process, opening it if need be.  The event loop is started
+    first, so that domain events are delivered on the connection.
+    """
+    start_event_loop()
+    with _connections_lock:
+        if uri not in _connections:
+            _connections[uri] = libvirt.open(uri)
+        return _connections[uri]
+
+
+class DomainWatcher(object):
+    """
+    Class to watch a running domain for lifecycle events.  The stopped
+    attribute is a threading.Event that gets set as soon as the domain is
+    no longer running, for whatever reason; it can be passed to
+    oz.ozutil.timed_loop() to end a wait right away.  If the asyncio event
+    loop loop is given, async_stopped is an asyncio.Event on that loop that
+    gets set along with stopped, for oz.ozutil.async_timed_loop().  If
+    events can't be delivered on the connection, supported is False and the
+    events are never set, so callers must keep polling the domain as well.
+    """
+    def __init__(self, conn, dom, loop=None):
+        self.conn = conn
+        self.dom = dom
+        self.loop = loop
+        self.stopped = threading.Event()
+        self.async_stopped = None
+        if loop is not None:
+            self.async_stopped = asyncio.Event()
+        # the detail of the lifecycle event that stopped the domain
+        self.detail = None
+        self.callback_id = None
+        self.supported = False
+
+        if not _event_loop_started.is_set():
+            return
+
+        try:
+            self.callback_id = conn.domainEventRegisterAny(dom,
+                                                           libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                                                           self._lifecycle_cb,
+                                                           None)
+        except libvirt.libvirtError as err:
+            logging.getLogger(__name__).debug("Could not register for events of %s: %s", dom.name(), err)
+            return
+        self.supported = True
+
+        # the domain may have gone away before we were registered
+        try:
+            if not dom.isActive():
+                self._set_stopped()
+        except libvirt.libvirtError as err:
+            if err.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                self._set_stopped()
+
+    def _set_stopped(self):
+        """
+        Internal method to flag the domain as stopped, from any thread.
+        """
+        self.stopped.set()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.async_stopped.set)
+
+    def _lifecycle_cb(self, conn_unused, dom_unused, event, detail, opaque_unused):
+        """
+        Method called from the event loop thread for every lifecycle event of
+        the domain.
+        """
+        if event in (libvirt.VIR_DOMAIN_EVENT_STOPPED,
+                     libvirt.VIR_DOMAIN_EVENT_UNDEFINED):
+            self.detail = detail
+            self._set_stopped()
+
+    def close(self):
+        """
+        Method to stop watching the domain.
+        """
+        if self.callback_id is not None:
+            try:
+                self.conn.domainEventDeregisterAny(self.callback_id)
+            except libvirt.libvirtError:
+                pass
+            self.callback_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,274 @@
+# Copyright (C) 2026  agent <agent@local>
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Sampling of the disk and network statistics of all of the domains that Oz
+is watching on a libvirt connection with a single call, rather than a call
+per device per domain, and tracking of the activity of running installs
+with them.
+"""
+
+import logging
+import threading
+
+import monotonic
+
+import libvirt
+
+import oz.OzException
+
+_samplers_lock = threading.Lock()
+_samplers = {}
+
+
+class StatsSampler(object):
+    """
+    Class to sample the block and interface statistics of the domains
+    registered with it.  All of the registered domains (and only those) are
+    sampled together with one virConnectGetDomainStats() call, at most once
+    every interval seconds; every caller of sample() within that time gets
+    the results of the same call, so that installs that poll at about the
+    same time share it.
+    """
+    def __init__(self, conn, interval=1):
+        self.conn = conn
+        self.interval = interval
+        self.log = logging.getLogger('%s.%s' % (__name__,
+                                                self.__class__.__name__))
+        self.lock = threading.Lock()
+        # the domain and the number of its registrations, by UUID
+        self.domains = {}
+        self.stats = {}
+        self.sampled = None
+        # whether the connection can do bulk statistics; if not, sample()
+        # always returns None and callers query the domain themselves
+        self.supported = hasattr(conn, 'domainListGetStats')
+
+    def register(self, dom):
+        """
+        Method to start sampling dom.
+        """
+        with self.lock:
+            uuid = dom.UUIDString()
+            count = self.domains.get(uuid, (dom, 0))[1]
+            self.domains[uuid] = (dom, count + 1)
+            # make sure the next sample includes the new domain
+            self.sampled = None
+
+    def unregister(self, dom):
+        """
+        Method to stop sampling dom.
+        """
+        with self.lock:
+            uuid = dom.UUIDString()
+            (registered, count) = self.domains[uuid]
+            if count <= 1:
+                del self.domains[uuid]
+                self.stats.pop(uuid, None)
+            else:
+                self.domains[uuid] = (registered, count - 1)
+
+    def _refresh(self):
+        """
+        Internal method to sample all of the registered domains.  Must be
+        called with the lock held.
+        """
+        stats = libvirt.VIR_DOMAIN_STATS_BLOCK | libvirt.VIR_DOMAIN_STATS_INTERFACE
+        doms = [dom for dom, count_unused in self.domains.values()]
+        try:
+            records = self.conn.domainListGetStats(doms, stats)
+        except libvirt.libvirtError as err:
+            if err.get_error_code() == libvirt.VIR_ERR_NO_SUPPORT:
+                self.log.debug("Bulk domain statistics are not supported, querying domains one by one")
+                self.supported = False
+                return
+            # most likely one of the domains went away; sample the others
+            # one at a time, so that they still get their statistics
+            self.log.debug("Sampling domain statistics failed: %s", err)
+            records = []
+            for dom in doms:
+                try:
+                    records.extend(self.conn.domainListGetStats([dom], stats))
+                except libvirt.libvirtError:
+                    pass
+
+        self.stats = {}
+        for dom, dom_stats in records:
+            self.stats[dom.UUIDString()] = dom_stats
+        self.sampled = monotonic.monotonic()
+
+    def sample(self, dom):
+        """
+        Method to return the statistics of dom (which must be registered), as
+        the dictionary of typed parameters that libvirt returns (keys like
+        "block.0.name" and "net.0.rx.bytes").  Returns None if the statistics
+        can't be sampled in bulk, or dom is not running (any more); the
+        caller then has to query the domain itself.
+        """
+        with self.lock:
+            if self.supported and (self.sampled is None or monotonic.monotonic() - self.sampled >= self.interval):
+                self._refresh()
+            if not self.supported:
+                return None
+            return self.stats.get(dom.UUIDString())
+
+
+def get_sampler(conn):
+    """
+    Function to return the StatsSampler shared by all of the users of the
+    libvirt connection conn.
+    """
+    with _samplers_lock:
+        if id(conn) not in _samplers:
+            _samplers[id(conn)] = StatsSampler(conn)
+        return _samplers[id(conn)]
+
+
+def device_totals(stats, disks, interfaces):
+    """
+    Function to add up the statistics returned by StatsSampler.sample() into
+    the total number of disk requests on the disk targets disks, and the
+    total number of bytes transferred on the interface targets interfaces.
+    Returns None if any of the devices is missing from the statistics.
+    """
+    blocks = {}
+    for i in range(stats.get("block.count", 0)):
+        prefix = "block.%d." % (i)
+        blocks[stats.get(prefix + "name")] = stats.get(prefix + "rd.reqs", 0) + stats.get(prefix + "wr.reqs", 0)
+    nets = {}
+    for i in range(stats.get("net.count", 0)):
+        prefix = "net.%d." % (i)
+        nets[stats.get(prefix + "name")] = stats.get(prefix + "rx.bytes", 0) + stats.get(prefix + "tx.bytes", 0)
+
+    if any(dev not in blocks for dev in disks) or any(dev not in nets for dev in interfaces):
+        return None
+
+    return (sum(blocks[dev] for dev in disks),
+            sum(nets[dev] for dev in interfaces))
+
+
+def disk_and_net_activity(conn, dom, disks, interfaces):
+    """
+    Function to collect the disk and network activity by the domain dom on
+    the libvirt connection conn.  The function returns two numbers: the
+    first is the sum of all disk activity from all disks, and the second is
+    the sum of all network traffic from all network devices.  The
+    statistics are taken from the sampler shared by all of the installs on
+    the connection if possible, and queried per device otherwise.
+    """
+    stats = get_sampler(conn).sample(dom)
+    if stats is not None:
+        totals = device_totals(stats, disks, interfaces)
+        if totals is not None:
+            return totals
+
+    total_disk_req = 0
+    for dev in disks:
+        rd_req, rd_bytes_unused, wr_req, wr_bytes_unused, errs_unused = dom.blockStats(dev)
+        total_disk_req += rd_req + wr_req
+
+    total_net_bytes = 0
+    for dev in interfaces:
+        rx_bytes, rx_packets_unused, rx_errs_unused, rx_drop_unused, tx_bytes, tx_packets_unused, tx_errs_unused, tx_drop_unused = dom.interfaceStats(dev)
+        total_net_bytes += rx_bytes + tx_bytes
+
+    return total_disk_req, total_net_bytes
+
+
+class InstallActivity(object):
+    """
+    Class to track the disk and network activity of the install running in
+    the domain dom, to tell when it has hung.  The install is considered
+    hung once it showed no activity for timeout checks in a row.
+    """
+    def __init__(self, conn, dom, disks, interfaces, timeout):
+        self.conn = conn
+        self.dom = dom
+        self.disks = disks
+        self.interfaces = interfaces
+        self.timeout = timeout
+        self.last_disk_activity = 0
+        self.last_network_activity = 0
+        self.countdown = timeout
+        # the libvirt error that ended the tracking, if any
+        self.saved_exception = None
+
+    def check(self):
+        """
+        Method to check the install for disk and network activity since the
+        last check.  Returns True if waiting for the install should stop,
+        because the inactivity timeout ran out or libvirt failed.
+        """
+        if self.countdown <= 0:
+            return True
+        try:
+            total_disk_req, total_net_bytes = disk_and_net_activity(self.conn, self.dom,
+                                                                    self.disks,
+                                                                    self.interfaces)
+        except libvirt.libvirtError as e:
+            # we save the exception here because we want to raise it later
+            # if this was a "real" exception
+            self.saved_exception = e
+            return True
+
+        # rd_req and wr_req are the *total* number of disk read requests and
+        # write requests ever made for this domain.  Similarly rd_bytes and
+        # wr_bytes are the total number of network bytes read or written
+        # for this domain
+
+        # we define activity as having done a read or write request on the
+        # install disk, or having done at least 4KB of network transfers in
+        # the last second.  The thinking is that if the installer is putting
+        # bits on disk, there will be disk activity, so we should keep
+        # waiting.  On the other hand, the installer might be downloading
+        # bits to eventually install on disk, so we look for network
+        # activity as well.  We say that transfers of at least 4KB must be
+        # made, however, to try to reduce false positives from things like
+        # ARP requests
+
+        if (total_disk_req == self.last_disk_activity) and (total_net_bytes < (self.last_network_activity + 4096)):
+            # if we saw no read or write requests since the last iteration,
+            # decrement our activity timer
+            self.countdown -= 1
+        else:
+            # if we did see some activity, then we can reset the timer
+            self.countdown = self.timeout
+
+        self.last_disk_activity = total_disk_req
+        self.last_network_activity = total_net_bytes
+
+        return False
+
+    def raise_error(self, logger):
+        """
+        Method to raise the libvirt error that ended the tracking, after
+        logging its details with logger, or a generic error if there was
+        none.
+        """
+        if self.saved_exception is None:
+            raise oz.OzException.OzException("Unknown libvirt error")
+
+        logger.debug("Libvirt Domain Info Failed:")
+        logger.debug(" code is %d", self.saved_exception.get_error_code())
+        logger.debug(" domain is %d", self.saved_exception.get_error_domain())
+        logger.debug(" message is %s", self.saved_exception.get_error_message())
+        logger.debug(" level is %d", self.saved_exception.get_error_level())
+        logger.debug(" str1 is %s", self.saved_exception.get_str1())
+        logger.debug(" str2 is %s", self.saved_exception.get_str2())
+        logger.debug(" str3 is %s", self.saved_exception.get_str3())
+        logger.debug(" int1 is %d", self.saved_exception.get_int1())
+        logger.debug(" int2 is %d", self.saved_exception.get_int2())
+        raise self.saved_exception
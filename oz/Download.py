@@ -0,0 +1,466 @@
+# Copyright (C) 2010,2011  Chris Lalancette <clalance@redhat.com>
+# Copyright (C) 2012-2018  Chris Lalancette <clalancette@gmail.com>
+# Copyright (C) 2026  agent <agent@local>
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+HTTP session handling and (ranged, resumable) downloads of install media
+and other files.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import sys
+import threading
+import urllib
+try:
+    import urllib.parse as urlparse
+except ImportError:
+    import urlparse
+
+import requests
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    from requests.packages.urllib3.util.retry import Retry
+
+import oz.ozutil
+
+
+_http_session = None
+_http_session_lock = threading.Lock()
+_http_session_config = {'pool_size': 10, 'retries': 3, 'backoff': 0.5}
+
+
+def configure_http_session(pool_size=None, retries=None, backoff=None):
+    """
+    Function to configure the HTTP session shared by all of the network
+    operations in oz.  pool_size is the number of connections kept open per
+    host, retries is the number of times a failed connection or a 5xx
+    response is retried, and backoff is the factor (in seconds) of the
+    exponential backoff between retries.  Arguments that are None are left
+    alone.  If anything changed, the new settings take effect the next time
+    the session is used.
+    """
+    global _http_session  # pylint: disable=global-statement
+    with _http_session_lock:
+        changed = False
+        for key, value in [('pool_size', pool_size), ('retries', retries),
+                           ('backoff', backoff)]:
+            if value is not None and _http_session_config[key] != value:
+                _http_session_config[key] = value
+                changed = True
+        # several guests in one process configure the session the same way;
+        # only drop it (and its pooled connections, which may be in use by
+        # another build) if something changed
+        if changed and _http_session is not None:
+            _http_session.close()
+            _http_session = None
+
+
+def configure_from_config(config):
+    """
+    Function to configure the HTTP session from the 'download' section of
+    the oz configuration config.  Returns the number of workers that
+    downloads should use.
+    """
+    workers = int(oz.ozutil.config_get_key(config, 'download', 'workers', 4))
+    # all of the download workers need their own pooled connection
+    pool_size = int(oz.ozutil.config_get_key(config, 'download', 'pool_size',
+                                             10))
+    configure_http_session(max(pool_size, workers),
+                           int(oz.ozutil.config_get_key(config, 'download',
+                                                        'retries', 3)),
+                           float(oz.ozutil.config_get_key(config, 'download',
+                                                          'backoff', 0.5)))
+    return workers
+
+
+def get_http_session():
+    """
+    Function to get the HTTP session shared by all of the network operations
+    in oz.  The session keeps connections alive between requests (so that
+    fetching e.g. a treeinfo, kernel, initrd and checksum file from the same
+    mirror only pays for the TCP and TLS handshakes once), retries transient
+    failures, and handles file:// URLs.  The session is created on first use
+    and may be used from several threads at once.
+    """
+    global _http_session  # pylint: disable=global-statement
+    with _http_session_lock:
+        if _http_session is None:
+            retry = Retry(total=_http_session_config['retries'],
+                          backoff_factor=_http_session_config['backoff'],
+                          status_forcelist=(500, 502, 503, 504),
+                          raise_on_status=False)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=_http_session_config['pool_size'],
+                                                    pool_maxsize=_http_session_config['pool_size'],
+                                                    max_retries=retry)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.mount('file://', oz.ozutil.LocalFileAdapter())
+            _http_session = session
+        return _http_session
+
+
+def http_get_header(url, redirect=True, headers=None):
+    """
+    Function to get the HTTP headers from a URL.  The available headers will be
+    returned in a dictionary.  If redirect=True (the default), then this
+    function will automatically follow http redirects through to the final
+    destination, entirely transparently to the caller.  If redirect=False, then
+    this function will follow http redirects through to the final destination,
+    and also store that information in the 'Redirect-URL' key.  Note that
+    'Redirect-URL' will always be None in the redirect=True case, and may be
+    None in the redirect=True case if no redirects were required.  Any extra
+    request headers (like If-None-Match) can be passed in the headers
+    dictionary.
+    """
+    response = get_http_session().head(url, allow_redirects=redirect, stream=True, timeout=10,
+                                       headers=headers)
+    try:
+        info = response.headers
+        info['HTTP-Code'] = response.status_code
+        if not redirect:
+            info['Redirect-URL'] = response.headers.get('Location')
+        else:
+            info['Redirect-URL'] = None
+    finally:
+        response.close()
+
+    return info
+
+
+def _http_download_stream(url, fd, show_progress, logger, digest=None):
+    """
+    Internal function to download a file from url to file descriptor fd using
+    a single streaming GET.  If digest is not None, it is updated with the
+    data as it is downloaded.
+    """
+    response = get_http_session().get(url, stream=True, allow_redirects=True,
+                                      headers={'Accept-Encoding': ''})
+    try:
+        # chunked responses don't have a length to show the progress against
+        file_size = response.headers.get('Content-Length')
+        chunk_size = 10 * 1024 * 1024
+        done = 0
+        for chunk in response.iter_content(chunk_size):
+            oz.ozutil.write_bytes_to_fd(fd, chunk)
+            if digest is not None:
+                digest.update(chunk)
+            done += len(chunk)
+            if show_progress:
+                if file_size is None:
+                    logger.debug("%dkB", done / 1024)
+                else:
+                    logger.debug("%dkB of %dkB", done / 1024, int(file_size) / 1024)
+    finally:
+        response.close()
+
+
+def _read_download_manifest(manifest):
+    """
+    Internal function to read the state of a partial download out of the
+    manifest file.  Returns None if there is no (usable) manifest.
+    """
+    try:
+        with open(manifest, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _write_download_manifest(manifest, state):
+    """
+    Internal function to atomically write the state of a partial download to
+    the manifest file.
+    """
+    tmpname = manifest + ".tmp"
+    with open(tmpname, 'w') as f:
+        json.dump(state, f)
+    os.rename(tmpname, manifest)
+
+
+def _http_download_ranges(url, fd, file_size, workers, show_progress, logger,
+                          segment_size=64 * 1024 * 1024, manifest=None,
+                          source=None, validator=None, digest=None):
+    """
+    Internal function to download a file from url to file descriptor fd using
+    up to "workers" concurrent HTTP Range requests of segment_size bytes.  Each
+    segment is written straight into fd at its own offset.
+
+    If manifest is not None, it is the path to a file that records which
+    segments have already been downloaded (along with their SHA256), so that
+    an interrupted download can be continued later on.  The manifest is only
+    reused if it was written for the same source URL, size and validator (the
+    ETag or Last-Modified header of the server), and the segments it lists
+    are re-hashed before they are trusted.
+
+    If digest is not None, it is updated with the whole file.  Since segments
+    finish out of order, each one is fed to digest (from the page cache) as
+    soon as all of the segments before it are complete.
+    """
+    chunk_size = 1024 * 1024
+    segment_list = [(start, min(start + segment_size, file_size) - 1)
+                    for start in range(0, file_size, segment_size)]
+    segments = list(segment_list)
+
+    lock = threading.Lock()
+    hash_lock = threading.Lock()
+    errors = []
+    progress = {'done': 0, 'last': 0, 'hashed': 0}
+    state = {'url': source, 'size': file_size, 'segment_size': segment_size,
+             'validator': validator, 'blocks': {}}
+
+    if manifest is not None:
+        previous = _read_download_manifest(manifest)
+        if previous is not None and previous.get('blocks') and \
+           all(previous.get(key) == state[key] for key in ['url', 'size', 'segment_size', 'validator']):
+            for index, block_digest in previous['blocks'].items():
+                start, end = segment_list[int(index)]
+                if oz.ozutil.hash_fd_range(fd, start, end + 1 - start) == block_digest:
+                    state['blocks'][index] = block_digest
+                    progress['done'] += end + 1 - start
+            if show_progress:
+                logger.debug("Resuming download of %s at %dkB of %dkB", source, progress['done'] / 1024, file_size / 1024)
+        else:
+            # nothing we can reuse; start over from scratch
+            os.ftruncate(fd, 0)
+        segments = [seg for index, seg in enumerate(segments)
+                    if str(index) not in state['blocks']]
+        _write_download_manifest(manifest, state)
+
+    def _hash_completed_segments():
+        """
+        Feed all of the segments that are complete and in order to digest.
+        """
+        while progress['hashed'] < len(segment_list):
+            index = progress['hashed']
+            with lock:
+                if str(index) not in state['blocks']:
+                    return
+            start, end = segment_list[index]
+            oz.ozutil.hash_fd_range(fd, start, end + 1 - start, digest)
+            progress['hashed'] += 1
+
+    def _segment_worker():
+        """
+        Worker thread that takes segments off of the list and downloads them
+        until either the list is empty or another worker hit an error.
+        """
+        headers = {'Accept-Encoding': ''}
+        if validator is not None:
+            # if the file changed upstream since we started, the server will
+            # answer with the whole (new) file instead of a partial response
+            headers['If-Range'] = validator
+        requests_session = get_http_session()
+        while True:
+            with lock:
+                if errors or not segments:
+                    return
+                start, end = segments.pop(0)
+
+            try:
+                headers['Range'] = 'bytes=%d-%d' % (start, end)
+                response = requests_session.get(url, stream=True,
+                                                allow_redirects=True,
+                                                headers=headers,
+                                                timeout=60)
+                if response.status_code != 206:
+                    response.close()
+                    raise Exception("Expected a partial response for bytes %d-%d of %s, got HTTP %d" % (start, end, url, response.status_code))
+
+                segment_digest = hashlib.sha256()
+                offset = start
+                try:
+                    for chunk in response.iter_content(chunk_size):
+                        oz.ozutil.pwrite_bytes_to_fd(fd, chunk, offset)
+                        segment_digest.update(chunk)
+                        offset += len(chunk)
+                        with lock:
+                            progress['done'] += len(chunk)
+                            if show_progress and progress['done'] - progress['last'] >= 10 * 1024 * 1024:
+                                progress['last'] = progress['done']
+                                logger.debug("%dkB of %dkB", progress['done'] / 1024, file_size / 1024)
+                finally:
+                    response.close()
+
+                if offset != end + 1:
+                    raise Exception("Expected %d bytes for segment at %d of %s, got %d" % (end + 1 - start, start, url, offset - start))
+
+                with lock:
+                    state['blocks'][str(start // segment_size)] = segment_digest.hexdigest()
+                    if manifest is not None:
+                        _write_download_manifest(manifest, state)
+
+                # only one thread hashes at a time; anything that gets
+                # skipped here is picked up after all of the workers are
+                # done
+                if digest is not None and hash_lock.acquire(False):
+                    try:
+                        _hash_completed_segments()
+                    finally:
+                        hash_lock.release()
+            except Exception as err:  # pylint: disable=broad-except
+                with lock:
+                    errors.append(err)
+                return
+
+    threads = []
+    for i_unused in range(min(workers, len(segments))):
+        thread = threading.Thread(target=_segment_worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        if manifest is None:
+            # the segments that did complete are useless on their own, so
+            # make sure we don't leave a correctly sized but incomplete file
+            # behind
+            os.ftruncate(fd, 0)
+        raise errors[0]
+
+    if digest is not None:
+        _hash_completed_segments()
+
+    if manifest is not None:
+        os.unlink(manifest)
+
+    # leave the file offset where a sequential download would have
+    os.lseek(fd, file_size, os.SEEK_SET)
+
+
+def _file_url_to_path(url):
+    """
+    Internal function to convert a file:// URL to a local path.
+    """
+    path = urlparse.urlparse(url).path
+    if sys.version_info.major == 2:
+        return urllib.url2pathname(path)  # pylint: disable=no-member
+    return urllib.request.url2pathname(path)
+
+
+def _copy_local_file(url, fd, show_progress, logger, digest=None):
+    """
+    Internal function to copy the local file named by the file:// url to
+    file descriptor fd, at its current offset.  If fd refers to an empty file
+    on a filesystem that supports it, the file is reflinked rather than
+    copied; otherwise the data is copied inside of the kernel.  Either way
+    the data never passes through userspace, except to update digest (if it
+    is not None) from the page cache.
+    """
+    src_fd = os.open(_file_url_to_path(url), os.O_RDONLY)
+    try:
+        file_size = os.fstat(src_fd).st_size
+        start = os.lseek(fd, 0, os.SEEK_CUR)
+        if show_progress:
+            logger.debug("Copying %dkB from %s", file_size / 1024, url)
+        if start != 0 or os.fstat(fd).st_size != 0 or not oz.ozutil.reflink_fd(src_fd, fd):
+            oz.ozutil.copy_fd_range(src_fd, fd, 0, start, file_size)
+    finally:
+        os.close(src_fd)
+
+    if digest is not None:
+        oz.ozutil.hash_fd_range(fd, start, file_size, digest)
+
+    # leave the file offset where a sequential download would have
+    os.lseek(fd, start + file_size, os.SEEK_SET)
+
+
+class MultiDigest(object):
+    """
+    Class that looks like a hashlib object to http_download_file(), but
+    feeds the data to several of them, so that a download can be checked
+    against more than one kind of checksum without reading it twice.
+    """
+    def __init__(self, digests):
+        self.digests = digests
+
+    def update(self, data):
+        """
+        Method to feed data to all of the digests.
+        """
+        for digest in self.digests:
+            digest.update(data)
+
+    def hexdigest(self):
+        """
+        Method to return the hex digest of the first of the digests.
+        """
+        return self.digests[0].hexdigest()
+
+
+def http_download_file(url, fd, show_progress, logger, workers=1,
+                       manifest=None, digest=None):
+    """
+    Function to download a file from url to file descriptor fd.  If workers
+    is greater than 1 and the server advertises byte range support, the file
+    is fetched in segments over that many concurrent connections; otherwise
+    it is streamed over a single connection.  file:// URLs are reflinked or
+    copied inside of the kernel instead.
+
+    If manifest is not None, the download is made resumable: the progress is
+    recorded in the file named by manifest, and if that file is left over
+    from an earlier, interrupted download of the same URL, only the missing
+    parts are fetched.  The manifest is removed once the download completes.
+    If the server does not support byte ranges, fd is truncated and the file
+    is downloaded from the beginning.
+
+    If digest (a hashlib object, or a MultiDigest) is not None, it is updated
+    with the contents of the file while it is downloaded, so the caller does
+    not need to read the file back to checksum it.
+    """
+    if (workers > 1 or manifest is not None) and urlparse.urlparse(url).scheme in ('http', 'https'):
+        response = get_http_session().head(url, allow_redirects=True,
+                                           timeout=10)
+        content_length = response.headers.get('Content-Length')
+        if response.status_code == 200 and content_length is not None and \
+           response.headers.get('Accept-Ranges') == 'bytes':
+            # resolve any redirect once up-front, so that all of the segments
+            # come from the same mirror
+            if show_progress:
+                logger.debug("Downloading %s using %d connections", response.url, workers)
+            validator = response.headers.get('ETag')
+            if validator is None or validator.startswith('W/'):
+                # weak ETags can't be used with If-Range
+                validator = response.headers.get('Last-Modified')
+            _http_download_ranges(response.url, fd, int(content_length),
+                                  max(workers, 1), show_progress, logger,
+                                  manifest=manifest, source=url,
+                                  validator=validator, digest=digest)
+            return
+
+    if manifest is not None:
+        # we can't resume without byte ranges, so throw away anything we had
+        os.ftruncate(fd, 0)
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            os.unlink(manifest)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+    if urlparse.urlparse(url).scheme == 'file':
+        _copy_local_file(url, fd, show_progress, logger, digest)
+        return
+
+    _http_download_stream(url, fd, show_progress, logger, digest)
@@ -0,0 +1,236 @@
+# Copyright (C) 2010,2011  Chris Lalancette <clalance@redhat.com>
+# Copyright (C) 2012-2018  Chris Lalancette <clalancette@gmail.com>
+# Copyright (C) 2026  agent <agent@local>
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Reader for El Torito boot catalogs on ISO9660 images, and extraction of the
+boot images that they point to.
+"""
+
+import os
+import struct
+
+import oz.ISO9660
+import oz.OzException
+import oz.ozutil
+
+SECTOR_SIZE = oz.ISO9660.SECTOR_SIZE
+# the unit of the sector count in a boot entry
+VIRTUAL_SECTOR_SIZE = 512
+
+PLATFORM_X86 = 0x00
+PLATFORM_PPC = 0x01
+PLATFORM_MAC = 0x02
+PLATFORM_EFI = 0xef
+
+MEDIA_NO_EMULATION = 0
+MEDIA_FLOPPY_1_2 = 1
+MEDIA_FLOPPY_1_44 = 2
+MEDIA_FLOPPY_2_88 = 3
+MEDIA_HARD_DISK = 4
+
+_FLOPPY_SIZES = {
+    MEDIA_FLOPPY_1_2: 1200 * 1024,
+    MEDIA_FLOPPY_1_44: 1440 * 1024,
+    MEDIA_FLOPPY_2_88: 2880 * 1024,
+}
+
+_ENTRY_SIZE = 32
+_ENTRY_FMT = "<BBHBBHL20s"
+_SECTION_HEADER_FMT = "<BBH28s"
+_VALIDATION_FMT = "<BBH24sHBB"
+
+_HEADER_MORE = 0x90
+_HEADER_FINAL = 0x91
+_EXTENSION = 0x44
+
+
+def _checksum(data):
+    """
+    Function to compute the checksum of a validation entry.  Note that this
+    is *not* a 1's complement checksum; when an addition overflows, the
+    carry bit is discarded, not added to the end.
+    """
+    return sum(word for (word,) in struct.iter_unpack("<H", memoryview(data))) & 0xffff
+
+
+class BootEntry(object):
+    """
+    Class to hold one entry of an El Torito boot catalog.
+    """
+    def __init__(self, platform, bootable, media, load_segment, system_type,
+                 sector_count, load_rba, selection=b""):
+        # the platform of the section the entry is in
+        self.platform = platform
+        self.bootable = bootable
+        self.media = media
+        self.load_segment = load_segment
+        self.system_type = system_type
+        # in VIRTUAL_SECTOR_SIZE units
+        self.sector_count = sector_count
+        # in SECTOR_SIZE units
+        self.load_rba = load_rba
+        # the vendor unique selection criteria of a section entry
+        self.selection = selection
+        # the size of the boot image in bytes, filled in by BootCatalog
+        self.size = None
+
+
+class BootCatalog(oz.ISO9660.ImageFile):
+    """
+    Class to read the El Torito boot catalog of an ISO9660 image.  The
+    entries attribute is the list of all of the boot entries; the first one
+    is the initial/default entry, followed by the entries of every section
+    (such as the EFI one on UEFI bootable media) in order.
+    """
+    def __init__(self, path):
+        self.entries = []
+        self.id_string = None
+        self.platform = None
+        oz.ISO9660.ImageFile.__init__(self, path)
+
+    def _parse(self):
+        self._read_catalog()
+
+    def _find_catalog(self):
+        """
+        Internal method to find the boot record volume descriptor, and return
+        the sector of the boot catalog that it points to.
+        """
+        sector = 16
+        while True:
+            desc = self._read(sector * SECTOR_SIZE, SECTOR_SIZE)
+            (desc_type, identifier, version, system) = struct.unpack_from("=B5sB32s", desc)
+            if identifier != b"CD001":
+                raise oz.OzException.OzException("%s is not an ISO9660 image" % (self.path))
+            if desc_type == 255:
+                raise oz.OzException.OzException("%s is not bootable; there is no El Torito boot record" % (self.path))
+            if desc_type == 0:
+                if version != 1 or system.rstrip(b"\0") != b"EL TORITO SPECIFICATION":
+                    raise oz.OzException.OzException("invalid CD torito specification")
+                return struct.unpack_from("<L", desc, 71)[0]
+            sector += 1
+
+    def _read_catalog(self):
+        """
+        Internal method to parse the boot catalog into the entries list.
+        """
+        catalog_offset = self._find_catalog() * SECTOR_SIZE
+        catalog = bytearray(self._read(catalog_offset, SECTOR_SIZE))
+
+        validation = bytes(catalog[:_ENTRY_SIZE])
+        (header, platform, unused, self.id_string, checksum_unused, key55,
+         keyaa) = struct.unpack(_VALIDATION_FMT, validation)
+        if header != 0x1:
+            raise oz.OzException.OzException("invalid CD boot sector header")
+        if unused != 0x0:
+            raise oz.OzException.OzException("invalid CD unused boot sector field")
+        if key55 != 0x55 or keyaa != 0xaa:
+            raise oz.OzException.OzException("invalid CD boot sector footer")
+        csum = _checksum(validation)
+        if csum != 0:
+            raise oz.OzException.OzException("invalid CD checksum: expected 0, saw %d" % (csum))
+        self.platform = platform
+
+        def _entry(pos):
+            """
+            Method to return the raw 32-byte catalog entry at pos, reading
+            more of the catalog if it spans more than one sector.
+            """
+            while pos + _ENTRY_SIZE > len(catalog):
+                catalog.extend(self._read(catalog_offset + len(catalog), SECTOR_SIZE))
+            return bytes(catalog[pos:pos + _ENTRY_SIZE])
+
+        (indicator, media, load_segment, system_type, unused, sector_count,
+         load_rba, selection_unused) = struct.unpack(_ENTRY_FMT, _entry(_ENTRY_SIZE))
+        if indicator != 0x88:
+            raise oz.OzException.OzException("invalid CD initial boot indicator")
+        self.entries = [BootEntry(platform, True, media, load_segment,
+                                  system_type, sector_count, load_rba)]
+
+        pos = 2 * _ENTRY_SIZE
+        indicator = _HEADER_MORE
+        while indicator == _HEADER_MORE:
+            (indicator, platform, count, id_unused) = struct.unpack(_SECTION_HEADER_FMT, _entry(pos))
+            if indicator not in (_HEADER_MORE, _HEADER_FINAL):
+                # no (more) sections
+                break
+            pos += _ENTRY_SIZE
+            for i_unused in range(count):
+                (boot, media, load_segment, system_type, unused, sector_count,
+                 load_rba, selection) = struct.unpack(_ENTRY_FMT, _entry(pos))
+                pos += _ENTRY_SIZE
+                self.entries.append(BootEntry(platform, boot == 0x88,
+                                              media & 0x0f, load_segment,
+                                              system_type, sector_count,
+                                              load_rba, selection))
+                if media & 0x20:
+                    # followed by extension entries with more selection
+                    # criteria, which we don't need
+                    while struct.unpack_from("=B", _entry(pos))[0] == _EXTENSION:
+                        extension = _entry(pos)
+                        pos += _ENTRY_SIZE
+                        if not struct.unpack_from("=B", extension, 1)[0] & 0x20:
+                            break
+
+        for entry in self.entries:
+            entry.size = self._entry_size(entry)
+
+    def _entry_size(self, entry):
+        """
+        Internal method to work out the size of the boot image of entry.
+        """
+        if entry.media in _FLOPPY_SIZES:
+            return _FLOPPY_SIZES[entry.media]
+        if entry.media not in (MEDIA_NO_EMULATION, MEDIA_HARD_DISK):
+            raise oz.OzException.OzException("invalid CD media type")
+
+        size = entry.sector_count * VIRTUAL_SECTOR_SIZE
+        if entry.platform == PLATFORM_EFI and entry.sector_count <= 1:
+            # EFI images are usually too big for the 16-bit sector count,
+            # which is then left at 0 or 1; the real size is in the FAT
+            # boot sector of the image
+            boot = self._read(entry.load_rba * SECTOR_SIZE, VIRTUAL_SECTOR_SIZE)
+            if boot[510:512] == b"\x55\xaa":
+                (bytes_per_sector, total16) = struct.unpack_from("<H6xH", boot, 11)
+                total32 = struct.unpack_from("<L", boot, 32)[0]
+                fat_size = bytes_per_sector * (total16 or total32)
+                if fat_size:
+                    size = fat_size
+        return size
+
+    def find(self, platform):
+        """
+        Method to return the first entry for platform, or None if there is no
+        such entry.
+        """
+        for entry in self.entries:
+            if entry.platform == platform:
+                return entry
+        return None
+
+    def extract(self, entry, outfile):
+        """
+        Method to write the boot image of entry to outfile.  The data is
+        copied straight from the image inside of the kernel.
+        """
+        fd = os.open(outfile, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            oz.ozutil.copy_fd_range(self.fd, fd, entry.load_rba * SECTOR_SIZE,
+                                    0, entry.size)
+        finally:
+            os.close(fd)
@@ -85,6 +85,12 @@ class FreeBSD(oz.Guest.CDGuest):
                                            self.iso_contents],
                                           printfn=self.log.debug)
 
+    def _iso_overlay_paths(self, iso):
+        """
+        Method to return the paths on the ISO that FreeBSD guests modify.
+        """
+        return ["etc/installerconfig", "boot/loader.conf"]
+
     def _modify_iso(self):
         """
         Method to make the boot ISO auto-boot with appropriate parameters.
@@ -19,19 +19,14 @@
 Main class for guest installation
 """
 
-import base64
 import errno
-import hashlib
 import logging
 import monotonic
 import os
 import re
 import shutil
 import socket
-import stat
 import struct
-import subprocess
-import tempfile
 import time
 try:
     import urllib.parse as urlparse
@@ -42,18 +37,24 @@ import uuid
 from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 
-import guestfs
-
 import libvirt
 
 import lxml.etree
 
+import oz.AsyncGuest
+import oz.DomainEvents
+import oz.DomainStats
+import oz.Download
+import oz.ElTorito
 import oz.GuestFSManager
+import oz.ISO9660
+import oz.ISOTree
+import oz.Media
 import oz.OzException
 import oz.ozutil
 
 
-class Guest(object):
+class Guest(oz.AsyncGuest.AsyncGuestMixin):
     """
     Main class for guest installation.
     """
@@ -126,7 +127,7 @@ class Guest(object):
             pass
 
         libvirt.registerErrorHandler(_libvirt_error_handler, 'context')
-        self.libvirt_conn = libvirt.open(self.libvirt_uri)
+        self.libvirt_conn = oz.DomainEvents.open_connection(self.libvirt_uri)
         self._discover_libvirt_bridge()
         self._discover_libvirt_type()
 
@@ -202,11 +203,15 @@ class Guest(object):
         self.cache_modified_media = oz.ozutil.config_get_boolean_key(config,
                                                                      'cache',
                                                                      'modified_media',
-                                                                     False)
+                                                                     True)
         self.cache_jeos = oz.ozutil.config_get_boolean_key(config, 'cache',
                                                            'jeos', False)
 
-        self.jeos_cache_dir = os.path.join(self.data_dir, "jeos")
+        self._read_jeos_config(config)
+
+        # configuration from 'download' section
+        self.media = oz.Media.MediaCache(self.tdl, self.data_dir,
+                                         oz.Download.configure_from_config(config))
 
         # configuration of "safe" ICICLE generation option
         self.safe_icicle_gen = oz.ozutil.config_get_boolean_key(config,
@@ -251,6 +256,10 @@ class Guest(object):
 
         self.console_listen_port = oz.ozutil.get_free_port()
 
+        # the event loop of the async_* method running a step of this build,
+        # if any
+        self.async_loop = None
+
         self.connect_to_libvirt()
 
         self.nicmodel = nicmodel
@@ -297,6 +306,8 @@ class Guest(object):
         self.auto = auto
         if self.auto is None:
             self.auto = self.get_auto_path()
+        # the key of the inputs to the modified media, computed on first use
+        self._media_key = None
 
         self.log.debug("Name: %s, UUID: %s", self.tdl.name, self.uuid)
         self.log.debug("MAC: %s, distro: %s", self.macaddr, self.tdl.distro)
@@ -378,6 +389,67 @@ class Guest(object):
         if os.access(self.diskimage, os.F_OK):
             raise oz.OzException.OzException("Diskimage %s already exists" % (self.diskimage))
 
+    def _read_jeos_config(self, config):
+        """
+        Internal method to read how the cached JEOS is used from the 'cache'
+        section of the configuration.
+        """
+        self.jeos_cache_dir = os.path.join(self.data_dir, "jeos")
+        self.jeos_mode = oz.ozutil.config_get_key(config, 'cache', 'jeos_mode',
+                                                  'copy')
+        if self.jeos_mode not in ('copy', 'overlay'):
+            raise oz.OzException.OzException("Invalid JEOS mode '%s', must be 'copy' or 'overlay'" % (self.jeos_mode))
+        self.jeos_flatten = oz.ozutil.config_get_boolean_key(config, 'cache',
+                                                             'jeos_flatten',
+                                                             False)
+        # whether self.diskimage is currently a qcow2 overlay on the JEOS
+        self.jeos_overlay = False
+
+    def _space_plan(self, force_download):
+        """
+        Method to work out the disk space the build will need, as a list of
+        (step, directory, bytes, sparse) tuples.  Steps that are sparse only
+        need their full size in the worst case, when the guest fills up its
+        disk.  Subclasses that generate install media add their own steps.
+        """
+        plan = []
+        diskdir = os.path.dirname(self.diskimage)
+        if not force_download and os.access(self.jeos_filename, os.F_OK):
+            size = 0
+            if self.jeos_mode != 'overlay' or self.image_type != 'qcow2':
+                size = os.stat(self.jeos_filename).st_blocks * 512
+            plan.append(("restore JEOS", diskdir, size, False))
+        else:
+            size = int(self.disksize)
+            plan.append(("disk image", diskdir, size, True))
+            if self.cache_jeos:
+                plan.append(("JEOS cache", self.jeos_cache_dir, size, True))
+
+        # a screenshot is taken if the install fails
+        plan.append(("screenshot", self.screenshot_dir, 4 * 1024 * 1024, False))
+
+        return plan
+
+    def check_space(self, force_download=False):
+        """
+        Method to check that there is enough disk space for the build before
+        any of it is started.  The plan of the space each step needs is
+        logged, and an exception is raised if a filesystem doesn't have
+        enough room for the steps that will certainly use it; if there is
+        only not enough room for disk images to fill up, a warning is
+        logged.  The force_download parameter has the same meaning as for
+        generate_install_media().  Returns the plan, as a list of (step,
+        directory, bytes, sparse) tuples.
+        """
+        plan = self._space_plan(force_download)
+
+        self.log.info("Disk space plan for %s:", self.tdl.name)
+        short = oz.ozutil.check_space_plan(plan, self.log)
+        if short:
+            raise oz.OzException.OzException("Not enough disk space for %s on %s" % (self.tdl.name, ", ".join(short)))
+
+        return plan
+
     # the next 4 methods are intended to be overridden by the individual
     # OS backends; raise an error if they are called but not implemented
 
@@ -389,6 +461,20 @@ class Guest(object):
         """
         raise oz.OzException.OzException("Install media for %s%s is not implemented, install cannot continue" % (self.tdl.distro, self.tdl.update))
 
+    def install(self, timeout=None, force=False):
+        """
+        Base method for running the operating system installation.  This is
+        expected to be overridden by all subclasses.
+        """
+        raise oz.OzException.OzException("Install for %s%s is not implemented" % (self.tdl.distro, self.tdl.update))
+
+    def cleanup_install(self):
+        """
+        Base method for cleaning up any transient install data.  This is
+        expected to be overridden by all subclasses.
+        """
+        raise oz.OzException.OzException("Install cleanup for %s%s is not implemented" % (self.tdl.distro, self.tdl.update))
+
     def customize(self, libvirt_xml):
         """
         Base method for customizing the operating system.  This is expected
@@ -732,6 +818,39 @@ class Guest(object):
         """
         return self._internal_generate_diskimage(size, force, False)
 
+    def _restore_jeos(self):
+        """
+        Internal method to create the diskimage from the cached JEOS.  In
+        'overlay' JEOS mode, the diskimage is a thin qcow2 overlay backed by
+        the cached JEOS; otherwise the JEOS is copied.
+        """
+        if self.jeos_mode == 'overlay':
+            if self.image_type == 'qcow2':
+                self.log.info("Creating overlay on cached JEOS (%s)", self.jeos_filename)
+                self._internal_generate_diskimage(force=True,
+                                                  backing_filename=self.jeos_filename)
+                self.jeos_overlay = True
+                return
+            self.log.warning("JEOS overlays require the qcow2 image type, copying the JEOS instead")
+
+        oz.ozutil.copyfile_sparse(self.jeos_filename, self.diskimage)
+
+    def flatten_diskimage(self):
+        """
+        Method to turn a diskimage that is an overlay on the cached JEOS (see
+        the jeos_mode option) into a standalone image, so that it no longer
+        depends on the JEOS cache.  If the diskimage is not an overlay, this
+        does nothing.
+        """
+        if not self.jeos_overlay:
+            return
+
+        self.log.info("Flattening diskimage %s", self.diskimage)
+        oz.ozutil.subprocess_check_output(["qemu-img", "rebase", "-f", "qcow2",
+                                           "-b", "", self.diskimage],
+                                          printfn=self.log.debug)
+        self.jeos_overlay = False
+
     def _get_disks_and_interfaces(self, libvirt_xml):
         """
         Method to figure out the disks and interfaces attached to a domain.
@@ -764,41 +883,43 @@ class Guest(object):
 
         return disks, interfaces
 
-    def _get_disk_and_net_activity(self, libvirt_dom, disks, interfaces):
-        """
-        Method to collect the disk and network activity by the domain.  The
-        method returns two numbers: the first is the sum of all disk activity
-        from all disks, and the second is the sum of all network traffic from
-        all network devices.
-        """
-        total_disk_req = 0
-        for dev in disks:
-            rd_req, rd_bytes, wr_req, wr_bytes, errs = libvirt_dom.blockStats(dev)
-            total_disk_req += rd_req + wr_req
-
-        total_net_bytes = 0
-        for dev in interfaces:
-            rx_bytes, rx_packets, rx_errs, rx_drop, tx_bytes, tx_packets, tx_errs, tx_drop = libvirt_dom.interfaceStats(dev)
-            total_net_bytes += rx_bytes + tx_bytes
-
-        return total_disk_req, total_net_bytes
-
     def _wait_for_install_finish(self, xml, max_time):
         """
         Method to wait for an installation to finish.  This will wait around
         until either the VM has gone away (at which point it is assumed the
         install was successful), or until the timeout is reached (at which
         point it is assumed the install failed and raise an exception).
-        """
+        The VM going away is noticed through libvirt lifecycle events where
+        possible; the disk and network statistics are only sampled for the
+        inactivity timeout, and as a fallback for when events aren't
+        available.  When called from a step run by one of the async_*
+        methods, the wait itself is done on the event loop.
+        """
+        if self.async_loop is not None:
+            self._wait_on_loop(self._async_wait_for_install_finish(xml, max_time))
+            return
 
         libvirt_dom = self.libvirt_conn.createXML(xml, 0)
+        sampler = oz.DomainStats.get_sampler(self.libvirt_conn)
+        sampler.register(libvirt_dom)
+        try:
+            with oz.DomainEvents.DomainWatcher(self.libvirt_conn, libvirt_dom) as watcher:
+                self._wait_for_install_finish_events(libvirt_dom, max_time, watcher)
+        finally:
+            sampler.unregister(libvirt_dom)
+
+    def _wait_for_install_finish_events(self, libvirt_dom, max_time, watcher):
+        """
+        Internal method to wait for the running installation in libvirt_dom to
+        finish, with watcher (an oz.DomainEvents.DomainWatcher) watching the
+        domain.
+        """
 
         disks, interfaces = self._get_disks_and_interfaces(libvirt_dom.XMLDesc(0))
 
-        self.last_disk_activity = 0
-        self.last_network_activity = 0
-        self.inactivity_countdown = self.inactivity_timeout
-        self.saved_exception = None
+        activity = oz.DomainStats.InstallActivity(self.libvirt_conn, libvirt_dom,
+                                                  disks, interfaces,
+                                                  self.inactivity_timeout)
         if self.has_consolelog:
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.sock.settimeout(1)
@@ -808,41 +929,8 @@ class Guest(object):
             '''
             A callback for _looper to deal with waiting for a guest to finish installing.
             '''
-            if self.inactivity_countdown <= 0:
+            if activity.check():
                 return True
-            try:
-                total_disk_req, total_net_bytes = self._get_disk_and_net_activity(libvirt_dom, disks, interfaces)
-            except libvirt.libvirtError as e:
-                # we save the exception here because we want to raise it later
-                # if this was a "real" exception
-                self.saved_exception = e
-                return True
-
-            # rd_req and wr_req are the *total* number of disk read requests and
-            # write requests ever made for this domain.  Similarly rd_bytes and
-            # wr_bytes are the total number of network bytes read or written
-            # for this domain
-
-            # we define activity as having done a read or write request on the
-            # install disk, or having done at least 4KB of network transfers in
-            # the last second.  The thinking is that if the installer is putting
-            # bits on disk, there will be disk activity, so we should keep
-            # waiting.  On the other hand, the installer might be downloading
-            # bits to eventually install on disk, so we look for network
-            # activity as well.  We say that transfers of at least 4KB must be
-            # made, however, to try to reduce false positives from things like
-            # ARP requests
-
-            if (total_disk_req == self.last_disk_activity) and (total_net_bytes < (self.last_network_activity + 4096)):
-                # if we saw no read or write requests since the last iteration,
-                # decrement our activity timer
-                self.inactivity_countdown -= 1
-            else:
-                # if we did see some activity, then we can reset the timer
-                self.inactivity_countdown = self.inactivity_timeout
-
-            self.last_disk_activity = total_disk_req
-            self.last_network_activity = total_net_bytes
 
             if self.has_consolelog:
                 try:
@@ -858,37 +946,37 @@ class Guest(object):
 
             return False
 
-        finished = oz.ozutil.timed_loop(max_time, _finish_cb, "Waiting for %s to finish installing" % (self.tdl.name), self)
+        finished = oz.ozutil.timed_loop(max_time, _finish_cb, "Waiting for %s to finish installing" % (self.tdl.name), self,
+                                        watcher.stopped)
+
+        self._check_install_finished(libvirt_dom, finished, watcher, activity)
 
+    def _check_install_finished(self, libvirt_dom, finished, watcher, activity):
+        """
+        Internal method to sort out why waiting for the installation in
+        libvirt_dom ended (finished is what the wait returned, and activity
+        the oz.DomainStats.InstallActivity that tracked it), and raise an
+        exception if the installation failed.
+        """
         # We get here because of a libvirt exception, an absolute timeout, or
         # an I/O timeout; we sort this out below
         if not finished:
             # if we timed out, then let's make sure to take a screenshot.
             screenshot_text = self._capture_screenshot(libvirt_dom)
             raise oz.OzException.OzException("Timed out waiting for install to finish.  %s" % (screenshot_text))
-        elif self.inactivity_countdown <= 0:
+        elif activity.countdown <= 0:
             # if we saw no disk or network activity in the countdown window,
             # we presume the install has hung.  Fail here
             screenshot_text = self._capture_screenshot(libvirt_dom)
             raise oz.OzException.OzException("No disk activity in %d seconds, failing.  %s" % (self.inactivity_timeout, screenshot_text))
 
+        if watcher.stopped.is_set():
+            self.log.info("Install of %s succeeded", self.tdl.name)
+            return
+
         # We get here only if we got a libvirt exception
         if not self._wait_for_guest_shutdown(libvirt_dom):
-            if self.saved_exception is not None:
-                self.log.debug("Libvirt Domain Info Failed:")
-                self.log.debug(" code is %d", self.saved_exception.get_error_code())
-                self.log.debug(" domain is %d", self.saved_exception.get_error_domain())
-                self.log.debug(" message is %s", self.saved_exception.get_error_message())
-                self.log.debug(" level is %d", self.saved_exception.get_error_level())
-                self.log.debug(" str1 is %s", self.saved_exception.get_str1())
-                self.log.debug(" str2 is %s", self.saved_exception.get_str2())
-                self.log.debug(" str3 is %s", self.saved_exception.get_str3())
-                self.log.debug(" int1 is %d", self.saved_exception.get_int1())
-                self.log.debug(" int2 is %d", self.saved_exception.get_int2())
-                raise self.saved_exception
-            else:
-                # the passed in exception was None, just raise a generic error
-                raise oz.OzException.OzException("Unknown libvirt error")
+            activity.raise_error(self.log)
 
         self.log.info("Install of %s succeeded", self.tdl.name)
 
@@ -896,127 +984,34 @@ class Guest(object):
         """
         Method to wait around for orderly shutdown of a running guest.  Returns
         True if the guest shutdown in the specified time, False otherwise.
+        When called from a step run by one of the async_* methods, the wait
+        itself is done on the event loop.
         """
+        if self.async_loop is not None:
+            return self._wait_on_loop(self._async_wait_for_guest_shutdown(libvirt_dom))
 
         def _shutdown_cb(self):
             '''
             The _looper callback to wait for the guest to shutdown.
             '''
-            try:
-                libvirt_dom.info()
-            except libvirt.libvirtError as e:
-                if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
-                    # Here, the guest really, truly went away cleanly.  Thus, we know this
-                    # loop has successfully completed, and we can return True.
-                    return True
-
-                # In all other cases, we got some kind of exception we didn't understand.
-                # Fall through to the False return, and if we don't eventually see the
-                # VIR_ERR_NO_DOMAIN, we'll return False to the caller.
-
-            return False
+            return oz.DomainEvents.domain_gone(libvirt_dom)
 
-        return oz.ozutil.timed_loop(self.shutdown_timeout, _shutdown_cb, "Waiting for %s to finish shutdown" % (self.tdl.name), self)
+        with oz.DomainEvents.DomainWatcher(self.libvirt_conn, libvirt_dom) as watcher:
+            return oz.ozutil.timed_loop(self.shutdown_timeout, _shutdown_cb, "Waiting for %s to finish shutdown" % (self.tdl.name), self,
+                                        watcher.stopped)
 
-    def _get_csums(self, original_url, outdir, outputfd):
+    def _modified_media_cache_path(self, cache):
         """
-        Internal method to fetch the checksum file and compute the checksum
-        on the downloaded data.
+        Internal method to turn the base name of a modified media cache file
+        into the path of the cached media for the current inputs.  Returns
+        None if the modified media can't be cached.
         """
-        if self.tdl.iso_md5_url:
-            url = self.tdl.iso_md5_url
-            hashname = 'md5'
-        elif self.tdl.iso_sha1_url:
-            url = self.tdl.iso_sha1_url
-            hashname = 'sha1'
-        elif self.tdl.iso_sha256_url:
-            url = self.tdl.iso_sha256_url
-            hashname = 'sha256'
-        else:
-            return True
-
-        originalname = os.path.basename(urlparse.urlparse(original_url)[2])
-
-        csumname = os.path.join(outdir,
-                                self.tdl.distro + self.tdl.update + self.tdl.arch + "-CHECKSUM")
-
-        (csumfd, outdir) = oz.ozutil.open_locked_file(csumname)
-
-        os.ftruncate(csumfd, 0)
-
-        try:
-            self.log.debug("Checksum requested, fetching %s file", hashname)
-            oz.ozutil.http_download_file(url, csumfd, False, self.log)
-        finally:
-            os.close(csumfd)
-
-        upstream_sum = getattr(oz.ozutil,
-                               'get_' + hashname + 'sum_from_file')(csumname, originalname)
-
-        os.unlink(csumname)
-
-        if not upstream_sum:
-            raise oz.OzException.OzException("Could not find checksum for original file " + originalname)
-
-        self.log.debug("Calculating checksum of downloaded file")
-        os.lseek(outputfd, 0, os.SEEK_SET)
-
-        local_sum = getattr(hashlib, hashname)()
-
-        buf = oz.ozutil.read_bytes_from_fd(outputfd, 4096)
-        while buf != '':
-            local_sum.update(buf)
-            buf = oz.ozutil.read_bytes_from_fd(outputfd, 4096)
-
-        return local_sum.hexdigest() == upstream_sum
-
-    def _get_original_media(self, url, fd, outdir, force_download):
-        """
-        Method to fetch the original media from url.  If the media is already
-        cached locally, the cached copy will be used instead.
-        """
-        self.log.info("Fetching the original media")
-
-        info = oz.ozutil.http_get_header(url)
-
-        if 'HTTP-Code' not in info or int(info['HTTP-Code']) >= 400 or 'Content-Length' not in info or int(info['Content-Length']) < 0:
-            raise oz.OzException.OzException("Could not reach %s to fetch boot media: %r" % (url, info))
-
-        content_length = int(info['Content-Length'])
-
-        if content_length == 0:
-            raise oz.OzException.OzException("Install media of 0 size detected, something is wrong")
-
-        if not force_download:
-            if content_length == os.fstat(fd)[stat.ST_SIZE]:
-                if self._get_csums(url, outdir, fd):
-                    self.log.info("Original install media available, using cached version")
-                    return
-
-                self.log.info("Original available, but checksum mis-match; re-downloading")
-
-        # before fetching everything, make sure that we have enough
-        # space on the filesystem to store the data we are about to download
-        devdata = os.statvfs(outdir)
-        if (devdata.f_bsize * devdata.f_bavail) < content_length:
-            raise oz.OzException.OzException("Not enough room on %s for install media" % (outdir))
-
-        # at this point we know we are going to download something.  Make
-        # sure to truncate the file so no stale data is left on the end
-        os.ftruncate(fd, 0)
-
-        self.log.info("Fetching the original install media from %s", url)
-        oz.ozutil.http_download_file(url, fd, True, self.log)
-
-        filesize = os.fstat(fd)[stat.ST_SIZE]
-
-        if filesize != content_length:
-            # if the length we downloaded is not the same as what we
-            # originally saw from the headers, something went wrong
-            raise oz.OzException.OzException("Expected to download %d bytes, downloaded %d" % (content_length, filesize))
-
-        if not self._get_csums(url, outdir, fd):
-            raise oz.OzException.OzException("Checksum for downloaded file does not match!")
+        if self._media_key is None:
+            self._media_key = oz.Media.modified_media_key(self)
+        if self._media_key is None:
+            return None
+        root, ext = os.path.splitext(cache)
+        return "%s-%s%s" % (root, self._media_key[:16], ext)
 
     def _capture_screenshot(self, libvirt_dom):
         """
@@ -1134,13 +1129,65 @@ class Guest(object):
         self.log.debug("Generated XML:\n%s", xml)
         return xml
 
+    def _check_announce(self, libvirt_dom, boot_deadline):
+        """
+        Internal method to check whether the data the guest sent so far
+        (in self.data) is its announcement.  Returns True once it is (with
+        the IP address of the guest in self.addr), and False if we have to
+        keep waiting.
+        """
+        # OK, we got data back from the socket.  Check to see if it is
+        # is what we expect; essentially, some up-front garbage,
+        # followed by a !<ip>,<uuid>!
+        # Exclude ! from the wildcard to avoid errors when receiving two
+        # announce messages in the same string
+        match = re.search(b"!([^!]*?,[^!]*?)!$", self.data)
+        if match is not None:
+            if len(match.groups()) != 1:
+                raise oz.OzException.OzException("Guest checked in with no data")
+            split = match.group(1).split(b',')
+            if len(split) != 2:
+                raise oz.OzException.OzException("Guest checked in with bogus data")
+            self.addr = split[0]
+            uuidstr = split[1]
+            try:
+                # use socket.inet_aton() to validate the IP address
+                socket.inet_aton(self.addr.decode('utf-8'))
+            except socket.error:
+                # Getting address can be slower than first report, so it is worth
+                # to try few more times before giving up. Cron should send announce
+                # every minute, so three minutes should be enough to confirm.
+                if monotonic.monotonic() < boot_deadline:
+                    # if the data we got didn't match, we need to continue waiting.
+                    # before going to sleep, make sure that the domain is still
+                    # around
+                    libvirt_dom.info()
+                    return False
+                raise oz.OzException.OzException("Guest checked in with invalid IP address")
+
+            if uuidstr.decode('utf-8') != str(self.uuid):
+                raise oz.OzException.OzException("Guest checked in with unknown UUID")
+            return True
+
+        # if the data we got didn't match, we need to continue waiting.
+        # before going to sleep, make sure that the domain is still
+        # around
+        libvirt_dom.info()
+
+        return False
+
     def _wait_for_guest_boot(self, libvirt_dom):
         """
         Method to wait around for a guest to boot.  Orderly guests will boot
         up and announce their presence via a TCP message; if that happens within
         the timeout, this method returns the IP address of the guest.  If that
-        doesn't happen an exception is raised.
+        doesn't happen an exception is raised.  When called from a step run
+        by one of the async_* methods, the wait itself is done on the event
+        loop.
         """
+        if self.async_loop is not None:
+            return self._wait_on_loop(self._async_wait_for_guest_boot(libvirt_dom))
+
         self.log.info("Waiting for guest %s to boot", self.tdl.name)
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -1168,51 +1215,20 @@ class Guest(object):
                     # through to the below code because it is a noop.
                     pass
 
-                # OK, we got data back from the socket.  Check to see if it is
-                # is what we expect; essentially, some up-front garbage,
-                # followed by a !<ip>,<uuid>!
-                # Exclude ! from the wildcard to avoid errors when receiving two
-                # announce messages in the same string
-                match = re.search(b"!([^!]*?,[^!]*?)!$", self.data)
-                if match is not None:
-                    if len(match.groups()) != 1:
-                        raise oz.OzException.OzException("Guest checked in with no data")
-                    split = match.group(1).split(b',')
-                    if len(split) != 2:
-                        raise oz.OzException.OzException("Guest checked in with bogus data")
-                    self.addr = split[0]
-                    uuidstr = split[1]
-                    try:
-                        # use socket.inet_aton() to validate the IP address
-                        socket.inet_aton(self.addr.decode('utf-8'))
-                    except socket.error:
-                        # Getting address can be slower than first report, so it is worth
-                        # to try few more times before giving up. Cron should send announce
-                        # every minute, so three minutes should be enough to confirm.
-                        if monotonic.monotonic() < boot_deadline:
-                            # if the data we got didn't match, we need to continue waiting.
-                            # before going to sleep, make sure that the domain is still
-                            # around
-                            libvirt_dom.info()
-                            return False
-                        raise oz.OzException.OzException("Guest checked in with invalid IP address")
-
-                    if uuidstr.decode('utf-8') != str(self.uuid):
-                        raise oz.OzException.OzException("Guest checked in with unknown UUID")
-                    return True
-
-                # if the data we got didn't match, we need to continue waiting.
-                # before going to sleep, make sure that the domain is still
-                # around
-                libvirt_dom.info()
-
-                return False
+                return self._check_announce(libvirt_dom, boot_deadline)
 
             oz.ozutil.timed_loop(self.boot_timeout, _boot_cb, "Waiting for %s to finish boot" % (self.tdl.name), self)
 
         finally:
             self.sock.close()
 
+        return self._guest_booted()
+
+    def _guest_booted(self):
+        """
+        Internal method to return the IP address the guest announced, or
+        raise an exception if it never did.
+        """
         if self.addr is None:
             raise oz.OzException.OzException("Timed out waiting for guest to boot")
 
@@ -1358,6 +1374,22 @@ class CDGuest(Guest):
         self.output_floppy = os.path.join(self.output_dir,
                                           self.tdl.name + "-" + self.tdl.installtype + "-oz.img")
 
+        # configuration from 'iso' section
+        self.iso_build_mode = oz.ozutil.config_get_key(config, 'iso',
+                                                       'build_mode', 'auto')
+        if self.iso_build_mode not in ('auto', 'extract', 'overlay', 'stream'):
+            raise oz.OzException.OzException("Invalid ISO build mode '%s', must be 'auto', 'extract', 'overlay' or 'stream'" % (self.iso_build_mode))
+        # whether iso_contents only holds the overlay for the current build,
+        # and the paths on the ISO that make up that overlay
+        self.iso_overlay = False
+        self.iso_overlay_paths = []
+        # whether the overlay is patched straight into a copy of the original
+        # ISO, rather than handed to xorriso
+        self.iso_stream = False
+        # the state of a fully extracted tree before it was modified, to find
+        # the files that have to be written to the new ISO
+        self.iso_contents_snapshot = None
+
         self.log.debug("Original ISO path: %s", self.orig_iso)
         self.log.debug("Modified ISO cache: %s", self.modified_iso_cache)
         self.log.debug("Output ISO path: %s", self.output_iso)
@@ -1367,90 +1399,162 @@ class CDGuest(Guest):
         """
         Method to fetch the original ISO for an operating system.
         """
-        self._get_original_media(isourl, fd, outdir, force_download)
+        self.media.get_original_media(isourl, fd, outdir, force_download,
+                                      self.orig_iso)
 
-    def _copy_iso(self):
+    def _iso_overlay_paths(self, iso):  # pylint: disable=unused-argument
         """
-        Method to copy the data out of an ISO onto the local filesystem.
+        Base method to return the list of paths on the ISO (relative to its
+        root) that _modify_iso() needs to read or modify, given the original
+        ISO opened with oz.ISO9660.  When the ISO is built as an overlay,
+        only these paths are extracted, and everything else is taken
+        straight from the original ISO when the new one is built.  Paths
+        that are only checked for existence should be checked with
+        _iso_exists() or _iso_isdir() instead of being listed here.  In the
+        common case, return an empty list, which means the whole ISO has to
+        be extracted; subclasses that know what they touch will override
+        this.
         """
-        self.log.info("Copying ISO contents for modification")
-        try:
-            shutil.rmtree(self.iso_contents)
-        except OSError as err:
-            if err.errno != errno.ENOENT:
-                raise
-        os.makedirs(self.iso_contents)
-
-        self.log.info("Setting up guestfs handle for %s", self.tdl.name)
-        gfs = guestfs.GuestFS()
-        self.log.debug("Adding ISO image %s", self.orig_iso)
-        gfs.add_drive_opts(self.orig_iso, readonly=1, format='raw')
-        self.log.debug("Launching guestfs")
-        gfs.launch()
-        try:
-            self.log.debug("Mounting ISO")
-            gfs.mount_options('ro', "/dev/sda", "/")
-
-            self.log.debug("Checking if there is enough space on the filesystem")
-            isostat = gfs.statvfs("/")
-            outputstat = os.statvfs(self.iso_contents)
-            if (outputstat.f_bsize * outputstat.f_bavail) < (isostat['blocks'] * isostat['bsize']):
-                raise oz.OzException.OzException("Not enough room on %s to extract install media" % (self.iso_contents))
-
-            self.log.debug("Extracting ISO contents")
-            current = os.getcwd()
-            os.chdir(self.iso_contents)
+        return []
+
+    def _use_iso_overlay(self):
+        """
+        Method to decide whether this build can use an ISO overlay, and if
+        so, to set iso_overlay_paths and whether the overlay is streamed into
+        a copy of the original ISO (iso_stream) or built with xorriso.
+        """
+        self.iso_stream = False
+        if self.iso_build_mode == 'extract':
+            return False
+
+        # in 'auto' mode, falling back to a full extraction is expected
+        fallback_log = self.log.debug
+        if self.iso_build_mode in ('overlay', 'stream'):
+            fallback_log = self.log.warning
+
+        paths = self._original_iso_overlay_paths(fallback_log)
+        if not paths:
+            return False
+
+        if self.iso_build_mode != 'stream':
+            # streaming patches the directory records of the original media
+            # in place, so it is never picked automatically
             try:
-                rd, wr = os.pipe()
+                oz.ozutil.executable_exists('xorriso')
+            except Exception:
+                fallback_log("ISO overlays require xorriso, extracting the whole ISO")
+                return False
+        elif self.tdl.isoextras:
+            fallback_log("Streamed ISOs can't carry ISO extras, extracting the whole ISO")
+            return False
+        else:
+            unpatchable = oz.ISOTree.unpatchable_path(self.orig_iso, paths)
+            if unpatchable is not None:
+                fallback_log("%s can't be patched into the ISO, extracting the whole ISO", unpatchable)
+                return False
+            self.iso_stream = True
 
-                try:
-                    # NOTE: it is very, very important that we use temporary
-                    # files for collecting stdout and stderr here.  There is a
-                    # nasty bug in python subprocess; if your process produces
-                    # more than 64k of data on an fd that is using
-                    # subprocess.PIPE, the whole thing will hang. To avoid
-                    # this, we use temporary fds to capture the data
-                    stdouttmp = tempfile.TemporaryFile()
-                    stderrtmp = tempfile.TemporaryFile()
+        self.iso_overlay_paths = paths
+        return True
 
-                    try:
-                        tar = subprocess.Popen(["tar", "-x", "-v"], stdin=rd,
-                                               stdout=stdouttmp,
-                                               stderr=stderrtmp)
-                        try:
-                            gfs.tar_out("/", "/dev/fd/%d" % wr)
-                        except:
-                            # we need this here if gfs.tar_out throws an
-                            # exception.  In that case, we need to manually
-                            # kill off the tar process and re-raise the
-                            # exception, otherwise we hang forever
-                            tar.kill()
-                            raise
-
-                        # Make sure tar is fully done with the archive before
-                        # we can continue.
-                        tar.wait()
-                        if tar.returncode:
-                            self.log.debug('tar stdout: %s', stdouttmp.read())
-                            self.log.debug('tar stderr: %s', stderrtmp.read())
-                            raise oz.OzException.OzException("Tar exited with an error")
+    def _original_iso_overlay_paths(self, fallback_log):
+        """
+        Internal method to return _iso_overlay_paths() for the original ISO,
+        or an empty list (logging why with fallback_log) if it has none.
+        """
+        iso = oz.ISOTree.open_iso(self.orig_iso, self.log)
+        if iso is None:
+            fallback_log("ISO overlays are only supported for ISO9660 media, extracting the whole ISO")
+            return []
+        try:
+            paths = self._iso_overlay_paths(iso)
+        finally:
+            iso.close()
+        if not paths:
+            fallback_log("%s%s does not support ISO overlays, extracting the whole ISO",
+                         self.tdl.distro, self.tdl.update)
+        return paths
 
-                    finally:
-                        stdouttmp.close()
-                        stderrtmp.close()
-                finally:
-                    os.close(rd)
-                    os.close(wr)
+    def _iso_exists(self, path):
+        """
+        Method to check whether path exists in the (possibly modified) ISO
+        tree.  When only an overlay of the ISO is extracted, the original
+        ISO is checked as well.
+        """
+        if os.path.lexists(os.path.join(self.iso_contents, path)):
+            return True
+        if self.iso_overlay:
+            with oz.ISO9660.ISO9660(self.orig_iso) as iso:
+                return iso.exists(path)
+        return False
 
-                # since we extracted from an ISO, there are no write bits on
-                # any of the directories.  Fix that here.
-                oz.ozutil.recursively_add_write_bit(self.iso_contents)
-            finally:
-                os.chdir(current)
+    def _iso_isdir(self, path):
+        """
+        Method to check whether path is a directory in the (possibly
+        modified) ISO tree.  When only an overlay of the ISO is extracted,
+        the original ISO is checked as well.
+        """
+        if os.path.isdir(os.path.join(self.iso_contents, path)):
+            return True
+        if self.iso_overlay:
+            with oz.ISO9660.ISO9660(self.orig_iso) as iso:
+                return iso.isdir(path)
+        return False
+
+    def _can_replay_iso(self):
+        """
+        Method to check whether a fully extracted and modified ISO tree can
+        still be mastered by xorriso replaying the boot records of the
+        original ISO, rather than by the genisoimage command line of the
+        subclass.  That takes ISO9660 media, xorriso, and a subclass that
+        declares its overlay paths (and with that, that it leaves the boot
+        setup of the ISO alone).
+        """
+        try:
+            oz.ozutil.executable_exists('xorriso')
+        except Exception:
+            return False
+
+        iso = oz.ISOTree.open_iso(self.orig_iso, self.log)
+        if iso is None:
+            return False
+        try:
+            return len(self._iso_overlay_paths(iso)) > 0
         finally:
-            gfs.sync()
-            gfs.umount_all()
-            gfs.kill_subprocess()
+            iso.close()
+
+    def _generate_replayed_iso(self):
+        """
+        Method to create the new ISO out of the original ISO with the
+        changes in iso_contents (either just the overlay, or the changed
+        parts of the whole modified tree) applied to it.  The boot records
+        of the original ISO, BIOS and EFI alike, are replayed onto the new
+        one.
+        """
+        if self.iso_overlay:
+            changes = ["-map", self.iso_contents, "/"]
+        else:
+            changes = oz.ISOTree.changes(self.iso_contents,
+                                         self.iso_contents_snapshot)
+        oz.ISOTree.replay(self.orig_iso, self.output_iso, changes, self.log)
+
+    def _copy_iso(self):
+        """
+        Method to copy the data out of an ISO onto the local filesystem.
+        """
+        if self.iso_overlay:
+            self.log.info("Extracting ISO overlay for modification")
+            oz.ISOTree.extract_overlay(self.orig_iso, self.iso_contents,
+                                       self.iso_overlay_paths)
+            return
+
+        self.log.info("Copying ISO contents for modification")
+        iso = oz.ISOTree.open_iso(self.orig_iso, self.log)
+        if iso is None:
+            oz.ISOTree.extract_guestfs(self.orig_iso, self.iso_contents,
+                                       self.log)
+        else:
+            oz.ISOTree.extract(iso, self.iso_contents, self.log)
 
     def _get_primary_volume_descriptor(self, cdfd):
         """
@@ -1466,21 +1570,27 @@ class CDGuest(Guest):
 
         if desc_type != 0x1:
             raise oz.OzException.OzException("Invalid primary volume descriptor")
-        if identifier != "CD001":
+        if identifier != b"CD001":
             raise oz.OzException.OzException("invalid CD isoIdentification")
         if unused1 != 0x0:
             raise oz.OzException.OzException("data in unused field")
         if unused2 != 0x0:
             raise oz.OzException.OzException("data in 2nd unused field")
 
-        return self._PrimaryVolumeDescriptor(version, system_identifier,
-                                             volume_identifier, space_size_le,
+        return self._PrimaryVolumeDescriptor(version,
+                                             system_identifier.decode('ascii', 'replace'),
+                                             volume_identifier.decode('ascii', 'replace'),
+                                             space_size_le,
                                              set_size_le, seqnum_le)
 
-    def _geteltorito(self, cdfile, outfile):
+    def _geteltorito(self, cdfile, outfile, platform=None):
         """
-        Method to extract the El-Torito boot sector off of a CD and write it
-        to a file.
+        Method to extract the El-Torito boot image off of a CD and write it
+        to a file.  By default the initial/default boot image is extracted;
+        if platform is given (one of the oz.ElTorito.PLATFORM_* values), the
+        first boot image for that platform is extracted instead, so that for
+        instance the EFI image of a UEFI bootable CD can be carried over to
+        a remastered one.
         """
         if cdfile is None:
             raise oz.OzException.OzException("input iso is None")
@@ -1490,104 +1600,15 @@ class CDGuest(Guest):
         with open(cdfile, 'rb') as cdfd:
             self._get_primary_volume_descriptor(cdfd)
 
-            # the 17th sector contains the boot specification and the offset of the
-            # boot sector
-            cdfd.seek(17 * 2048)
-
-            # NOTE: With "native" alignment (the default for struct), there is
-            # some padding that happens that causes the unpacking to fail.
-            # Instead we force "standard" alignment, which has no padding
-            fmt = "=B5sB23s41sI"
-            (boot, isoIdent, version, toritoSpec, unused, bootP) = struct.unpack(fmt,
-                                                                                 cdfd.read(struct.calcsize(fmt)))
-            if boot != 0x0:
-                raise oz.OzException.OzException("invalid CD boot sector")
-            if isoIdent != "CD001":
-                raise oz.OzException.OzException("invalid CD isoIdentification")
-            if version != 0x1:
-                raise oz.OzException.OzException("invalid CD version")
-            if toritoSpec != "EL TORITO SPECIFICATION":
-                raise oz.OzException.OzException("invalid CD torito specification")
-
-            # OK, this looks like a bootable CD.  Seek to the boot sector, and
-            # look for the header, 0x55, and 0xaa in the first 32 bytes
-            cdfd.seek(bootP * 2048)
-            fmt = "=BBH24sHBB"
-            bootdata = cdfd.read(struct.calcsize(fmt))
-            (header, platform, unused, manu_unused, unused2, five, aa) = struct.unpack(fmt,
-                                                                                       bootdata)
-            if header != 0x1:
-                raise oz.OzException.OzException("invalid CD boot sector header")
-            if platform != 0x0 and platform != 0x1 and platform != 0x2:
-                raise oz.OzException.OzException("invalid CD boot sector platform")
-            if unused != 0x0:
-                raise oz.OzException.OzException("invalid CD unused boot sector field")
-            if five != 0x55 or aa != 0xaa:
-                raise oz.OzException.OzException("invalid CD boot sector footer")
-
-            def _checksum(data):
-                """
-                Method to compute the checksum on the ISO.  Note that this is *not*
-                a 1's complement checksum; when an addition overflows, the carry
-                bit is discarded, not added to the end.
-                """
-                s = 0
-                for i in range(0, len(data), 2):
-                    w = ord(data[i]) + (ord(data[i + 1]) << 8)
-                    s = (s + w) & 0xffff
-                return s
-
-            csum = _checksum(bootdata)
-            if csum != 0:
-                raise oz.OzException.OzException("invalid CD checksum: expected 0, saw %d" % (csum))
-
-            # OK, everything so far has checked out.  Read the default/initial
-            # boot entry
-            cdfd.seek(bootP * 2048 + 32)
-            fmt = "=BBHBBHIB"
-            (boot, media, loadsegment_unused, systemtype_unused, unused, scount,
-             imgstart, unused2) = struct.unpack(fmt, cdfd.read(struct.calcsize(fmt)))
-
-            if boot != 0x88:
-                raise oz.OzException.OzException("invalid CD initial boot indicator")
-            if unused != 0x0 or unused2 != 0x0:
-                raise oz.OzException.OzException("invalid CD initial boot unused field")
-
-            if media == 0 or media == 4:
-                count = scount
-            elif media == 1:
-                # 1.2MB floppy in sectors
-                count = 1200 * 1024 / 512
-            elif media == 2:
-                # 1.44MB floppy in sectors
-                count = 1440 * 1024 / 512
-            elif media == 3:
-                # 2.88MB floppy in sectors
-                count = 2880 * 1024 / 512
+        with oz.ElTorito.BootCatalog(cdfile) as catalog:
+            if platform is None:
+                entry = catalog.entries[0]
             else:
-                raise oz.OzException.OzException("invalid CD media type")
-
-            # finally, seek to "imgstart", and read "count" sectors, which
-            # contains the boot image
-            cdfd.seek(imgstart * 2048)
-
-            # The eltorito specification section 2.5 says:
-            #
-            # Sector Count. This is the number of virtual/emulated sectors the
-            # system will store at Load Segment during the initial boot
-            # procedure.
-            #
-            # and then Section 1.5 says:
-            #
-            # Virtual Disk - A series of sectors on the CD which INT 13 presents
-            # to the system as a drive with 200 byte virtual sectors. There
-            # are 4 virtual sectors found in each sector on a CD.
-            #
-            # (note that the bytes above are in hex).  So we read count*512
-            eltoritodata = cdfd.read(count * 512)
-
-        with open(outfile, "w") as f:
-            f.write(eltoritodata)
+                entry = catalog.find(platform)
+                if entry is None:
+                    raise oz.OzException.OzException("%s has no El Torito boot image for platform 0x%x" % (cdfile, platform))
+            self.log.debug("Extracting El Torito boot image of %d bytes at sector %d", entry.size, entry.load_rba)
+            catalog.extract(entry, outfile)
 
     def _do_install(self, timeout=None, force=False, reboots=0,
                     kernelfname=None, ramdiskfname=None, cmdline=None,
@@ -1597,7 +1618,7 @@ class CDGuest(Guest):
         """
         if not force and os.access(self.jeos_filename, os.F_OK):
             self.log.info("Found cached JEOS (%s), using it", self.jeos_filename)
-            oz.ozutil.copyfile_sparse(self.jeos_filename, self.diskimage)
+            self._restore_jeos()
             return self._generate_xml("hd", None)
 
         self.log.info("Running install for %s", self.tdl.name)
@@ -1713,8 +1734,9 @@ class CDGuest(Guest):
 
     def _generate_new_iso(self):
         """
-        Base method to generate the new ISO.  Subclasses are expected to
-        override this.
+        Base method to generate the new ISO out of the whole of
+        iso_contents, for when xorriso can't be used (see _can_replay_iso()).
+        Subclasses are expected to override this.
         """
         raise oz.OzException.OzException("Internal error, subclass didn't override generate_new_iso")
 
@@ -1730,27 +1752,43 @@ class CDGuest(Guest):
                 # if we found a cached JEOS, we don't need to do anything here;
                 # we'll copy the JEOS itself later on
                 return
-            elif os.access(self.modified_iso_cache, os.F_OK):
+            elif self.cache_modified_media and self.media.modified_media_cached(self._modified_media_cache_path(self.modified_iso_cache),
+                                                                                self.orig_iso):
                 self.log.info("Using cached modified media")
-                shutil.copyfile(self.modified_iso_cache, self.output_iso)
+                oz.ozutil.clone_file(self._modified_media_cache_path(self.modified_iso_cache),
+                                     self.output_iso)
                 return
 
-        (fd, outdir) = oz.ozutil.open_locked_file(self.orig_iso)
+        # the output may be a clone of the cached modified media from an
+        # earlier run, so it must be replaced rather than written into
+        oz.Media.remove_output_media(self.output_iso)
+
+        (fd, outdir) = oz.ozutil.open_locked_file(self.orig_iso, shared=True)
 
         try:
             self._get_original_iso(url, fd, outdir, force_download)
             self._check_pvd()
+            self.iso_overlay = self._use_iso_overlay()
             self._copy_iso()
+            if not self.iso_overlay:
+                self.iso_contents_snapshot = oz.ISOTree.snapshot(self.iso_contents)
 
             # from here on out, we have to make sure to cleanup the exploded ISO
             try:
                 self._check_iso_tree(customize_or_icicle)
                 self._add_iso_extras()
                 self._modify_iso()
-                self._generate_new_iso()
+                if self.iso_stream:
+                    oz.ISOTree.stream(self.orig_iso, self.output_iso,
+                                      self.iso_contents, self.log)
+                elif self.iso_overlay or self._can_replay_iso():
+                    self._generate_replayed_iso()
+                else:
+                    self._generate_new_iso()
                 if self.cache_modified_media:
-                    self.log.info("Caching modified media for future use")
-                    shutil.copyfile(self.output_iso, self.modified_iso_cache)
+                    self.media.cache_modified_media(self.output_iso,
+                                                    self._modified_media_cache_path(self.modified_iso_cache),
+                                                    self.orig_iso, fd)
             finally:
                 self._cleanup_iso()
         finally:
@@ -1768,18 +1806,80 @@ class CDGuest(Guest):
         return self._iso_generate_install_media(self.url, force_download,
                                                 customize_or_icicle)
 
+    def _space_plan(self, force_download):
+        """
+        Method to work out the disk space the build will need.  On top of the
+        steps of every guest, this adds the download of the original ISO, its
+        extraction and the mastering (and caching) of the modified ISO.
+        """
+        plan = Guest._space_plan(self, force_download)
+        if not force_download and os.access(self.jeos_filename, os.F_OK):
+            return plan
+
+        outdir = os.path.dirname(self.output_iso)
+        isodir = os.path.dirname(self.orig_iso)
+        cache = self._modified_media_cache_path(self.modified_iso_cache)
+        if not force_download and self.cache_modified_media and self.media.modified_media_cached(cache, self.orig_iso):
+            # the output is a link to (or clone of) the cached media
+            size = 0
+            if oz.ozutil.filesystem_id(cache) != oz.ozutil.filesystem_id(outdir):
+                size = os.stat(cache).st_blocks * 512
+            plan.append(("modified ISO", outdir, size, False))
+            return plan
+
+        have = 0
+        iso_size = 0
+        if os.access(self.orig_iso, os.F_OK):
+            st = os.stat(self.orig_iso)
+            have = st.st_blocks * 512
+            iso_size = st.st_size
+        if force_download or not iso_size or os.path.exists(self.orig_iso + ".part"):
+            if self.tdl.installtype == 'iso':
+                info = oz.ozutil.http_get_header(self.url)
+                if int(info.get('HTTP-Code', 0)) < 400 and int(info.get('Content-Length', 0)) > 0:
+                    iso_size = int(info['Content-Length'])
+                else:
+                    self.log.debug("Could not get the size of %s: %r", self.url, info)
+            else:
+                # URL installs may not need the boot ISO at all, and where it
+                # comes from is up to the subclass
+                self.log.debug("Size of the boot ISO is not known, leaving it out of the plan")
+        plan.append(("download ISO", isodir, max(iso_size - have, 0), False))
+
+        # an overlay only holds the few files that are changed; if the ISO
+        # isn't there yet, it isn't known whether one can be used
+        overlay = False
+        if self.iso_build_mode != 'extract' and os.access(self.orig_iso, os.F_OK):
+            iso = oz.ISOTree.open_iso(self.orig_iso, self.log)
+            if iso is not None:
+                try:
+                    overlay = len(self._iso_overlay_paths(iso)) > 0
+                finally:
+                    iso.close()
+        if not overlay:
+            plan.append(("extract ISO", self.iso_contents, iso_size, False))
+
+        plan.append(("master ISO", outdir, iso_size, False))
+        if self.cache_modified_media and cache is not None:
+            # the cache may be a copy-on-write clone of the output on the
+            # same filesystem
+            plan.append(("modified ISO cache", isodir, iso_size,
+                         oz.ozutil.filesystem_id(isodir) == oz.ozutil.filesystem_id(outdir)))
+
+        return plan
+
     def _cleanup_iso(self):
         """
         Method to cleanup the local ISO contents.
         """
         self.log.info("Cleaning up old ISO data")
-        # if we are running as non-root, then there might be some files left
-        # around that are not writable, which means that the rmtree below would
-        # fail.  Recurse into the iso_contents tree, doing a chmod +w on
-        # every file and directory to make sure the rmtree succeeds
-        oz.ozutil.recursively_add_write_bit(self.iso_contents)
-
-        oz.ozutil.rmtree_and_sync(self.iso_contents)
+        # the tree can be huge for DVD media, and nothing after this needs it
+        # to be gone, so the removal is done in the background.  Trees that
+        # earlier builds failed to remove are picked up along the way
+        oz.ozutil.rmtree_and_sync(self.iso_contents, background=True,
+                                  logger=self.log)
+        oz.ozutil.remove_stale_trees(os.path.dirname(self.iso_contents),
+                                     self.log)
 
     def cleanup_install(self):
         """
@@ -1830,7 +1930,8 @@ class FDGuest(Guest):
         """
         Method to download the original floppy if necessary.
         """
-        self._get_original_media(floppyurl, fd, outdir, force_download)
+        self.media.get_original_media(floppyurl, fd, outdir, force_download,
+                                      self.orig_floppy)
 
     def _copy_floppy(self):
         """
@@ -1845,7 +1946,7 @@ class FDGuest(Guest):
         """
         if not force and os.access(self.jeos_filename, os.F_OK):
             self.log.info("Found cached JEOS, using it")
-            oz.ozutil.copyfile_sparse(self.jeos_filename, self.diskimage)
+            self._restore_jeos()
             return self._generate_xml("hd", None)
 
         self.log.info("Running install for %s", self.tdl.name)
@@ -0,0 +1,837 @@
+# Copyright (C) 2026  agent <agent@local>
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+In-process, read-only reader for ISO9660 images (with the Joliet and Rock
+Ridge extensions), so that install media can be inspected and extracted
+without mounting it.
+"""
+
+import errno
+import os
+import stat
+import struct
+
+import oz.OzException
+import oz.ozutil
+
+SECTOR_SIZE = 2048
+
+# the fixed part of a directory record, up to (and including) the length of
+# the file identifier
+_DIR_RECORD_FMT = "<BBL4sL4s7sBBBH2sB"
+_DIR_RECORD_LEN = struct.calcsize(_DIR_RECORD_FMT)
+
+_FLAG_DIRECTORY = 0x02
+_FLAG_MULTI_EXTENT = 0x80
+
+_JOLIET_ESCAPES = (b"%/@", b"%/C", b"%/E")
+
+
+class ISO9660Entry(object):
+    """
+    Class to hold information about a file, directory or symlink on an
+    ISO9660 image.
+    """
+    def __init__(self, name, extents, is_dir, mode=None, symlink=None):
+        self.name = name
+        # a list of (byte offset in the image, length) tuples; files larger
+        # than 4GiB are made up of more than one extent
+        self.extents = extents
+        self.is_dir = is_dir
+        # the Rock Ridge mode (including the file type bits), if any
+        self.mode = mode
+        # the Rock Ridge symlink target, if any
+        self.symlink = symlink
+
+    @property
+    def size(self):
+        """
+        The total size of the entry in bytes.
+        """
+        return sum(length for offset_unused, length in self.extents)
+
+
+class ImageFile(object):
+    """
+    Class for the low-level access to an image: it opens path (for writing
+    as well if writable is True), and reads exactly the bytes it is asked
+    for.  Subclasses parse the image in _parse(); the image is closed again
+    if that fails.
+    """
+    def __init__(self, path, writable=False):
+        self.path = path
+        flags = os.O_RDONLY
+        if writable:
+            flags = os.O_RDWR
+        self.fd = os.open(path, flags)
+        try:
+            self._parse()
+        except:
+            os.close(self.fd)
+            raise
+
+    def _parse(self):
+        """
+        Internal method to parse the image after it is opened.  The base
+        version does nothing.
+        """
+
+    def close(self):
+        """
+        Method to close the image.
+        """
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read(self, offset, length):
+        """
+        Internal method to read exactly length bytes at offset out of the
+        image.
+        """
+        buf = b""
+        while len(buf) < length:
+            chunk = os.pread(self.fd, length - len(buf), offset + len(buf))
+            if not chunk:
+                raise oz.OzException.OzException("%s is truncated (wanted %d bytes at offset %d)" % (self.path, length, offset))
+            buf += chunk
+        return buf
+
+
+class ISO9660(ImageFile):
+    """
+    Class to read the file tree out of an ISO9660 image.  If the image has
+    Rock Ridge extensions they are used for the names, modes and symlinks;
+    otherwise the Joliet tree is used if there is one, and the plain
+    ISO9660 names (lowercased, and without the version) if not.  This is the
+    same view of the image that the Linux kernel gives by default.  If
+    writable is True, the image is opened for writing as well; that is only
+    needed by ISO9660Patcher.
+    """
+    def __init__(self, path, writable=False):
+        self._listings = {}
+        self.udf = False
+        self.joliet = False
+        self.rock_ridge = False
+        self._susp_skip = 0
+        self.root = None
+        ImageFile.__init__(self, path, writable)
+
+    def _parse(self):
+        self._read_volume_descriptors()
+
+    def _read_volume_descriptors(self):
+        """
+        Internal method to find the root directories of the primary and
+        Joliet volume descriptors, and to find out whether the image also
+        carries a UDF filesystem.
+        """
+        primary_root = None
+        joliet_root = None
+        sector = 16
+        while True:
+            desc = self._read(sector * SECTOR_SIZE, SECTOR_SIZE)
+            (desc_type, identifier) = struct.unpack_from("=B5s", desc)
+            if identifier != b"CD001":
+                raise oz.OzException.OzException("%s is not an ISO9660 image" % (self.path))
+            if desc_type == 255:
+                break
+            if desc_type == 1 and primary_root is None:
+                primary_root = desc[156:156 + 34]
+            elif desc_type == 2 and desc[88:91] in _JOLIET_ESCAPES:
+                joliet_root = desc[156:156 + 34]
+            sector += 1
+
+        if primary_root is None:
+            raise oz.OzException.OzException("Could not find the primary volume descriptor on %s" % (self.path))
+
+        # the UDF volume recognition sequence (if any) directly follows the
+        # ISO9660 volume descriptors
+        for udf_sector in range(sector + 1, sector + 17):
+            identifier = self._read(udf_sector * SECTOR_SIZE + 1, 5)
+            if identifier in (b"NSR02", b"NSR03"):
+                self.udf = True
+                break
+            if identifier not in (b"BEA01", b"TEA01", b"CD001", b"BOOT2", b"CDW02"):
+                break
+
+        root = self._parse_record(primary_root, 0, None)[0]
+
+        # Rock Ridge images have SUSP entries (at least "SP") in the "."
+        # record of the root directory
+        offset = root.extents[0][0]
+        dot = self._read(offset, SECTOR_SIZE)
+        info = {}
+        self._parse_record(dot, 0, info)
+        if info.get('susp'):
+            self.rock_ridge = True
+            self._susp_skip = info.get('skip', 0)
+        elif joliet_root is not None:
+            self.joliet = True
+            root = self._parse_record(joliet_root, 0, None)[0]
+        self.root = root
+
+    def _parse_susp(self, data, info):
+        """
+        Internal method to parse the System Use Sharing Protocol entries in
+        data (the system use area of a directory record) into the info
+        dictionary.
+        """
+        areas = [data]
+        while areas:
+            area = areas.pop(0)
+            pos = 0
+            while pos + 4 <= len(area):
+                (signature, length) = struct.unpack_from("=2sB", area, pos)
+                if length < 4 or pos + length > len(area):
+                    break
+                body = area[pos + 4:pos + length]
+                pos += length
+
+                info['susp'] = True
+                if signature == b"ST":
+                    break
+                if signature == b"SP" and len(body) >= 3:
+                    info['skip'] = struct.unpack_from("=B", body, 2)[0]
+                elif signature == b"CE" and len(body) >= 24:
+                    (lba, offset, ce_len) = struct.unpack_from("<L4sL4sL", body)[0::2]
+                    areas.append(self._read(lba * SECTOR_SIZE + offset, ce_len))
+                elif signature == b"NM" and body:
+                    flags = struct.unpack_from("=B", body)[0]
+                    if flags & 0x02:
+                        info['name'] = b"."
+                    elif flags & 0x04:
+                        info['name'] = b".."
+                    else:
+                        info['name'] = info.get('name', b"") + body[1:]
+                elif signature == b"PX" and len(body) >= 4:
+                    info['mode'] = struct.unpack_from("<L", body)[0]
+                elif signature == b"SL" and body:
+                    components = info.setdefault('symlink', [])
+                    continued = info.get('sl_continue', False)
+                    cpos = 1
+                    while cpos + 2 <= len(body):
+                        (cflags, clen) = struct.unpack_from("=BB", body, cpos)
+                        content = body[cpos + 2:cpos + 2 + clen]
+                        cpos += 2 + clen
+                        if cflags & 0x02:
+                            content = b"."
+                        elif cflags & 0x04:
+                            content = b".."
+                        elif cflags & 0x08:
+                            content = b""
+                        if continued and components:
+                            components[-1] += content
+                        else:
+                            components.append(content)
+                        continued = bool(cflags & 0x01)
+                    info['sl_continue'] = continued
+                elif signature == b"CL" and len(body) >= 4:
+                    info['child_link'] = struct.unpack_from("<L", body)[0]
+                elif signature == b"RE":
+                    info['relocated'] = True
+
+    def _decode_name(self, raw, info):
+        """
+        Internal method to turn the raw identifier of a directory record into
+        the name we present.
+        """
+        if 'name' in info:
+            return info['name'].decode('utf-8', 'replace')
+        if self.joliet:
+            name = raw.decode('utf-16-be', 'replace')
+        else:
+            name = raw.decode('ascii', 'replace').lower()
+        if ';' in name:
+            name = name[:name.rindex(';')]
+        if not self.joliet and name.endswith('.'):
+            name = name[:-1]
+        return name
+
+    def _parse_record(self, buf, offset, info):
+        """
+        Internal method to parse the directory record at offset in buf.  If
+        info is not None, the Rock Ridge data in the record is parsed into
+        it.  Returns an (entry, flags) tuple.
+        """
+        (length, ext_attr_len_unused, lba, lba_be_unused, size, size_be_unused,
+         date_unused, flags, unit_unused, gap_unused, volseq_unused,
+         volseq_be_unused, namelen) = struct.unpack_from(_DIR_RECORD_FMT, buf, offset)
+        raw = buf[offset + _DIR_RECORD_LEN:offset + _DIR_RECORD_LEN + namelen]
+        if info is not None and not self.joliet:
+            susp_start = _DIR_RECORD_LEN + namelen + ((namelen + 1) % 2) + self._susp_skip
+            self._parse_susp(buf[offset + susp_start:offset + length], info)
+            if 'child_link' in info:
+                # a deep directory that was relocated; the real extent and
+                # size are in its own "." record
+                child = self._read(info['child_link'] * SECTOR_SIZE, SECTOR_SIZE)
+                size = struct.unpack_from(_DIR_RECORD_FMT, child)[4]
+                lba = info['child_link']
+                flags |= _FLAG_DIRECTORY
+
+        if raw == b"\x00":
+            name = "."
+        elif raw == b"\x01":
+            name = ".."
+        else:
+            name = self._decode_name(raw, info or {})
+
+        symlink = None
+        if info is not None and 'symlink' in info:
+            symlink = "/".join([c.decode('utf-8', 'replace') for c in info['symlink']])
+            if info['symlink'] and info['symlink'][0] == b"":
+                symlink = "/" + symlink.lstrip("/")
+
+        return ISO9660Entry(name, [(lba * SECTOR_SIZE, size)],
+                            bool(flags & _FLAG_DIRECTORY),
+                            (info or {}).get('mode'), symlink), flags
+
+    def _read_directory_records(self, offset, size):
+        """
+        Internal method to read the directory at offset.  Returns a list of
+        (entry, flags, info) tuples for all of the records in the directory
+        (including "." and "..").
+        """
+        data = self._read(offset, size)
+        records = []
+        pos = 0
+        while pos < len(data):
+            length = struct.unpack_from("=B", data, pos)[0]
+            if length == 0:
+                # records don't cross sector boundaries; skip the padding
+                pos = (pos // SECTOR_SIZE + 1) * SECTOR_SIZE
+                continue
+            info = {}
+            entry, flags = self._parse_record(data, pos, info)
+            records.append((entry, flags, info))
+            pos += length
+
+        return records
+
+    def _listing(self, directory):
+        """
+        Internal method to return the (cached) dictionary of the entries in
+        directory, keyed by name.
+        """
+        offset, size = directory.extents[0]
+        if offset in self._listings:
+            return self._listings[offset]
+
+        listing = {}
+        previous = None
+        for entry, flags, info in self._read_directory_records(offset, size):
+            if entry.name in (".", "..") or info.get('relocated'):
+                continue
+            if previous is not None and previous.name == entry.name:
+                # the continuation of a multi-extent file; the extents all
+                # go to the entry of its first record
+                previous.extents += entry.extents
+            else:
+                listing[entry.name] = entry
+                previous = entry
+            if not flags & _FLAG_MULTI_EXTENT:
+                previous = None
+
+        self._listings[offset] = listing
+        return listing
+
+    def lookup(self, path):
+        """
+        Method to find the entry for path (relative to the root of the image).
+        Returns None if there is no such path.
+        """
+        entry = self.root
+        for component in path.strip('/').split('/'):
+            if component in ('', '.'):
+                continue
+            if not entry.is_dir:
+                return None
+            entry = self._listing(entry).get(component)
+            if entry is None:
+                return None
+        return entry
+
+    def exists(self, path):
+        """
+        Method to check whether path exists on the image.
+        """
+        return self.lookup(path) is not None
+
+    def isdir(self, path):
+        """
+        Method to check whether path is a directory on the image.
+        """
+        entry = self.lookup(path)
+        return entry is not None and entry.is_dir
+
+    def listdir(self, path):
+        """
+        Method to list the names of the entries in the directory path.
+        """
+        entry = self.lookup(path)
+        if entry is None or not entry.is_dir:
+            raise oz.OzException.OzException("%s is not a directory on %s" % (path, self.path))
+        return sorted(self._listing(entry).keys())
+
+    def walk(self, path="/"):
+        """
+        Method to walk the tree under path, like os.walk().  Yields a
+        (dirpath, dirnames, filenames) tuple for every directory, where
+        dirpath is relative to the root of the image.
+        """
+        entry = self.lookup(path)
+        if entry is None or not entry.is_dir:
+            raise oz.OzException.OzException("%s is not a directory on %s" % (path, self.path))
+        pending = [(path.strip('/'), entry)]
+        while pending:
+            dirpath, directory = pending.pop(0)
+            listing = self._listing(directory)
+            dirnames = sorted([name for name, child in listing.items() if child.is_dir])
+            filenames = sorted([name for name, child in listing.items() if not child.is_dir])
+            yield dirpath, dirnames, filenames
+            for name in dirnames:
+                pending.append((os.path.join(dirpath, name), listing[name]))
+
+    def read(self, path):
+        """
+        Method to return the contents of the file at path.
+        """
+        entry = self.lookup(path)
+        if entry is None or entry.is_dir:
+            raise oz.OzException.OzException("%s is not a file on %s" % (path, self.path))
+        return b"".join([self._read(offset, length) for offset, length in entry.extents])
+
+    def _extract_entry(self, entry, destination):
+        """
+        Internal method to extract entry (recursively, for directories) to
+        destination.  Everything is created writable by the owner, so that
+        the tree can be modified and removed later on.
+        """
+        if entry.symlink is not None:
+            os.symlink(entry.symlink, destination)
+            return
+
+        if entry.is_dir:
+            mode = 0o755
+            if entry.mode is not None:
+                mode = stat.S_IMODE(entry.mode)
+            oz.ozutil.mkdir_p(destination)
+            os.chmod(destination, mode | stat.S_IRWXU)
+            for name, child in self._listing(entry).items():
+                self._extract_entry(child, os.path.join(destination, name))
+            return
+
+        mode = 0o644
+        if entry.mode is not None:
+            mode = stat.S_IMODE(entry.mode)
+        fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                     mode | stat.S_IWUSR)
+        try:
+            written = 0
+            for offset, length in entry.extents:
+                oz.ozutil.copy_fd_range(self.fd, fd, offset, written, length)
+                written += length
+        finally:
+            os.close(fd)
+
+    def extract(self, path, destination):
+        """
+        Method to extract the file, symlink or directory tree at path on the
+        image to destination.  File data is copied straight from the image
+        inside of the kernel.
+        """
+        entry = self.lookup(path)
+        if entry is None:
+            raise oz.OzException.OzException("%s does not exist on %s" % (path, self.path))
+        parent = os.path.dirname(destination)
+        if parent:
+            oz.ozutil.mkdir_p(parent)
+        try:
+            self._extract_entry(entry, destination)
+        except OSError as err:
+            if err.errno == errno.ENOSPC:
+                raise oz.OzException.OzException("Not enough room on %s to extract install media" % (parent))
+            raise
+
+
+def _both16(value):
+    """
+    Internal function to pack value as a both-endian 16-bit field.
+    """
+    return struct.pack("<H", value) + struct.pack(">H", value)
+
+
+def _both32(value):
+    """
+    Internal function to pack value as a both-endian 32-bit field.
+    """
+    return struct.pack("<L", value) + struct.pack(">L", value)
+
+
+def _iso_identifier(name):
+    """
+    Internal function to turn name into a plain ISO9660 file identifier
+    (upper case d-characters, exactly one dot and a version).
+    """
+    ident = "".join([c if c.isalnum() or c in "._" else "_" for c in name.upper()])
+    ident = ident.encode('ascii', 'replace').replace(b"?", b"_")
+    if b"." in ident:
+        base, ext = ident.rsplit(b".", 1)
+        ident = base.replace(b".", b"_") + b"." + ext
+    else:
+        ident += b"."
+    return ident + b";1"
+
+
+class _PatchDirectory(object):
+    """
+    Internal class to hold a directory in one of the trees (primary or
+    Joliet) of an image being patched.
+    """
+    def __init__(self, lba, size, record_pos, parent):
+        self.lba = lba
+        self.size = size
+        # the position in the image of the record pointing at this directory;
+        # for the root, that is the record in the volume descriptor
+        self.record_pos = record_pos
+        self.parent = parent
+        # lowercased name -> _PatchDirectory
+        self.children = {}
+        # lowercased name -> (record position, flags)
+        self.files = {}
+
+
+class ISO9660Patcher(ISO9660):
+    """
+    Class to substitute or add files in an ISO9660 image in place.  The new
+    data is written to the end of the image, and the directory records of
+    every tree on it (the primary tree, with or without Rock Ridge, and the
+    Joliet tree) are pointed at it.  Everything else stays exactly where it
+    was, including the boot records and the boot images they point to.
+    Files can only be added to directories that already exist, and only
+    single-extent files can be replaced.
+    """
+    def __init__(self, path, writable=True):
+        ISO9660.__init__(self, path, writable)
+        try:
+            self._load_trees()
+        except:
+            self.close()
+            raise
+
+    def _load_trees(self):
+        """
+        Internal method to find all of the volume descriptors on the image,
+        and to read the directory trees of the primary and Joliet ones.
+        """
+        # a list of (descriptor sector, is joliet, root directory)
+        self.trees = []
+        self.descriptors = []
+        sector = 16
+        while True:
+            desc = self._read(sector * SECTOR_SIZE, SECTOR_SIZE)
+            desc_type = struct.unpack_from("=B", desc)[0]
+            if desc_type == 255:
+                break
+            if desc_type in (1, 2):
+                self.descriptors.append(sector)
+            joliet = desc_type == 2 and desc[88:91] in _JOLIET_ESCAPES
+            if (desc_type == 1 and not self.trees) or joliet:
+                (lba, size) = struct.unpack_from("<L4sL", desc, 156 + 2)[0::2]
+                root = _PatchDirectory(lba, size, sector * SECTOR_SIZE + 156,
+                                       None)
+                self.trees.append((sector, joliet, root))
+            sector += 1
+
+        # new data goes after everything that is on the image now, including
+        # any padding after the end of the ISO9660 volume
+        self.next_lba = (os.fstat(self.fd).st_size + SECTOR_SIZE - 1) // SECTOR_SIZE
+
+        for sector_unused, joliet, root in self.trees:
+            pending = [root]
+            while pending:
+                directory = pending.pop()
+                self._scan_directory(directory, joliet)
+                pending.extend(directory.children.values())
+
+    def _tree_name(self, data, pos, joliet):
+        """
+        Internal method to return the name of the record at pos in data as
+        it appears in a tree; Joliet names for the Joliet tree, and Rock
+        Ridge or plain (lowercased) names for the primary one.  Returns an
+        (name, info) tuple, where info holds the parsed Rock Ridge data.
+        """
+        (length, namelen) = struct.unpack_from("=B31xB", data, pos)
+        raw = data[pos + _DIR_RECORD_LEN:pos + _DIR_RECORD_LEN + namelen]
+        info = {}
+        if joliet:
+            name = raw.decode('utf-16-be', 'replace')
+        else:
+            if self.rock_ridge:
+                susp_start = _DIR_RECORD_LEN + namelen + ((namelen + 1) % 2) + self._susp_skip
+                self._parse_susp(data[pos + susp_start:pos + length], info)
+            if 'name' in info:
+                return info['name'].decode('utf-8', 'replace'), info
+            name = raw.decode('ascii', 'replace')
+        if ';' in name:
+            name = name[:name.rindex(';')]
+        if not joliet and name.endswith('.'):
+            name = name[:-1]
+        return name, info
+
+    def _directory_records(self, directory):
+        """
+        Internal method to split the directory into its records.  Returns the
+        raw directory data and a list of the positions of the records in it.
+        """
+        data = self._read(directory.lba * SECTOR_SIZE, directory.size)
+        positions = []
+        pos = 0
+        while pos < len(data):
+            length = struct.unpack_from("=B", data, pos)[0]
+            if length == 0:
+                pos = (pos // SECTOR_SIZE + 1) * SECTOR_SIZE
+                continue
+            positions.append(pos)
+            pos += length
+        return data, positions
+
+    def _scan_directory(self, directory, joliet):
+        """
+        Internal method to (re)read the records of directory, filling in its
+        files and children.
+        """
+        data, positions = self._directory_records(directory)
+        children = directory.children
+        directory.children = {}
+        directory.files = {}
+        for pos in positions[2:]:
+            (lba, size, flags, namelen_unused) = struct.unpack_from("<2xL4xL4x7xB6xB", data, pos)
+            name, info = self._tree_name(data, pos, joliet)
+            if info.get('relocated') or 'child_link' in info:
+                # deeply nested directories that Rock Ridge moved around;
+                # we never need to patch anything in there
+                continue
+            record_pos = directory.lba * SECTOR_SIZE + pos
+            key = name.lower()
+            if flags & _FLAG_DIRECTORY:
+                child = children.get(key)
+                if child is None:
+                    child = _PatchDirectory(lba, size, record_pos, directory)
+                child.record_pos = record_pos
+                directory.children[key] = child
+            elif key in directory.files:
+                # more than one extent; mark it so that we refuse to replace it
+                directory.files[key] = (directory.files[key][0], _FLAG_MULTI_EXTENT)
+            else:
+                directory.files[key] = (record_pos, flags)
+
+    def _find_directory(self, root, path):
+        """
+        Internal method to find the directory at path (relative to the root of
+        the image) in the tree starting at root.  Returns None if there is no
+        such directory.
+        """
+        directory = root
+        for component in path.strip('/').split('/'):
+            if component in ('', '.'):
+                continue
+            directory = directory.children.get(component.lower())
+            if directory is None:
+                return None
+        return directory
+
+    def can_patch(self, path):
+        """
+        Method to check whether the file at path can be substituted or added.
+        """
+        dirname, basename = os.path.split(path.strip('/'))
+        for sector_unused, joliet_unused, root in self.trees:
+            directory = self._find_directory(root, dirname)
+            if directory is None or basename.lower() in directory.children:
+                return False
+            if directory.files.get(basename.lower(), (0, 0))[1] & _FLAG_MULTI_EXTENT:
+                return False
+        return True
+
+    def _append(self, src_fd, size):
+        """
+        Internal method to copy size bytes of src_fd to the end of the image.
+        Returns the LBA the data was written at.
+        """
+        lba = self.next_lba
+        oz.ozutil.copy_fd_range(src_fd, self.fd, 0, lba * SECTOR_SIZE, size)
+        self.next_lba += (size + SECTOR_SIZE - 1) // SECTOR_SIZE
+        return lba
+
+    def _point_record(self, record_pos, lba, size):
+        """
+        Internal method to point the directory record at record_pos in the
+        image at a new extent.
+        """
+        oz.ozutil.pwrite_bytes_to_fd(self.fd, _both32(lba) + _both32(size),
+                                     record_pos + 2)
+
+    def _new_record(self, name, lba, size, joliet, date):
+        """
+        Internal method to build a directory record for a new file.
+        """
+        if joliet:
+            ident = (name + ";1").encode('utf-16-be')
+        else:
+            ident = _iso_identifier(name)
+
+        system_use = b""
+        if not joliet and self.rock_ridge:
+            encoded = name.encode('utf-8')
+            system_use = (b"\0" * self._susp_skip +
+                          b"PX" + struct.pack("=BB", 36, 1) +
+                          _both32(0o100444) + _both32(1) + _both32(0) + _both32(0) +
+                          b"NM" + struct.pack("=BB", 5 + len(encoded), 1) + b"\0" + encoded)
+
+        body = (_both32(lba) + _both32(size) + date +
+                struct.pack("=BBB", 0, 0, 0) + _both16(1) +
+                struct.pack("=B", len(ident)) + ident)
+        if len(ident) % 2 == 0:
+            body += b"\0"
+        body += system_use
+        if len(body) % 2:
+            body += b"\0"
+        return struct.pack("=BB", len(body) + 2, 0) + body, ident
+
+    def _patch_path_tables(self, desc_sector, old_lba, new_lba):
+        """
+        Internal method to point the path table entries of the volume
+        descriptor at desc_sector for the directory at old_lba to new_lba.
+        """
+        desc = self._read(desc_sector * SECTOR_SIZE, SECTOR_SIZE)
+        table_size = struct.unpack_from("<L", desc, 132)[0]
+        tables = [(struct.unpack_from("<L", desc, 140)[0], "<L"),
+                  (struct.unpack_from("<L", desc, 144)[0], "<L"),
+                  (struct.unpack_from(">L", desc, 148)[0], ">L"),
+                  (struct.unpack_from(">L", desc, 152)[0], ">L")]
+        for table_lba, fmt in tables:
+            if table_lba == 0:
+                continue
+            table = self._read(table_lba * SECTOR_SIZE, table_size)
+            pos = 0
+            while pos + 8 <= len(table):
+                namelen = struct.unpack_from("=B", table, pos)[0]
+                if namelen == 0:
+                    break
+                if struct.unpack_from(fmt, table, pos + 2)[0] == old_lba:
+                    oz.ozutil.pwrite_bytes_to_fd(self.fd, struct.pack(fmt, new_lba),
+                                                 table_lba * SECTOR_SIZE + pos + 2)
+                pos += 8 + namelen + (namelen % 2)
+
+    def _add_record(self, desc_sector, joliet, directory, name, lba, size):
+        """
+        Internal method to add a record for the new file name to directory,
+        keeping the records in order.  If the directory doesn't have room
+        for it, the directory is moved to the end of the image.
+        """
+        data, positions = self._directory_records(directory)
+        records = [data[pos:pos + struct.unpack_from("=B", data, pos)[0]] for pos in positions]
+        date = records[0][18:25]
+        record, ident = self._new_record(name, lba, size, joliet, date)
+
+        index = len(records)
+        for i in range(2, len(records)):
+            namelen = struct.unpack_from("=B", records[i], 32)[0]
+            if records[i][33:33 + namelen] > ident:
+                index = i
+                break
+        records.insert(index, record)
+
+        newdata = b""
+        for rec in records:
+            if len(newdata) % SECTOR_SIZE + len(rec) > SECTOR_SIZE:
+                newdata += b"\0" * (SECTOR_SIZE - len(newdata) % SECTOR_SIZE)
+            newdata += rec
+        newsize = max(directory.size,
+                      (len(newdata) + SECTOR_SIZE - 1) // SECTOR_SIZE * SECTOR_SIZE)
+        newdata = bytearray(newdata.ljust(newsize, b"\0"))
+
+        if newsize == directory.size:
+            oz.ozutil.pwrite_bytes_to_fd(self.fd, bytes(newdata),
+                                         directory.lba * SECTOR_SIZE)
+        else:
+            # the directory has to move, so everything that points at it has
+            # to follow: its own "." record (and ".." for the root), the
+            # record in its parent, the ".." records of its children and the
+            # path tables
+            old_lba = directory.lba
+            new_lba = self.next_lba
+            self.next_lba += newsize // SECTOR_SIZE
+            newdata[2:18] = _both32(new_lba) + _both32(newsize)
+            if directory.parent is None:
+                dotdot = newdata[0]
+                newdata[dotdot + 2:dotdot + 18] = _both32(new_lba) + _both32(newsize)
+            oz.ozutil.pwrite_bytes_to_fd(self.fd, bytes(newdata),
+                                         new_lba * SECTOR_SIZE)
+            self._point_record(directory.record_pos, new_lba, newsize)
+            for child in directory.children.values():
+                dot_len = struct.unpack("=B", self._read(child.lba * SECTOR_SIZE, 1))[0]
+                self._point_record(child.lba * SECTOR_SIZE + dot_len, new_lba,
+                                   newsize)
+            self._patch_path_tables(desc_sector, old_lba, new_lba)
+            directory.lba = new_lba
+            directory.size = newsize
+
+        self._scan_directory(directory, joliet)
+
+    def patch(self, path, source):
+        """
+        Method to put the contents of the local file source on the image as
+        the file at path, replacing the file that is there or adding a new
+        one.
+        """
+        if not self.can_patch(path):
+            raise oz.OzException.OzException("Cannot patch %s into %s" % (path, self.path))
+
+        dirname, basename = os.path.split(path.strip('/'))
+        src_fd = os.open(source, os.O_RDONLY)
+        try:
+            size = os.fstat(src_fd).st_size
+            lba = self._append(src_fd, size)
+        finally:
+            os.close(src_fd)
+
+        for desc_sector, joliet, root in self.trees:
+            directory = self._find_directory(root, dirname)
+            existing = directory.files.get(basename.lower())
+            if existing is not None:
+                self._point_record(existing[0], lba, size)
+            else:
+                self._add_record(desc_sector, joliet, directory, basename,
+                                 lba, size)
+
+    def commit(self):
+        """
+        Method to finish patching, by recording the new size of the image in
+        the volume descriptors.
+        """
+        os.ftruncate(self.fd, self.next_lba * SECTOR_SIZE)
+        for sector in self.descriptors:
+            oz.ozutil.pwrite_bytes_to_fd(self.fd, _both32(self.next_lba),
+                                         sector * SECTOR_SIZE + 80)
@@ -0,0 +1,253 @@
+# Copyright (C) 2010,2011  Chris Lalancette <clalance@redhat.com>
+# Copyright (C) 2012-2018  Chris Lalancette <clalancette@gmail.com>
+# Copyright (C) 2026  agent <agent@local>
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Extraction of install ISOs into a tree on the local filesystem for
+modification, and mastering of the modified tree into a new ISO.
+"""
+
+import errno
+import os
+import shutil
+import stat
+import threading
+
+import guestfs
+
+import oz.ISO9660
+import oz.OzException
+import oz.ozutil
+
+
+def _make_empty_dir(path):
+    """
+    Internal function to (re)create path as an empty directory.
+    """
+    try:
+        shutil.rmtree(path)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    os.makedirs(path)
+
+
+def open_iso(path, logger):
+    """
+    Function to open the ISO at path with the in-process ISO9660 reader.
+    Returns None if the reader can't handle the media; that is the case
+    for media that isn't ISO9660 at all, and for UDF media (where the
+    ISO9660 tree is usually just a stub).
+    """
+    try:
+        iso = oz.ISO9660.ISO9660(path)
+    except oz.OzException.OzException as err:
+        logger.debug("Could not read %s as ISO9660: %s", path, err)
+        return None
+    if iso.udf:
+        iso.close()
+        return None
+    return iso
+
+
+def unpatchable_path(path, paths):
+    """
+    Function to return the first of paths (relative to the root of the ISO
+    at path) that stream() can't patch into a copy of the ISO, or None if
+    it can patch all of them.
+    """
+    with oz.ISO9660.ISO9660Patcher(path, writable=False) as patcher:
+        for name in paths:
+            if not patcher.can_patch(name):
+                return name
+    return None
+
+
+def extract_overlay(path, contents, paths):
+    """
+    Function to extract only the given paths out of the ISO at path into
+    the directory contents, so that it only holds the files that are going
+    to be changed.  Paths that are not on the ISO yet are files that are
+    going to be added; the directories they go into are created.
+    """
+    _make_empty_dir(contents)
+
+    with oz.ISO9660.ISO9660(path) as iso:
+        for isopath in paths:
+            isopath = isopath.strip('/')
+            destination = os.path.join(contents, isopath)
+            if iso.exists(isopath):
+                iso.extract(isopath, destination)
+            else:
+                oz.ozutil.mkdir_p(os.path.dirname(destination))
+
+
+def extract(iso, contents, logger):
+    """
+    Function to extract all of iso (opened with open_iso()) into the
+    directory contents.  The iso is closed afterwards.
+    """
+    try:
+        _make_empty_dir(contents)
+
+        logger.debug("Checking if there is enough space on the filesystem")
+        outputstat = os.statvfs(contents)
+        if (outputstat.f_bsize * outputstat.f_bavail) < os.fstat(iso.fd).st_size:
+            raise oz.OzException.OzException("Not enough room on %s to extract install media" % (contents))
+
+        logger.debug("Extracting ISO contents")
+        # the extracted tree is already writable, so unlike with the
+        # guestfs path there is no need to fix up the modes afterwards
+        iso.extract("/", contents)
+    finally:
+        iso.close()
+
+
+def extract_guestfs(path, contents, logger):
+    """
+    Function to extract all of the ISO at path into the directory contents
+    using libguestfs, for media that the in-process reader can't handle.
+    """
+    _make_empty_dir(contents)
+
+    logger.info("Setting up guestfs handle for %s", path)
+    gfs = guestfs.GuestFS()
+    logger.debug("Adding ISO image %s", path)
+    gfs.add_drive_opts(path, readonly=1, format='raw')
+    logger.debug("Launching guestfs")
+    gfs.launch()
+    try:
+        logger.debug("Mounting ISO")
+        gfs.mount_options('ro', "/dev/sda", "/")
+
+        logger.debug("Checking if there is enough space on the filesystem")
+        isostat = gfs.statvfs("/")
+        outputstat = os.statvfs(contents)
+        if (outputstat.f_bsize * outputstat.f_bavail) < (isostat['blocks'] * isostat['bsize']):
+            raise oz.OzException.OzException("Not enough room on %s to extract install media" % (contents))
+
+        logger.debug("Extracting ISO contents")
+        rd, wr = os.pipe()
+        # guestfs writes the tar stream from this thread, so it has to
+        # be unpacked in another one.  The entries come out writable,
+        # so there is no need to fix up the modes afterwards
+        errors = []
+
+        def _extract():
+            """
+            Function to unpack the tar stream from guestfs.
+            """
+            try:
+                with os.fdopen(rd, 'rb') as tarstream:
+                    oz.ozutil.extract_writable_tar(tarstream, contents)
+                    # consume the padding after the end of the archive,
+                    # so that guestfs doesn't see a broken pipe
+                    while tarstream.read(1024 * 1024):
+                        pass
+            except Exception as err:
+                errors.append(err)
+
+        extractor = threading.Thread(target=_extract)
+        extractor.start()
+        try:
+            gfs.tar_out("/", "/dev/fd/%d" % wr)
+        finally:
+            # closing the write end lets the extractor see the end of
+            # the stream.  If the extractor failed early, it closed the
+            # read end, so tar_out fails rather than blocking forever
+            os.close(wr)
+            extractor.join()
+        if errors:
+            raise oz.OzException.OzException("Failed to extract ISO contents: %s" % (errors[0]))
+    finally:
+        gfs.sync()
+        gfs.umount_all()
+        gfs.kill_subprocess()
+
+
+def snapshot(contents):
+    """
+    Function to record the state of every file in the directory contents,
+    so that changes() can tell what was modified afterwards.
+    """
+    state = {}
+    for dirpath, dirnames, filenames in os.walk(contents):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            state[os.path.relpath(path, contents)] = (st.st_mode, st.st_ino,
+                                                      st.st_size, st.st_mtime_ns)
+    return state
+
+
+def changes(contents, before):
+    """
+    Function to compare the directory contents against the snapshot()
+    before.  Returns the xorriso arguments that remove the paths that are
+    gone and insert the ones that are new or changed.
+    """
+    current = snapshot(contents)
+    args = []
+    for path in sorted(before):
+        parent = os.path.dirname(path)
+        if path not in current and (not parent or parent in current):
+            args.extend(["-rm_r", "/" + path])
+    for path in sorted(current):
+        (mode, ino_unused, size_unused, mtime_unused) = current[path]
+        if stat.S_ISDIR(mode):
+            if path not in before:
+                args.extend(["-mkdir", "/" + path])
+        elif current[path] != before.get(path):
+            args.extend(["-map", os.path.join(contents, path), "/" + path])
+    return args
+
+
+def replay(path, output, args, logger):
+    """
+    Function to create the new ISO output out of the ISO at path with the
+    xorriso arguments args (see changes()) applied to it.  The boot records
+    of the original ISO, BIOS and EFI alike, are replayed onto the new one.
+    """
+    logger.debug("Generating new ISO with xorriso")
+    try:
+        os.unlink(output)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+    oz.ozutil.subprocess_check_output(["xorriso", "-indev", path,
+                                       "-outdev", output,
+                                       "-boot_image", "any", "replay"] + args + ["-commit"],
+                                      printfn=logger.debug)
+
+
+def stream(path, output, contents, logger):
+    """
+    Function to create the new ISO output by copying the ISO at path (as a
+    copy-on-write clone, or inside of the kernel) and patching the files in
+    the directory contents into it.  Only the changed files are written,
+    and the boot records stay as they are.
+    """
+    logger.debug("Generating new ISO by patching the original")
+    oz.ozutil.copyfile_sparse(path, output)
+    with oz.ISO9660.ISO9660Patcher(output) as patcher:
+        for dirpath, dirnames_unused, filenames in os.walk(contents):
+            for filename in sorted(filenames):
+                source = os.path.join(dirpath, filename)
+                isopath = os.path.relpath(source, contents)
+                logger.debug("Patching %s into the ISO", isopath)
+                patcher.patch(isopath, source)
+        patcher.commit()
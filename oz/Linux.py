@@ -18,6 +18,7 @@
 Linux installation
 """
 
+import asyncio
 import os
 import re
 import time
@@ -44,14 +45,19 @@ class LinuxCDGuest(oz.Guest.CDGuest):
         Under systemd, the IP address of a guest can come up and reportip can
         run before the ssh key is generated and sshd starts up.  This check
         makes sure that we allow an additional 30 seconds (1 second per ssh
-        attempt) for sshd to finish initializing.
+        attempt) for sshd to finish initializing.  When called from a step
+        run by one of the async_* methods, the wait is done on the event loop.
         """
+        if self.async_loop is not None:
+            self._wait_on_loop(self._async_test_ssh_connection(guestaddr))
+            return
+
         count = 30
         success = False
         while count > 0:
+            self.log.debug("Testing ssh connection, try %d", count)
+            start = time.time()
             try:
-                self.log.debug("Testing ssh connection, try %d", count)
-                start = time.time()
                 self.guest_execute_command(guestaddr, 'ls', timeout=1)
                 self.log.debug("Succeeded")
                 success = True
@@ -67,6 +73,25 @@ class LinuxCDGuest(oz.Guest.CDGuest):
             self.log.debug("Failed to connect to ssh on running guest")
             raise oz.OzException.OzException("Failed to connect to ssh on running guest")
 
+    async def _async_test_ssh_connection(self, guestaddr):
+        """
+        asyncio version of _test_ssh_connection().
+        """
+        loop = asyncio.get_running_loop()
+        for count in range(30, 0, -1):
+            self.log.debug("Testing ssh connection, try %d", count)
+            start = loop.time()
+            try:
+                await self.async_guest_execute_command(guestaddr, 'ls', timeout=1)
+                self.log.debug("Succeeded")
+                return
+            except oz.ozutil.SubprocessException:
+                # ensure that we spent at least one second before trying again
+                await asyncio.sleep(1 - (loop.time() - start))
+
+        self.log.debug("Failed to connect to ssh on running guest")
+        raise oz.OzException.OzException("Failed to connect to ssh on running guest")
+
     def get_default_runlevel(self, g_handle):
         """
         Function to determine the default runlevel based on the /etc/inittab.
@@ -81,9 +106,9 @@ class LinuxCDGuest(oz.Guest.CDGuest):
 
         return runlevel
 
-    def guest_execute_command(self, guestaddr, command, timeout=30):
+    def _ssh_options(self, timeout):
         """
-        Method to execute a command on the guest and return the output.
+        Internal method to return the options that ssh and scp are run with.
         """
         # ServerAliveInterval protects against NAT firewall timeouts
         # on long-running commands with no output
@@ -93,47 +118,66 @@ class LinuxCDGuest(oz.Guest.CDGuest):
         #
         # -F /dev/null makes sure that we don't use the global or per-user
         # configuration files
+        return ["-i", self.sshprivkey,
+                "-F", "/dev/null",
+                "-o", "ServerAliveInterval=30",
+                "-o", "StrictHostKeyChecking=no",
+                "-o", "ConnectTimeout=" + str(timeout),
+                "-o", "UserKnownHostsFile=/dev/null",
+                "-o", "PasswordAuthentication=no",
+                "-o", "IdentitiesOnly yes"]
+
+    def guest_execute_command(self, guestaddr, command, timeout=30):
+        """
+        Method to execute a command on the guest and return the output.  When
+        called from a step run by one of the async_* methods, ssh is run by
+        the event loop.
+        """
+        if self.async_loop is not None:
+            return self._wait_on_loop(self.async_guest_execute_command(guestaddr, command, timeout))
 
-        return oz.ozutil.subprocess_check_output(["ssh", "-i", self.sshprivkey,
-                                                  "-F", "/dev/null",
-                                                  "-o", "ServerAliveInterval=30",
-                                                  "-o", "StrictHostKeyChecking=no",
-                                                  "-o", "ConnectTimeout=" + str(timeout),
-                                                  "-o", "UserKnownHostsFile=/dev/null",
-                                                  "-o", "PasswordAuthentication=no",
-                                                  "-o", "IdentitiesOnly yes",
-                                                  "root@" + guestaddr, command],
+        return oz.ozutil.subprocess_check_output(["ssh"] + self._ssh_options(timeout) + ["root@" + guestaddr, command],
                                                  printfn=self.log.debug)
 
+    async def async_guest_execute_command(self, guestaddr, command,
+                                          timeout=30):
+        """
+        asyncio version of guest_execute_command().
+        """
+        return await oz.ozutil.async_subprocess_check_output(["ssh"] + self._ssh_options(timeout) + ["root@" + guestaddr, command],
+                                                             printfn=self.log.debug)
+
     def guest_live_upload(self, guestaddr, file_to_upload, destination,
                           timeout=10):
         """
-        Method to copy a file to the live guest.
+        Method to copy a file to the live guest.  When called from a step run
+        by one of the async_* methods, ssh and scp are run by the event loop.
         """
+        if self.async_loop is not None:
+            return self._wait_on_loop(self.async_guest_live_upload(guestaddr, file_to_upload,
+                                                                   destination, timeout))
+
         self.guest_execute_command(guestaddr,
                                    "mkdir -p " + os.path.dirname(destination),
                                    timeout)
 
-        # ServerAliveInterval protects against NAT firewall timeouts
-        # on long-running commands with no output
-        #
-        # PasswordAuthentication=no prevents us from falling back to
-        # keyboard-interactive password prompting
-        #
-        # -F /dev/null makes sure that we don't use the global or per-user
-        # configuration files
-        return oz.ozutil.subprocess_check_output(["scp", "-i", self.sshprivkey,
-                                                  "-F", "/dev/null",
-                                                  "-o", "ServerAliveInterval=30",
-                                                  "-o", "StrictHostKeyChecking=no",
-                                                  "-o", "ConnectTimeout=" + str(timeout),
-                                                  "-o", "UserKnownHostsFile=/dev/null",
-                                                  "-o", "PasswordAuthentication=no",
-                                                  "-o", "IdentitiesOnly yes",
-                                                  file_to_upload,
-                                                  "root@" + guestaddr + ":" + destination],
+        return oz.ozutil.subprocess_check_output(["scp"] + self._ssh_options(timeout) + [file_to_upload,
+                                                                                         "root@" + guestaddr + ":" + destination],
                                                  printfn=self.log.debug)
 
+    async def async_guest_live_upload(self, guestaddr, file_to_upload,
+                                      destination, timeout=10):
+        """
+        asyncio version of guest_live_upload().
+        """
+        await self.async_guest_execute_command(guestaddr,
+                                               "mkdir -p " + os.path.dirname(destination),
+                                               timeout)
+
+        return await oz.ozutil.async_subprocess_check_output(["scp"] + self._ssh_options(timeout) + [file_to_upload,
+                                                                                                     "root@" + guestaddr + ":" + destination],
+                                                             printfn=self.log.debug)
+
     def _customize_files(self, guestaddr):
         """
         Method to upload the custom files specified in the TDL to the guest.
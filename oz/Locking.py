@@ -0,0 +1,107 @@
+# Copyright (C) 2010,2011  Chris Lalancette <clalance@redhat.com>
+# Copyright (C) 2012-2018  Chris Lalancette <clalancette@gmail.com>
+# Copyright (C) 2026  agent <agent@local>
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Locking of the files shared between several builds.
+"""
+
+import errno
+import fcntl
+import os
+import time
+
+import monotonic
+
+import oz.ozutil
+
+
+def lock_file(fd, shared=False, blocking=True):
+    """
+    Function to lock the file open as fd, with a shared lock if shared is
+    True and an exclusive one otherwise.  The locks are flock(2) locks, which
+    belong to the open file rather than to the process, so they work between
+    the threads of one process as well as between processes.  A lock already
+    held on fd is converted; note that the conversion is not atomic, and if
+    it fails no lock is held any more.  If blocking is False and someone
+    else holds a conflicting lock, False is returned rather than waiting;
+    otherwise True is returned.
+    """
+    operation = fcntl.LOCK_EX
+    if shared:
+        operation = fcntl.LOCK_SH
+    if not blocking:
+        operation |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(fd, operation)
+    except (IOError, OSError) as err:
+        if not blocking and err.errno in (errno.EAGAIN, errno.EACCES):
+            return False
+        raise
+    return True
+
+
+def open_locked_file(filename, shared=False):
+    """
+    A function to open and lock a file.  Files that are only read should be
+    opened with shared set to True, so that they can be used by several
+    builds at once.  Returns a file descriptor referencing the open and
+    locked file.
+    """
+    outdir = os.path.dirname(filename)
+    oz.ozutil.mkdir_p(outdir)
+
+    fd = os.open(filename, os.O_RDWR | os.O_CREAT)
+
+    try:
+        lock_file(fd, shared)
+    except:
+        os.close(fd)
+        raise
+
+    return (fd, outdir)
+
+
+def lock_file_for_writing(fd, logger, name):
+    """
+    Function to turn the shared lock held on fd into an exclusive one, so
+    that the file can be written.  Other builds holding shared locks are
+    waited out.  If someone else is writing the file, the growth of the file
+    is logged every 10 seconds, and once they are done False is returned
+    with a shared lock held again, so that the caller can look at what was
+    written before deciding to write the file itself.  Otherwise True is
+    returned, with the exclusive lock held.
+    """
+    before = os.fstat(fd)
+    next_print = monotonic.monotonic()
+    while not lock_file(fd, blocking=False):
+        # the failed conversion left us without a lock; as long as only
+        # readers hold one, a shared lock can be had
+        if lock_file(fd, shared=True, blocking=False):
+            st = os.fstat(fd)
+            if (st.st_size, st.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+                return False
+            # don't hold on to it while waiting, or two builds that both
+            # want to write would keep each other from ever doing so
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        now = monotonic.monotonic()
+        if now >= next_print:
+            logger.info("Waiting for other builds using %s (%s so far)", name,
+                        oz.ozutil.sizeof_fmt(os.fstat(fd).st_size))
+            next_print = now + 10
+        time.sleep(1)
+    return True
@@ -75,6 +75,16 @@ class MandrakeGuest(oz.Guest.CDGuest):
 
         self.config = version_to_config[tdl.update]
 
+    def _iso_overlay_paths(self, iso):
+        """
+        Method to return the paths on the ISO that Mandrake guests modify.
+        """
+        if self.config.old_isolinux:
+            # the boot floppy image itself is modified, so the boot record
+            # can't simply be replayed
+            return []
+        return ["auto_inst.cfg", "isolinux/isolinux.cfg"]
+
     def _modify_iso(self):
         """
         Method to make the boot ISO auto-boot with appropriate parameters.
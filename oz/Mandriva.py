@@ -66,6 +66,16 @@ class MandrivaGuest(oz.Guest.CDGuest):
 
         self.config = version_to_config[tdl.update]
 
+    def _iso_overlay_paths(self, iso):
+        """
+        Method to return the paths on the ISO that Mandriva guests modify.
+        """
+        pathdir = ""
+        if not self.config.old_path:
+            pathdir = self.mandriva_arch
+        return [os.path.join(pathdir, "auto_inst.cfg"),
+                os.path.join(pathdir, "isolinux", "isolinux.cfg")]
+
     def _modify_iso(self):
         """
         Method to make the boot ISO auto-boot with appropriate parameters.
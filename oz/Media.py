@@ -0,0 +1,504 @@
+# Copyright (C) 2010,2011  Chris Lalancette <clalance@redhat.com>
+# Copyright (C) 2012-2018  Chris Lalancette <clalancette@gmail.com>
+# Copyright (C) 2026  agent <agent@local>
+
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation;
+# version 2.1 of the License.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""
+Download, verification and caching of the original and modified install
+media, along with the index of the cached media that has been verified.
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import stat
+import sys
+import tempfile
+try:
+    import urllib.parse as urlparse
+except ImportError:
+    import urlparse
+
+import oz.Download
+import oz.Locking
+import oz.OzException
+import oz.ozutil
+
+
+def _media_index_key(st):
+    """
+    Internal function to generate the part of a media index entry that
+    identifies a particular version of a file.
+    """
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+            'inode': st.st_ino, 'dev': st.st_dev}
+
+
+def _read_media_index(index_file):
+    """
+    Internal function to read the verified media index.  A missing or corrupt
+    index is treated as empty.
+    """
+    try:
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(index, dict):
+        return {}
+    return index
+
+
+def get_media_index_entry(index_file, path, st):
+    """
+    Function to look up the file at path in the media index.  The st argument
+    is the os.stat() result of the file as it is now; the entry is only
+    returned if the file has the same size, mtime and inode as when the entry
+    was recorded.  Returns a dictionary, or None if there is no such entry.
+    """
+    entry = _read_media_index(index_file).get(os.path.realpath(path))
+    if entry is None:
+        return None
+    for key, value in _media_index_key(st).items():
+        if entry.get(key) != value:
+            return None
+    return entry
+
+
+def update_media_index_entry(index_file, path, st, fields):
+    """
+    Function to record the dictionary "fields" in the media index entry for
+    the file at path (with the os.stat() result st).  If the existing entry
+    was recorded for the same version of the file, the fields are merged into
+    it; otherwise the entry is replaced.
+    """
+    (lockfd, outdir_unused) = oz.ozutil.open_locked_file(index_file + ".lock")
+    try:
+        index = _read_media_index(index_file)
+        key = _media_index_key(st)
+        entry = index.get(os.path.realpath(path))
+        if entry is None or any(entry.get(k) != v for k, v in key.items()):
+            entry = key
+        entry.update(fields)
+        index[os.path.realpath(path)] = entry
+        tmpname = index_file + ".tmp"
+        with open(tmpname, 'w') as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.rename(tmpname, index_file)
+    finally:
+        os.close(lockfd)
+
+
+def modified_media_key(guest):
+    """
+    Function to compute a key over all of the inputs that go into the
+    modified install media of guest, other than the original media itself:
+    the auto file, the TDL settings that end up on the media, the ISO extras
+    and the Oz code that does the modification.  Returns None if the inputs
+    can't be pinned down (ISO extras fetched over the network), in which case
+    the modified media must not be cached.
+    """
+    digest = hashlib.sha256()
+    inputs = [type(guest).__module__, type(guest).__name__,
+              guest.tdl.distro, guest.tdl.update, guest.tdl.arch,
+              guest.tdl.installtype, guest.url, guest.tdl.rootpw,
+              guest.tdl.key, guest.tdl.kernel_param]
+    for isoextra in guest.tdl.isoextras:
+        inputs.extend([isoextra.element_type, isoextra.source,
+                       isoextra.destination])
+    digest.update(json.dumps(inputs).encode('utf-8'))
+
+    for isoextra in guest.tdl.isoextras:
+        parsedurl = urlparse.urlparse(isoextra.source)
+        if parsedurl.scheme != 'file':
+            guest.log.debug("ISO extra %s is remote, not caching modified media", isoextra.source)
+            return None
+        oz.ozutil.hash_path(parsedurl.path, digest)
+
+    oz.ozutil.hash_path(guest.auto, digest)
+
+    # Oz has no version of its own to go by, so the source of the modules
+    # that build the media stands in for it: the guest classes, and the
+    # modules that extract, modify and master the ISO for them
+    ozdir = os.path.dirname(os.path.abspath(__file__))
+    sources = {os.path.join(ozdir, name + ".py")
+               for name in ['ozutil', 'ElTorito', 'ISO9660', 'ISOTree',
+                            'Media']}
+    for cls in type(guest).__mro__:
+        module = sys.modules.get(cls.__module__)
+        if module is not None and cls.__module__.startswith('oz.'):
+            sources.add(os.path.splitext(module.__file__)[0] + ".py")
+    for source in sorted(sources):
+        if os.access(source, os.F_OK):
+            oz.ozutil.hash_path(source, digest)
+
+    return digest.hexdigest()
+
+
+def remove_output_media(output):
+    """
+    Function to remove the output media from an earlier run, if any.
+    """
+    try:
+        os.unlink(output)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+
+
+class MediaCache(object):
+    """
+    Class to fetch the original install media of a TDL into the cache, and to
+    keep the modified media made from it, with the verified media index
+    (media-index.json in data_dir) recording what is known about the cached
+    files.
+    """
+    def __init__(self, tdl, data_dir, download_workers):
+        self.tdl = tdl
+        self.download_workers = download_workers
+        self.index = os.path.join(data_dir, "media-index.json")
+        # forces the checksums of cached media to be checked again even if
+        # the index says they were verified
+        self.reverify = False
+        self.log = logging.getLogger('%s.%s' % (__name__,
+                                                self.__class__.__name__))
+
+    def _csum_type(self):
+        """
+        Internal method to figure out which checksum (if any) was requested
+        in the TDL.  Returns a tuple of the URL to the checksum file and the
+        name of the hashlib algorithm, or (None, None).
+        """
+        if self.tdl.iso_md5_url:
+            return self.tdl.iso_md5_url, 'md5'
+        if self.tdl.iso_sha1_url:
+            return self.tdl.iso_sha1_url, 'sha1'
+        if self.tdl.iso_sha256_url:
+            return self.tdl.iso_sha256_url, 'sha256'
+        return None, None
+
+    def _get_csums(self, original_url, outdir, outputfd, filename=None,
+                   local_sum=None):
+        """
+        Internal method to fetch the checksum file and compare it with the
+        checksum of the downloaded data.  If local_sum (a hashlib object that
+        was fed the data while it was downloaded) is given, it is used as the
+        checksum of the data; otherwise the data is read back to compute it.
+
+        If filename (the path of the file that outputfd refers to) is given,
+        a successful check is recorded in the verified media index, and as
+        long as the file is unchanged later checks against the same checksum
+        file are answered from the index without fetching or hashing anything
+        (unless reverify is set).
+        """
+        url, hashname = self._csum_type()
+        if url is None:
+            return True
+
+        if filename is not None and local_sum is None and not self.reverify:
+            entry = get_media_index_entry(self.index, filename,
+                                          os.fstat(outputfd))
+            if entry is not None and entry.get('hashname') == hashname and entry.get('csum_url') == url:
+                self.log.debug("%s was already verified against %s", filename, url)
+                return True
+
+        originalname = os.path.basename(urlparse.urlparse(original_url)[2])
+
+        # builds of the same media may check it at the same time, so each
+        # one fetches the checksum file under its own name
+        (csumfd, csumname) = tempfile.mkstemp(prefix=self.tdl.distro + self.tdl.update + self.tdl.arch + "-CHECKSUM.",
+                                              dir=outdir)
+        try:
+            try:
+                self.log.debug("Checksum requested, fetching %s file", hashname)
+                oz.ozutil.http_download_file(url, csumfd, False, self.log)
+            finally:
+                os.close(csumfd)
+
+            upstream_sum = getattr(oz.ozutil,
+                                   'get_' + hashname + 'sum_from_file')(csumname, originalname)
+        finally:
+            os.unlink(csumname)
+
+        if not upstream_sum:
+            raise oz.OzException.OzException("Could not find checksum for original file " + originalname)
+
+        fields = {'hashname': hashname, 'digest': upstream_sum, 'csum_url': url}
+        if local_sum is None:
+            self.log.debug("Calculating checksum of downloaded file")
+            os.lseek(outputfd, 0, os.SEEK_SET)
+
+            # the SHA256 is recorded along the way, so that the modified
+            # media cache doesn't have to read the file again
+            local_sum = getattr(hashlib, hashname)()
+            sha256 = hashlib.sha256()
+
+            buf = oz.ozutil.read_bytes_from_fd(outputfd, 1024 * 1024)
+            while buf:
+                local_sum.update(buf)
+                sha256.update(buf)
+                buf = oz.ozutil.read_bytes_from_fd(outputfd, 1024 * 1024)
+            fields['sha256'] = sha256.hexdigest()
+
+        if local_sum.hexdigest() != upstream_sum:
+            return False
+
+        if filename is not None:
+            update_media_index_entry(self.index, filename, os.fstat(outputfd),
+                                     fields)
+
+        return True
+
+    def get_original_media(self, url, fd, outdir, force_download,
+                           filename=None):
+        """
+        Method to fetch the original media from url.  If the media is already
+        cached locally, the cached copy will be used instead.  If filename
+        (the path of the file that fd refers to) is given, the download can
+        be resumed if it was interrupted earlier on, and the ETag and
+        Last-Modified headers of the media are remembered so that the next
+        fetch can ask the server whether anything changed.
+        """
+        self.log.info("Fetching the original media")
+
+        manifest = None
+        if filename is not None:
+            manifest = filename + ".part"
+            if force_download:
+                try:
+                    os.unlink(manifest)
+                except OSError as err:
+                    if err.errno != errno.ENOENT:
+                        raise
+
+        # a left-over manifest means that an earlier download was
+        # interrupted, so the cached file cannot be complete
+        resuming = manifest is not None and os.path.exists(manifest)
+
+        headers = {}
+        if filename is not None and not force_download and not resuming:
+            entry = get_media_index_entry(self.index, filename, os.fstat(fd))
+            if entry is not None and entry.get('url') == url:
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+
+        info = oz.ozutil.http_get_header(url, headers=headers)
+
+        if headers and int(info.get('HTTP-Code', 0)) == 304:
+            # neither the upstream media nor our cached copy of it changed
+            # since we last fetched it
+            if self._get_csums(url, outdir, fd, filename):
+                self.log.info("Original install media not modified, using cached version")
+                return
+
+            self.log.info("Original not modified, but checksum mis-match; re-downloading")
+            info = oz.ozutil.http_get_header(url)
+
+        if 'HTTP-Code' not in info or int(info['HTTP-Code']) >= 400 or 'Content-Length' not in info or int(info['Content-Length']) < 0:
+            raise oz.OzException.OzException("Could not reach %s to fetch boot media: %r" % (url, info))
+
+        content_length = int(info['Content-Length'])
+
+        if content_length == 0:
+            raise oz.OzException.OzException("Install media of 0 size detected, something is wrong")
+
+        if not force_download and not resuming:
+            if content_length == os.fstat(fd)[stat.ST_SIZE]:
+                if self._get_csums(url, outdir, fd, filename):
+                    self.log.info("Original install media available, using cached version")
+                    self._record_validators(url, fd, filename, info)
+                    return
+
+                self.log.info("Original available, but checksum mis-match; re-downloading")
+
+        # the media is read under a shared lock, so writing it has to wait for
+        # the other builds that use it.  If one of them was fetching the same
+        # media, its download is used rather than fetching it again
+        if not oz.Locking.lock_file_for_writing(fd, self.log, filename or url):
+            if filename is not None and self._fetched_by_other_build(url, fd, filename):
+                self.log.info("Original install media was fetched by another build, using it")
+                return
+            self.get_original_media(url, fd, outdir, force_download, filename)
+            return
+
+        try:
+            self._download(url, fd, outdir, filename, manifest, resuming,
+                           content_length, info)
+        finally:
+            oz.Locking.lock_file(fd, shared=True)
+
+    def _fetched_by_other_build(self, url, fd, filename):
+        """
+        Internal method to check whether the media in filename (open as fd) is
+        a complete download of url, verified against the checksum we would
+        use, as left behind by another build.
+        """
+        entry = get_media_index_entry(self.index, filename, os.fstat(fd))
+        if entry is None or entry.get('url') != url:
+            return False
+        if os.path.exists(filename + ".part"):
+            return False
+        csum_url = self._csum_type()[0]
+        return csum_url is None or entry.get('csum_url') == csum_url
+
+    def _download(self, url, fd, outdir, filename, manifest, resuming,
+                  content_length, info):
+        """
+        Internal method to download (or finish downloading) the media at url
+        into fd, which must be locked exclusively, and verify it.
+        """
+        # before fetching everything, make sure that we have enough
+        # space on the filesystem to store the data we are about to download
+        needed = content_length
+        if resuming:
+            needed -= os.fstat(fd).st_blocks * 512
+        devdata = os.statvfs(outdir)
+        if (devdata.f_bsize * devdata.f_bavail) < needed:
+            raise oz.OzException.OzException("Not enough room on %s for install media" % (outdir))
+
+        if not resuming:
+            # at this point we know we are going to download everything.  Make
+            # sure to truncate the file so no stale data is left on the end
+            os.ftruncate(fd, 0)
+            os.lseek(fd, 0, os.SEEK_SET)
+
+        # the SHA256 is always calculated, as the modified media cache
+        # refers to the original media by it
+        sha256 = hashlib.sha256()
+        digests = [sha256]
+        local_sum = None
+        hashname = self._csum_type()[1]
+        if hashname == 'sha256':
+            local_sum = sha256
+        elif hashname is not None:
+            local_sum = getattr(hashlib, hashname)()
+            digests.append(local_sum)
+
+        self.log.info("Fetching the original install media from %s", url)
+        oz.ozutil.http_download_file(url, fd, True, self.log,
+                                     self.download_workers, manifest,
+                                     oz.Download.MultiDigest(digests))
+
+        filesize = os.fstat(fd)[stat.ST_SIZE]
+
+        if filesize != content_length:
+            # if the length we downloaded is not the same as what we
+            # originally saw from the headers, something went wrong
+            raise oz.OzException.OzException("Expected to download %d bytes, downloaded %d" % (content_length, filesize))
+
+        if not self._get_csums(url, outdir, fd, filename, local_sum):
+            raise oz.OzException.OzException("Checksum for downloaded file does not match!")
+
+        if filename is not None:
+            update_media_index_entry(self.index, filename, os.fstat(fd),
+                                     {'sha256': sha256.hexdigest()})
+        self._record_validators(url, fd, filename, info)
+
+    def _record_validators(self, url, fd, filename, info):
+        """
+        Internal method to remember the ETag and Last-Modified headers that
+        the server sent for the media at url (if any) in the media index, so
+        that the next fetch of the media can be made conditional.  This must
+        only be called once the media has been verified.
+        """
+        if filename is None:
+            return
+
+        # the url is recorded even without validators, as the mark of a
+        # complete (and verified) fetch of the media
+        etag = info.get('ETag')
+        last_modified = info.get('Last-Modified')
+        update_media_index_entry(self.index, filename, os.fstat(fd),
+                                 {'url': url, 'etag': etag,
+                                  'last_modified': last_modified})
+
+    def _original_sha256(self, filename, fd):
+        """
+        Internal method to get the SHA256 of the original media in filename
+        (open as fd).  The digest is recorded in the media index while the
+        media is downloaded or verified, so it only has to be calculated (and
+        recorded) here for media that was cached without a checksum.
+        """
+        st = os.fstat(fd)
+        entry = get_media_index_entry(self.index, filename, st)
+        if entry is not None:
+            if entry.get('sha256'):
+                return entry['sha256']
+            if entry.get('hashname') == 'sha256' and entry.get('digest'):
+                return entry['digest']
+
+        self.log.debug("Calculating SHA256 of %s", filename)
+        sha256 = oz.ozutil.hash_path(filename)
+        update_media_index_entry(self.index, filename, st, {'sha256': sha256})
+        return sha256
+
+    def modified_media_cached(self, cache, orig):
+        """
+        Method to find out whether the modified media cache file cache can be
+        used.  It must have been made from the same inputs (which are part of
+        its name) and from the original media currently in orig.  If the
+        original media isn't around any more, there is no telling whether the
+        URL still refers to the same media, so the cache isn't used.
+        """
+        if cache is None or not os.access(cache, os.F_OK):
+            return False
+
+        entry = get_media_index_entry(self.index, cache, os.stat(cache))
+        if entry is None or not entry.get('source_sha256'):
+            return False
+
+        try:
+            fd = os.open(orig, os.O_RDONLY)
+        except OSError as err:
+            if err.errno == errno.ENOENT:
+                return False
+            raise
+        try:
+            return self._original_sha256(orig, fd) == entry['source_sha256']
+        finally:
+            os.close(fd)
+
+    def cache_modified_media(self, output, cache, orig, fd):
+        """
+        Method to save the modified media in output as the cache file cache,
+        along with the digest of the original media orig (open as fd) it was
+        made from.
+        """
+        if cache is None:
+            return
+
+        self.log.info("Caching modified media for future use")
+        # builds with the same inputs may cache their media at the same time;
+        # each one renames its own temporary file into place
+        (tmpfd, tmpname) = tempfile.mkstemp(prefix=os.path.basename(cache) + ".",
+                                            suffix=".tmp",
+                                            dir=os.path.dirname(cache))
+        os.close(tmpfd)
+        try:
+            oz.ozutil.clone_file(output, tmpname)
+            os.rename(tmpname, cache)
+        except:
+            try:
+                os.unlink(tmpname)
+            except OSError:
+                pass
+            raise
+        update_media_index_entry(self.index, cache, os.stat(cache),
+                                 {'source_sha256': self._original_sha256(orig, fd)})
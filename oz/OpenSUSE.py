@@ -143,6 +143,14 @@ class OpenSUSEGuest(oz.Linux.LinuxCDGuest):
         self.crond_was_active = False
         self.sshd_was_active = False
 
+    def _iso_overlay_paths(self, iso):
+        """
+        Method to return the paths on the ISO that OpenSUSE guests read or
+        modify.
+        """
+        return ["autoinst.xml",
+                "boot/" + self.tdl.arch + "/loader/isolinux.cfg"]
+
     def _modify_iso(self):
         """
         Method to make the boot ISO auto-boot with appropriate parameters.
@@ -31,6 +31,7 @@ import shutil
 import oz.Guest
 import oz.GuestFSManager
 import oz.Linux
+import oz.Media
 import oz.OzException
 import oz.ozutil
 
@@ -103,9 +104,15 @@ Subsystem	sftp	/usr/libexec/openssh/sftp-server
                                            self.iso_contents],
                                           printfn=self.log.debug)
 
+    def _iso_overlay_paths(self, iso):
+        """
+        Method to return the paths on the ISO that RedHat style guests
+        modify.
+        """
+        return ["isolinux/isolinux.cfg", "ks.cfg"]
+
     def _check_iso_tree(self, customize_or_icicle):
-        kernel = os.path.join(self.iso_contents, "isolinux", "vmlinuz")
-        if not os.path.exists(kernel):
+        if not self._iso_exists(os.path.join("isolinux", "vmlinuz")):
             raise oz.OzException.OzException("Fedora/Red Hat installs can only be done using a boot.iso (netinst) or DVD image (LiveCDs are not supported)")
 
     def _modify_isolinux(self, initrdline):
@@ -627,25 +634,27 @@ echo -n "!$ADDR,%s!" > %s
             # hard-coded path
             initrd = "images/pxeboot/initrd.img"
 
-        (fd, outdir) = oz.ozutil.open_locked_file(self.kernelcache)
+        (fd, outdir) = oz.ozutil.open_locked_file(self.kernelcache, shared=True)
 
         try:
-            self._get_original_media('/'.join([self.url.rstrip('/'),
-                                               kernel.lstrip('/')]),
-                                     fd, outdir, force_download)
+            self.media.get_original_media('/'.join([self.url.rstrip('/'),
+                                                    kernel.lstrip('/')]),
+                                          fd, outdir, force_download,
+                                          self.kernelcache)
 
             # if we made it here, then we can copy the kernel into place
             shutil.copyfile(self.kernelcache, self.kernelfname)
         finally:
             os.close(fd)
 
-        (fd, outdir) = oz.ozutil.open_locked_file(self.initrdcache)
+        (fd, outdir) = oz.ozutil.open_locked_file(self.initrdcache, shared=True)
 
         try:
             try:
-                self._get_original_media('/'.join([self.url.rstrip('/'),
-                                                   initrd.lstrip('/')]),
-                                         fd, outdir, force_download)
+                self.media.get_original_media('/'.join([self.url.rstrip('/'),
+                                                        initrd.lstrip('/')]),
+                                              fd, outdir, force_download,
+                                              self.initrdcache)
             except:
                 os.unlink(self.kernelfname)
                 raise
@@ -933,13 +942,19 @@ label customboot
                 # if we found a cached JEOS, we don't need to do anything here;
                 # we'll copy the JEOS itself later on
                 return
-            elif os.access(self.modified_floppy_cache, os.F_OK):
+            elif self.cache_modified_media and self.media.modified_media_cached(self._modified_media_cache_path(self.modified_floppy_cache),
+                                                                                self.orig_floppy):
                 self.log.info("Using cached modified media")
-                shutil.copyfile(self.modified_floppy_cache, self.output_floppy)
+                oz.ozutil.clone_file(self._modified_media_cache_path(self.modified_floppy_cache),
+                                     self.output_floppy)
                 return
 
+        # the output may be a clone of the cached modified media from an
+        # earlier run, so it must be replaced rather than written into
+        oz.Media.remove_output_media(self.output_floppy)
+
         # name of the output file
-        (fd, outdir) = oz.ozutil.open_locked_file(self.orig_floppy)
+        (fd, outdir) = oz.ozutil.open_locked_file(self.orig_floppy, shared=True)
 
         try:
             self._get_original_floppy(self.url + "/images/bootnet.img", fd,
@@ -948,8 +963,9 @@ label customboot
             try:
                 self._modify_floppy()
                 if self.cache_modified_media:
-                    self.log.info("Caching modified media for future use")
-                    shutil.copyfile(self.output_floppy, self.modified_floppy_cache)
+                    self.media.cache_modified_media(self.output_floppy,
+                                                    self._modified_media_cache_path(self.modified_floppy_cache),
+                                                    self.orig_floppy, fd)
             finally:
                 self._cleanup_floppy()
         finally:
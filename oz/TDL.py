@@ -24,6 +24,7 @@ import os
 import re
 import sys
 import tempfile
+import threading
 try:
     import urllib.parse as urlparse
 except ImportError:
@@ -39,6 +40,23 @@ import lxml.etree
 import oz.OzException
 import oz.ozutil
 
+# the schema is loaded once per process; validation with it is serialized,
+# since the validator keeps its error log
+_relaxng = None
+_relaxng_lock = threading.Lock()
+
+
+def _get_relaxng():
+    """
+    Function to return the RelaxNG validator of the TDL schema, loading it on
+    first use.  Must be called with _relaxng_lock held.
+    """
+    global _relaxng  # pylint: disable=global-statement
+    if _relaxng is None:
+        _relaxng = lxml.etree.RelaxNG(file=os.path.join(os.path.dirname(__file__),
+                                                        'tdl.rng'))
+    return _relaxng
+
 
 def _xml_get_value(doc, xmlstring, component, optional=False):
     """
@@ -192,13 +210,14 @@ class TDL(object):
         self.doc = tree.getroot()
 
         # then validate the schema
-        relaxng = lxml.etree.RelaxNG(file=os.path.join(os.path.dirname(__file__),
-                                                       'tdl.rng'))
-        valid = relaxng.validate(self.doc)
+        with _relaxng_lock:
+            relaxng = _get_relaxng()
+            valid = relaxng.validate(self.doc)
+            if not valid:
+                errstr = "\nXML schema validation failed:\n"
+                for error in relaxng.error_log:
+                    errstr += "\tline %s: %s\n" % (error.line, error.message)
         if not valid:
-            errstr = "\nXML schema validation failed:\n"
-            for error in relaxng.error_log:
-                errstr += "\tline %s: %s\n" % (error.line, error.message)
             raise oz.OzException.OzException(errstr)
 
         template = self.doc.xpath('/template')
@@ -745,7 +745,7 @@ Subsystem       sftp    /usr/libexec/openssh/sftp-server
             raise oz.OzException.OzException("Customization can only be done on Ubuntu 11.04 or later")
 
         # ISOs that contain casper are desktop install CDs
-        if os.path.isdir(os.path.join(self.iso_contents, "casper")):
+        if self._iso_isdir("casper"):
             # as far as I can tell, the Ubuntu 13.10 Desktop installer always
             # crashes during preseeded installations, so raise an error for
             # a Desktop install
@@ -776,6 +776,16 @@ Subsystem       sftp    /usr/libexec/openssh/sftp-server
         else:
             shutil.copy(self.auto, outname)
 
+    def _iso_overlay_paths(self, iso):
+        """
+        Method to return the paths on the ISO that Ubuntu guests modify.
+        """
+        if not iso.isdir("isolinux"):
+            # very old media keeps isolinux in the root, and we have to move
+            # it (and the boot catalog) into an isolinux directory
+            return []
+        return ["isolinux/isolinux.cfg", "preseed/customiso.seed"]
+
     def _modify_iso(self):
         """
         Method to make the boot ISO auto-boot with appropriate parameters.
@@ -816,7 +826,7 @@ PROMPT 0
                 f.write("label customiso\n")
                 f.write("  menu label ^Customiso\n")
                 f.write("  menu default\n")
-                if os.path.isdir(os.path.join(self.iso_contents, "casper")):
+                if self._iso_isdir("casper"):
                     kernelname = "/casper/vmlinuz"
                     if self.config.efi_extension and self.tdl.arch == "x86_64":
                         kernelname += ".efi"
@@ -1241,25 +1251,27 @@ echo -n "!$ADDR,%s!" > /dev/ttyS1
             # hard-coded path
             initrd = "ubuntu-installer/%s/initrd.gz" % (self.debarch)
 
-        (fd, outdir) = oz.ozutil.open_locked_file(self.kernelcache)
+        (fd, outdir) = oz.ozutil.open_locked_file(self.kernelcache, shared=True)
 
         try:
-            self._get_original_media('/'.join([self.url.rstrip('/'),
-                                               kernel.lstrip('/')]),
-                                     fd, outdir, force_download)
+            self.media.get_original_media('/'.join([self.url.rstrip('/'),
+                                                    kernel.lstrip('/')]),
+                                          fd, outdir, force_download,
+                                          self.kernelcache)
 
             # if we made it here, then we can copy the kernel into place
             shutil.copyfile(self.kernelcache, self.kernelfname)
         finally:
             os.close(fd)
 
-        (fd, outdir) = oz.ozutil.open_locked_file(self.initrdcache)
+        (fd, outdir) = oz.ozutil.open_locked_file(self.initrdcache, shared=True)
 
         try:
             try:
-                self._get_original_media('/'.join([self.url.rstrip('/'),
-                                                   initrd.lstrip('/')]),
-                                         fd, outdir, force_download)
+                self.media.get_original_media('/'.join([self.url.rstrip('/'),
+                                                        initrd.lstrip('/')]),
+                                              fd, outdir, force_download,
+                                              self.initrdcache)
             except:
                 os.unlink(self.kernelfname)
                 raise
@@ -27,10 +27,14 @@ try:
     import configparser
 except ImportError:
     import ConfigParser as configparser
+import asyncio
+import email.utils
 import errno
 import fcntl
 import ftplib
 import gzip
+import hashlib
+import io
 import logging
 import os
 import random
@@ -41,6 +45,9 @@ import stat
 import struct
 import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
 import time
 import urllib
 
@@ -50,6 +57,9 @@ import monotonic
 
 import requests
 
+import oz.Download
+import oz.Locking
+
 
 def generate_full_auto_path(relative):
     """
@@ -116,6 +126,28 @@ def write_bytes_to_fd(fd, buf):
     return offset
 
 
+def pwrite_bytes_to_fd(fd, buf, offset):
+    """
+    Function to write all bytes in "buf" to "fd" starting at "offset".  The
+    file offset of "fd" is not changed, so this is safe to call from several
+    threads on the same fd.  This handles both EINTR and short writes.
+    """
+    size = len(buf)
+    done = 0
+    while size > 0:
+        try:
+            bytes_written = os.pwrite(fd, buf[done:], offset + done)
+            done += bytes_written
+            size -= bytes_written
+        except OSError as err:
+            # see write_bytes_to_fd() for why we retry here
+            if err.errno == errno.EINTR:
+                continue
+            raise
+
+    return done
+
+
 def read_bytes_from_fd(fd, num):
     """
     Function to read and return bytes from fd.  This handles the EINTR situation
@@ -137,10 +169,97 @@ def read_bytes_from_fd(fd, num):
     return ret
 
 
+# from <linux/fs.h>
+FICLONE = 0x40049409
+
+
+def reflink_fd(src_fd, dest_fd):
+    """
+    Function to turn the file behind dest_fd into a copy-on-write
+    clone of the file behind src_fd, so that no data has to be copied at
+    all.  Returns True on success, or False if the filesystem (or the
+    combination of filesystems) can't do it.
+    """
+    try:
+        fcntl.ioctl(dest_fd, FICLONE, src_fd)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def copy_fd_range(src_fd, dest_fd, src_offset, dest_offset, count):
+    """
+    Function to copy count bytes at src_offset in src_fd to
+    dest_offset in dest_fd.  The copy is done inside of the kernel with
+    copy_file_range() (which may itself reflink or offload the copy) or
+    sendfile() where available, and through userspace otherwise.
+    """
+    use_copy_file_range = hasattr(os, 'copy_file_range')
+    use_sendfile = hasattr(os, 'sendfile')
+    while count > 0:
+        if use_copy_file_range:
+            try:
+                copied = os.copy_file_range(src_fd, dest_fd, count,
+                                            src_offset, dest_offset)
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                     errno.EOPNOTSUPP, errno.EPERM):
+                    raise
+                # e.g. an older kernel copying across filesystems
+                use_copy_file_range = False
+                continue
+        elif use_sendfile:
+            try:
+                os.lseek(dest_fd, dest_offset, os.SEEK_SET)
+                copied = os.sendfile(dest_fd, src_fd, src_offset,
+                                     min(count, 0x7ffff000))
+            except OSError as err:
+                if err.errno == errno.EINTR:
+                    continue
+                if err.errno not in (errno.EINVAL, errno.ENOSYS):
+                    raise
+                use_sendfile = False
+                continue
+        else:
+            buf = os.pread(src_fd, min(count, 1024 * 1024), src_offset)
+            copied = pwrite_bytes_to_fd(dest_fd, buf, dest_offset)
+
+        if copied == 0:
+            raise Exception("Unexpected end of file copying %d more bytes at offset %d" % (count, src_offset))
+        src_offset += copied
+        dest_offset += copied
+        count -= copied
+
+
+def _copy_sparse_blocks(src_fd, dest_fd, offset, length, buf_size):
+    """
+    Internal function to copy length bytes at offset in src_fd to the same
+    offset in dest_fd through userspace, skipping over blocks of zeros so
+    that they become holes in dest_fd.  The logic here is all taken from
+    coreutils cp, specifically the 'sparse_copy' function.
+    """
+    end = offset + length
+    while offset < end:
+        buf = os.pread(src_fd, min(buf_size, end - offset), offset)
+        if not buf:
+            break
+
+        if buf.count(b'\0') != len(buf):
+            pwrite_bytes_to_fd(dest_fd, buf, offset)
+
+        offset += len(buf)
+
+
 def copyfile_sparse(src, dest):
     """
-    Function to copy a file sparsely if possible.  The logic here is
-    all taken from coreutils cp, specifically the 'sparse_copy' function.
+    Function to copy a file sparsely if possible.  If the filesystem supports
+    it, dest is made a copy-on-write clone of src.  Otherwise only the data
+    extents of src (as found with SEEK_DATA/SEEK_HOLE) are copied, inside of
+    the kernel, so the holes in src stay holes in dest.  If the extents can't
+    be found, the whole file is copied through userspace, skipping over
+    blocks of zeros.
     """
     if src is None:
         raise Exception("Source of copy cannot be None")
@@ -164,27 +283,37 @@ def copyfile_sparse(src, dest):
 
         try:
             sb = os.fstat(src_fd)
+            size = sb.st_size
+
+            if size == 0 or reflink_fd(src_fd, dest_fd):
+                return
 
             # See io_blksize() in coreutils for an explanation of why 32*1024
             buf_size = max(32 * 1024, sb.st_blksize)
 
-            size = sb.st_size
-            destlen = 0
-            while size != 0:
-                buf = read_bytes_from_fd(src_fd, min(buf_size, size))
-                if not buf:
+            offset = 0
+            while offset < size:
+                try:
+                    data = os.lseek(src_fd, offset, os.SEEK_DATA)
+                    hole = os.lseek(src_fd, data, os.SEEK_HOLE)
+                except AttributeError:
+                    # no SEEK_DATA on this platform
+                    _copy_sparse_blocks(src_fd, dest_fd, offset, size - offset, buf_size)
+                    break
+                except OSError as err:
+                    if err.errno == errno.ENXIO:
+                        # nothing but a hole from here to the end
+                        break
+                    if err.errno != errno.EINVAL:
+                        raise
+                    _copy_sparse_blocks(src_fd, dest_fd, offset, size - offset, buf_size)
                     break
 
-                buflen = len(buf)
-                if buf == '\0' * buflen:
-                    os.lseek(dest_fd, buflen, os.SEEK_CUR)
-                else:
-                    write_bytes_to_fd(dest_fd, buf)
-
-                destlen += buflen
-                size -= buflen
+                hole = min(hole, size)
+                copy_fd_range(src_fd, dest_fd, data, data, hole - data)
+                offset = hole
 
-            os.ftruncate(dest_fd, destlen)
+            os.ftruncate(dest_fd, size)
 
         finally:
             os.close(dest_fd)
@@ -192,6 +321,24 @@ def copyfile_sparse(src, dest):
         os.close(src_fd)
 
 
+def clone_file(src, dest):
+    """
+    Function to make dest a copy of src as cheaply as possible: a
+    copy-on-write clone if the filesystem supports it, and a sparse copy
+    otherwise.  dest never shares its inode with src (as a hardlink would),
+    since libvirt changes the owner and security label of the media it
+    attaches to a guest, and the guest may write to a floppy.  An existing
+    dest is replaced rather than written into.
+    """
+    try:
+        os.unlink(dest)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+
+    copyfile_sparse(src, dest)
+
+
 def bsd_split(line, digest_type):
     """
     Function to split a BSD-style checksum line into a filename and
@@ -460,6 +607,42 @@ def subprocess_check_output(*popenargs, **kwargs):
     return (stdout, stderr, retcode)
 
 
+async def async_subprocess_check_output(args, printfn=None):
+    """
+    asyncio version of subprocess_check_output().  The output of the
+    subprocess is read with the event loop, so that one loop can run many
+    subprocesses at once.
+    """
+    executable_exists(args[0])
+
+    process = await asyncio.create_subprocess_exec(*args,
+                                                   stdout=subprocess.PIPE,
+                                                   stderr=subprocess.PIPE)
+
+    async def _read(stream):
+        '''
+        Internal coroutine to gather the output on stream until it is closed.
+        '''
+        output = ''
+        while True:
+            data = await stream.read(4096)
+            if not data:
+                return output
+            data = data.decode('utf-8')
+            if printfn is not None:
+                printfn(data)
+            output += data
+
+    stdout, stderr = await asyncio.gather(_read(process.stdout),
+                                          _read(process.stderr))
+    retcode = await process.wait()
+
+    if retcode:
+        raise SubprocessException("'%s' failed(%d): %s" % (str((args,)), retcode, stderr + stdout), retcode)
+
+    return (stdout, stderr, retcode)
+
+
 def mkdir_p(path):
     """
     Function to make a directory and all intermediate directories as
@@ -699,17 +882,124 @@ def config_get_path(config, section, key, default):
     return path
 
 
-def rmtree_and_sync(directory):
+def _fd_removal_supported():
+    """
+    Internal function to find out whether this platform can remove a tree
+    relative to directory file descriptors.
+    """
+    try:
+        return (os.scandir in os.supports_fd and
+                os.unlink in os.supports_dir_fd and
+                os.rmdir in os.supports_dir_fd)
+    except AttributeError:
+        return False
+
+
+def _make_dir_removable(fd):
+    """
+    Internal function to give the owner full access to the directory open as
+    fd, if it doesn't have that already, so that it can be emptied.
+    """
+    mode = os.fstat(fd).st_mode
+    if mode & stat.S_IRWXU != stat.S_IRWXU:
+        os.fchmod(fd, mode | stat.S_IRWXU)
+
+
+def _open_dir_nofollow(name, dir_fd=None):
+    """
+    Internal function to open the directory name (relative to dir_fd, if
+    given) without following symlinks.  A directory that the owner can't
+    read (as extracted from read-only media) is made readable first.
+    """
+    flags = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW
+    try:
+        return os.open(name, flags, dir_fd=dir_fd)
+    except OSError as err:
+        if err.errno != errno.EACCES:
+            raise
+    os.chmod(name, stat.S_IRWXU, dir_fd=dir_fd)
+    return os.open(name, flags, dir_fd=dir_fd)
+
+
+def _remove_dir_contents(fd):
+    """
+    Internal function to remove everything inside of the directory open as
+    fd.  Everything is removed relative to the file descriptor of its
+    directory, symlinks are never followed, and only directories are
+    chmod'ed (and only if they need it); files can be removed from a
+    writable directory whatever their own mode is.
+    """
+    for entry in list(os.scandir(fd)):
+        if entry.is_dir(follow_symlinks=False):
+            child = _open_dir_nofollow(entry.name, fd)
+            try:
+                _make_dir_removable(child)
+                _remove_dir_contents(child)
+            finally:
+                os.close(child)
+            os.rmdir(entry.name, dir_fd=fd)
+        else:
+            os.unlink(entry.name, dir_fd=fd)
+
+
+def _remove_tree(directory):
+    """
+    Internal function to remove the directory tree at directory.
+    """
+    if not _fd_removal_supported():
+        recursively_add_write_bit(directory)
+        shutil.rmtree(directory)
+        return
+
+    fd = _open_dir_nofollow(directory)
+    try:
+        _make_dir_removable(fd)
+        _remove_dir_contents(fd)
+    finally:
+        os.close(fd)
+    os.rmdir(directory)
+
+
+def rmtree_and_sync(directory, background=False, logger=None):
     """
     Function to remove a directory tree and do an fsync afterwards.  Because
     the removal of the directory tree can cause a lot of metadata updates, it
     can cause a lot of disk activity.  By doing the fsync, we ensure that any
     metadata updates caused by us will not cause subsequent steps to fail.  This
     cannot help if the system is otherwise very busy, but it does ensure that
-    the problem is not self-inflicted.
-    """
+    the problem is not self-inflicted.  Read-only directories in the tree
+    (as extracted from install media) are made writable as needed.
+
+    If background is True, the tree is moved out of the way right away and
+    removed by a separate thread, which is returned; the directory can be
+    reused as soon as this function returns.  Otherwise None is returned.
+    The thread logs a failed removal to logger (or the logger of this
+    module), and the tree is left for remove_stale_trees() to pick up.
+    """
+    if background:
+        directory = directory.rstrip('/')
+        trash = tempfile.mkdtemp(prefix="." + os.path.basename(directory) + "-",
+                                 suffix=".removing",
+                                 dir=os.path.dirname(directory))
+        # the lock tells remove_stale_trees() that the tree is being removed
+        fd = os.open(trash, os.O_RDONLY)
+        oz.Locking.lock_file(fd)
+        try:
+            os.rename(directory, os.path.join(trash, "tree"))
+        except OSError as err:
+            os.close(fd)
+            os.rmdir(trash)
+            if err.errno == errno.ENOENT:
+                return None
+            raise
+        thread = threading.Thread(target=_remove_trash,
+                                  args=(trash, fd, logger or logging.getLogger(__name__)),
+                                  name="rmtree " + directory)
+        thread.start()
+        return thread
+
     try:
-        shutil.rmtree(directory)
+        _remove_tree(directory)
         fd = os.open(os.path.dirname(directory), os.O_RDONLY)
         try:
             os.fsync(fd)
@@ -720,6 +1010,132 @@ def rmtree_and_sync(directory):
             pass
         else:
             raise
+    return None
+
+
+def _remove_trash(trash, fd, logger):
+    """
+    Internal function to remove the directory trash that a tree was moved
+    to by rmtree_and_sync(), while holding the lock on it through fd.
+    """
+    try:
+        rmtree_and_sync(trash)
+    except Exception as err:  # pylint: disable=broad-except
+        logger.error("Failed to remove %s: %s", trash, err)
+    finally:
+        os.close(fd)
+
+
+def remove_stale_trees(directory, logger):
+    """
+    Function to remove the trees in directory that rmtree_and_sync() moved
+    out of the way, but that nobody is removing any more, because the
+    removal failed or the process doing it went away.  The removals are
+    done in the background; the list of the threads doing them is returned.
+    """
+    threads = []
+    try:
+        names = os.listdir(directory)
+    except OSError as err:
+        if err.errno == errno.ENOENT:
+            return threads
+        raise
+
+    for name in sorted(names):
+        trash = os.path.join(directory, name)
+        # a directory without a tree in it may be just about to get one
+        if not name.startswith('.') or not name.endswith('.removing') or \
+           not os.path.lexists(os.path.join(trash, "tree")):
+            continue
+        try:
+            fd = os.open(trash, os.O_RDONLY)
+        except OSError as err:
+            if err.errno == errno.ENOENT:
+                continue
+            raise
+        if not oz.Locking.lock_file(fd, blocking=False):
+            os.close(fd)
+            continue
+        logger.info("Removing stale %s", trash)
+        thread = threading.Thread(target=_remove_trash, args=(trash, fd, logger),
+                                  name="rmtree " + trash)
+        thread.start()
+        threads.append(thread)
+
+    return threads
+
+
+def _nearest_existing_path(path):
+    """
+    Function to return path, or the nearest parent directory of path that
+    exists if path does not (yet).
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def filesystem_id(path):
+    """
+    Function to return an identifier of the filesystem that path is on, or
+    would be created on if it does not exist yet.
+    """
+    return os.stat(_nearest_existing_path(path)).st_dev
+
+
+def filesystem_space(needs):
+    """
+    Function to add up a list of (description, path, bytes) space needs per
+    filesystem.  Paths that don't exist yet are accounted to the filesystem
+    they would be created on.  Returns a list of (path, needed, available)
+    tuples, one per filesystem in the order they were first seen, where path
+    is the first path of the needs on that filesystem, and needed and
+    available are in bytes.
+    """
+    filesystems = {}
+    order = []
+    for description_unused, path, size in needs:
+        existing = _nearest_existing_path(path)
+        dev = os.stat(existing).st_dev
+        if dev not in filesystems:
+            devdata = os.statvfs(existing)
+            filesystems[dev] = [path, 0, devdata.f_frsize * devdata.f_bavail]
+            order.append(dev)
+        filesystems[dev][1] += size
+
+    return [tuple(filesystems[dev]) for dev in order]
+
+
+def check_space_plan(plan, logger):
+    """
+    Function to log a plan of the disk space a build needs, as a list of
+    (step, directory, bytes, sparse) tuples, and check it against the free
+    space of the filesystems involved.  Steps that are sparse only need their
+    full size in the worst case, so a filesystem that only lacks room for
+    those is warned about.  Returns a list of descriptions of the
+    filesystems that don't have enough room for the steps that aren't
+    sparse.
+    """
+    for step, directory, size, sparse in plan:
+        logger.info("  %s: %s in %s%s", step, sizeof_fmt(size), directory,
+                    " (at most)" if sparse else "")
+
+    dense = filesystem_space([(step, directory, size) for step, directory, size, sparse in plan if not sparse])
+    short = ["%s (needs %s, has %s)" % (path, sizeof_fmt(needed),
+                                        sizeof_fmt(available))
+             for path, needed, available in dense if needed > available]
+    if short:
+        return short
+
+    for path, needed, available in filesystem_space([(step, directory, size) for step, directory, size, sparse_unused in plan]):
+        if needed > available:
+            logger.warning("%s may run out of space if the guest fills its disk (needs up to %s, has %s)",
+                           path, sizeof_fmt(needed), sizeof_fmt(available))
+    return []
 
 
 def parse_config(config_file):
@@ -813,16 +1229,27 @@ class LocalFileAdapter(requests.adapters.BaseAdapter):
         """Return the file specified by the given request
 
         @type req: C{PreparedRequest}
-        @todo: Should I bother filling `response.headers` and processing
-               If-Modified-Since and friends using `os.stat`?
         """
         if sys.version_info.major == 2:
             path = os.path.normcase(os.path.normpath(urllib.url2pathname(request.path_url)))  # pylint: disable=no-member
         else:
             path = os.path.normcase(os.path.normpath(urllib.request.url2pathname(request.path_url)))
         response = requests.Response()
+        # responses without a body still need something to close
+        response.raw = io.BytesIO(b'')
 
         response.status_code, response.reason = self._chkpath(request.method, path)
+        if response.status_code == 200:
+            mtime = int(os.path.getmtime(path))
+            response.headers['Last-Modified'] = email.utils.formatdate(mtime, usegmt=True)
+            since = request.headers.get('If-Modified-Since')
+            if since is not None:
+                try:
+                    if mtime <= email.utils.mktime_tz(email.utils.parsedate_tz(since)):
+                        response.status_code, response.reason = 304, "Not Modified"
+                except TypeError:
+                    # an unparseable date is ignored, as per RFC 7232
+                    pass
         if response.status_code == 200 and request.method.lower() != 'head':
             try:
                 response.raw = open(path, 'rb')
@@ -847,46 +1274,83 @@ class LocalFileAdapter(requests.adapters.BaseAdapter):
         pass
 
 
-def http_get_header(url, redirect=True):
-    """
-    Function to get the HTTP headers from a URL.  The available headers will be
-    returned in a dictionary.  If redirect=True (the default), then this
-    function will automatically follow http redirects through to the final
-    destination, entirely transparently to the caller.  If redirect=False, then
-    this function will follow http redirects through to the final destination,
-    and also store that information in the 'Redirect-URL' key.  Note that
-    'Redirect-URL' will always be None in the redirect=True case, and may be
-    None in the redirect=True case if no redirects were required.
-    """
-    with requests.Session() as requests_session:
-        requests_session.mount('file://', LocalFileAdapter())
-        response = requests_session.head(url, allow_redirects=redirect, stream=True, timeout=10)
-        info = response.headers
-        info['HTTP-Code'] = response.status_code
-        if not redirect:
-            info['Redirect-URL'] = response.headers.get('Location')
-        else:
-            info['Redirect-URL'] = None
+def hash_fd_range(fd, start, length, digest=None):
+    """
+    Function to compute the SHA256 of "length" bytes of fd starting
+    at "start".  If digest is not None, that hashlib object is updated
+    instead.  Returns the hex digest.
+    """
+    if digest is None:
+        digest = hashlib.sha256()
+    offset = start
+    end = start + length
+    while offset < end:
+        buf = os.pread(fd, min(1024 * 1024, end - offset), offset)
+        if not buf:
+            break
+        digest.update(buf)
+        offset += len(buf)
+    return digest.hexdigest()
 
-    return info
 
+def hash_path(path, digest=None):
+    """
+    Function to compute the SHA256 of the file or directory tree at path.  For
+    a directory, the relative name and type of every entry is hashed along
+    with the contents of the files (in sorted order), so that renaming,
+    adding or removing an entry changes the result.  If digest is not None,
+    that hashlib object is updated instead.  Returns the hex digest.
+    """
+    if digest is None:
+        digest = hashlib.sha256()
+
+    def _hash_file(filename, header=b''):
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if header:
+                # the size delimits the contents from the next entry
+                digest.update(header + str(size).encode('ascii') + b'\0')
+            hash_fd_range(fd, 0, size, digest)
+        finally:
+            os.close(fd)
 
-def http_download_file(url, fd, show_progress, logger):
+    if not os.path.isdir(path):
+        _hash_file(path)
+        return digest.hexdigest()
+
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        relative = os.path.relpath(dirpath, path)
+        for name in dirnames:
+            digest.update(b'd\0' + os.path.join(relative, name).encode('utf-8') + b'\0')
+        for name in sorted(filenames):
+            fullname = os.path.join(dirpath, name)
+            if os.path.islink(fullname):
+                digest.update(b'l\0' + os.path.join(relative, name).encode('utf-8') + b'\0' +
+                              os.readlink(fullname).encode('utf-8') + b'\0')
+                continue
+            _hash_file(fullname,
+                       b'f\0' + os.path.join(relative, name).encode('utf-8') + b'\0')
+    return digest.hexdigest()
+
+
+def http_get_header(url, redirect=True, headers=None):
+    """
+    Function to get the HTTP headers from a URL.  This is
+    oz.Download.http_get_header(), kept here for compatibility.
+    """
+    return oz.Download.http_get_header(url, redirect, headers)
+
+
+def http_download_file(url, fd, show_progress, logger, workers=1,
+                       manifest=None, digest=None):
     """
-    Function to download a file from url to file descriptor fd.
+    Function to download a file from url to file descriptor fd.  This is
+    oz.Download.http_download_file(), kept here for compatibility.
     """
-    with requests.Session() as requests_session:
-        requests_session.mount('file://', LocalFileAdapter())
-        response = requests_session.get(url, stream=True, allow_redirects=True,
-                                        headers={'Accept-Encoding': ''})
-        file_size = int(response.headers.get('Content-Length'))
-        chunk_size = 10 * 1024 * 1024
-        done = 0
-        for chunk in response.iter_content(chunk_size):
-            write_bytes_to_fd(fd, chunk)
-            done += len(chunk)
-            if show_progress:
-                logger.debug("%dkB of %dkB" % (done / 1024, file_size / 1024))
+    oz.Download.http_download_file(url, fd, show_progress, logger, workers,
+                                   manifest, digest)
 
 
 def ftp_download_directory(server, username, password, basepath, destination, port=None):
@@ -1028,6 +1492,31 @@ def recursively_add_write_bit(inputdir):
                     raise
 
 
+def extract_writable_tar(fileobj, destination):
+    """
+    Function to extract the tar stream read from fileobj to destination.
+    Every directory is created with full owner permissions, and every file
+    is created readable and writable by the owner, so that a tree coming
+    from read-only media can be modified and removed later on without
+    having to walk it again to fix up the modes.
+    """
+    kwargs = {}
+    if hasattr(tarfile, 'fully_trusted_filter'):
+        # the member has been through tar_filter() below already
+        kwargs['filter'] = 'fully_trusted'
+
+    with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+        tar.copybufsize = 1024 * 1024
+        for member in tar:
+            if hasattr(tarfile, 'tar_filter'):
+                member = tarfile.tar_filter(member, destination)
+            if member.isdir():
+                member.mode |= stat.S_IRWXU
+            elif member.isreg():
+                member.mode |= stat.S_IRUSR | stat.S_IWUSR
+            tar.extract(member, destination, **kwargs)
+
+
 def find_uefi_firmware(arch):
     '''
     A function to find the UEFI firmware file that corresponds to a certain
@@ -1088,23 +1577,12 @@ def find_uefi_firmware(arch):
     raise Exception("UEFI firmware is not installed!")
 
 
-def open_locked_file(filename):
+def open_locked_file(filename, shared=False):
     """
-    A function to open and lock a file.  Returns a file descriptor referencing
-    the open and locked file.
+    A function to open and lock a file.  This is
+    oz.Locking.open_locked_file(), kept here for compatibility.
     """
-    outdir = os.path.dirname(filename)
-    mkdir_p(outdir)
-
-    fd = os.open(filename, os.O_RDWR | os.O_CREAT)
-
-    try:
-        fcntl.lockf(fd, fcntl.LOCK_EX)
-    except:
-        os.close(fd)
-        raise
-
-    return (fd, outdir)
+    return oz.Locking.open_locked_file(filename, shared)
 
 
 def lxml_subelement(root, name, text=None, attributes=None):
@@ -1121,27 +1599,34 @@ def lxml_subelement(root, name, text=None, attributes=None):
     return tmp
 
 
-def timed_loop(max_time, cb, msg, cb_arg=None):
+def timed_loop(max_time, cb, msg, cb_arg=None, event=None):
     '''
     A function to deal with waiting for an event to occur.  Given a
     maximum time to wait, a callback, and a message, it will wait until the maximum
     time for the event to occur.  Each time through the loop, it will do the following:
 
     1.  Check to see if it has been at least 10 seconds since it last logged.  If so, it
-        will log right now.
+        will log right now, and go on to step 2; otherwise it goes on to step 3.
     2.  Call the callback to check for the event.  If the callback returns True, the
         loop quits immediately.  If it returns False, go on to step 3.
     3.  Sleep for the portion of 1 second that was not taken up by the callback.
 
+    So the callback is called about every 10 seconds.
+
     If the event occurred (the callback returned True), then this function returns
     True.  If we timed out while waiting for the event to occur, this function returns
     False.
+
+    If event (a threading.Event) is given, the sleep in step 3 is a wait on it, and
+    the loop returns True as soon as it is set, without calling the callback.
     '''
     log = logging.getLogger('%s' % (__name__))
     now = monotonic.monotonic()
     end = now + max_time
     next_print = now
     while now < end:
+        if event is not None and event.is_set():
+            return True
         now = monotonic.monotonic()
         if now >= next_print:
             left = int(end) - int(now)
@@ -1161,9 +1646,49 @@ def timed_loop(max_time, cb, msg, cb_arg=None):
             # Otherwise, sleep for a time.  Note that we try to maintain
             # on our starting boundary, so we'll sleep less than a second
             # here almost always.
-            time.sleep(sleep_time)
+            if event is not None:
+                event.wait(sleep_time)
+            else:
+                time.sleep(sleep_time)
+
+    return event is not None and event.is_set()
+
+
+async def async_timed_loop(max_time, cb, msg, cb_arg=None, event=None):
+    '''
+    asyncio version of timed_loop().  The callback is a coroutine function,
+    and event (if given) an asyncio.Event; the wait between calls of the
+    callback only suspends the calling task, so that one event loop can wait
+    on many things at once.
+    '''
+    log = logging.getLogger(__name__)
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    end = now + max_time
+    next_print = now
+    while now < end:
+        if event is not None and event.is_set():
+            return True
+        now = loop.time()
+        if now >= next_print:
+            left = max(int(end) - int(now), 0)
+            log.debug("%s, %d/%d", msg, left, max_time)
+            next_print = now + 10
+
+            if await cb(cb_arg):
+                return True
+
+        sleep_time = 1.0 - (loop.time() - now)
+        if sleep_time > 0:
+            if event is not None:
+                try:
+                    await asyncio.wait_for(event.wait(), sleep_time)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(sleep_time)
 
-    return False
+    return event is not None and event.is_set()
 
 
 def get_free_port():
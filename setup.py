@@ -8,7 +8,8 @@ RELEASE = '0'
 
 datafiles = [('share/man/man1', ['man/oz-install.1', 'man/oz-generate-icicle.1',
                                  'man/oz-customize.1',
-                                 'man/oz-cleanup-cache.1']),
+                                 'man/oz-cleanup-cache.1',
+                                 'man/oz-build-many.1']),
              ('share/man/man5', ['man/oz-examples.5'])
              ]
 
@@ -68,7 +69,7 @@ setup(name='oz',
       package_data={'oz': ['auto/*', '*.rng']},
       packages=['oz'],
       scripts=['oz-install', 'oz-generate-icicle', 'oz-customize',
-               'oz-cleanup-cache'],
+               'oz-cleanup-cache', 'oz-build-many'],
       cmdclass={'sdist': sdist,
                 'test' : pytest },
       data_files = datafiles,
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+import json
+import os
+import sys
+import threading
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    import pytest
+except ImportError:
+    print('Unable to import pytest.  Is pytest installed?')
+    sys.exit(1)
+
+# Find oz
+prefix = '.'
+for i in range(0,3):
+    if os.path.isdir(os.path.join(prefix, 'oz')):
+        sys.path.insert(0, prefix)
+        break
+    else:
+        prefix = '../' + prefix
+
+try:
+    import oz.Batch
+    import oz.OzException
+    import oz.ozutil
+except ImportError:
+    print('Unable to import oz.  Is oz installed?')
+    sys.exit(1)
+
+def test_read_manifest(tmpdir):
+    manifest = os.path.join(str(tmpdir), 'manifest.json')
+    with open(manifest, 'w') as f:
+        json.dump(['f38.tdl',
+                   {'tdl': '/abs/debian.tdl', 'auto': 'debian.preseed',
+                    'timeout': '3600', 'customize': True}], f)
+
+    entries = oz.Batch.read_manifest(manifest)
+    assert(len(entries) == 2)
+    assert(entries[0].tdl == os.path.join(str(tmpdir), 'f38.tdl'))
+    assert(entries[0].auto is None)
+    assert(not entries[0].customize)
+    assert(entries[1].tdl == '/abs/debian.tdl')
+    assert(entries[1].auto == os.path.join(str(tmpdir), 'debian.preseed'))
+    assert(entries[1].timeout == 3600)
+    assert(entries[1].customize)
+    assert(not entries[1].generate_icicle)
+
+def test_read_manifest_bad_key(tmpdir):
+    manifest = os.path.join(str(tmpdir), 'manifest.json')
+    with open(manifest, 'w') as f:
+        json.dump([{'tdl': 'f38.tdl', 'memory': 4096}], f)
+
+    with pytest.raises(oz.OzException.OzException):
+        oz.Batch.read_manifest(manifest)
+
+def test_admission_pool_limits():
+    pool = oz.Batch.AdmissionPool(4, 4096)
+    first = pool.acquire(2, 2048)
+    second = pool.acquire(2, 1024)
+
+    started = threading.Event()
+    def _third():
+        reservation = pool.acquire(1, 1024)
+        started.set()
+        pool.release(reservation)
+
+    thread = threading.Thread(target=_third)
+    thread.start()
+    # no CPUs left until one of the others is done
+    assert(not started.wait(0.2))
+    pool.release(first)
+    assert(started.wait(5))
+    thread.join()
+    pool.release(second)
+    assert(pool.running == 0)
+    assert(pool.used_cpus == 0)
+
+def test_admission_pool_oversized_alone():
+    pool = oz.Batch.AdmissionPool(1, 1024)
+    # bigger than the host, but nothing else is running
+    reservation = pool.acquire(8, 8192)
+    pool.release(reservation)
+
+def test_admission_pool_disk(tmpdir):
+    pool = oz.Batch.AdmissionPool(16, 65536)
+    path = str(tmpdir)
+    free = oz.ozutil.filesystem_space([('test', path, 0)])[0][2]
+    first = pool.acquire(1, 1024, [('download', path, free - 10)])
+
+    started = threading.Event()
+    def _second():
+        reservation = pool.acquire(1, 1024, [('download', path, 20)])
+        started.set()
+        pool.release(reservation)
+
+    thread = threading.Thread(target=_second)
+    thread.start()
+    assert(not started.wait(0.2))
+    pool.release(first)
+    assert(started.wait(5))
+    thread.join()
+
+def test_admission_pool_disk_refresh(tmpdir, monkeypatch):
+    pool = oz.Batch.AdmissionPool(16, 65536)
+    path = str(tmpdir)
+    free = [1000]
+    def _filesystem_space(needs):
+        return [(need[1], need[2], free[0]) for need in needs]
+    monkeypatch.setattr(oz.ozutil, 'filesystem_space', _filesystem_space)
+
+    first = pool.acquire(1, 1024, [('disk image', path, 600)])
+    # something that needs no disk space keeps running throughout
+    other = pool.acquire(1, 1024)
+
+    started = threading.Event()
+    def _second():
+        reservation = pool.acquire(1, 1024, [('disk image', path, 500)])
+        started.set()
+        pool.release(reservation)
+
+    thread = threading.Thread(target=_second)
+    thread.start()
+    assert(not started.wait(0.2))
+    # the first build leaves its disk image behind when it is done
+    free[0] = 400
+    pool.release(first)
+    assert(not started.wait(0.2))
+    # and then someone removes it
+    free[0] = 1000
+    with pool.cond:
+        pool.cond.notify_all()
+    assert(started.wait(5))
+    thread.join()
+    pool.release(other)
+
+# test oz.Batch.install_guest
+def _mock_guest():
+    guest = mock.Mock()
+    guest.check_space.return_value = [('disk image', '/var/lib/libvirt/images', 10, True)]
+    guest.install.return_value = '<domain/>'
+    guest.generate_icicle.return_value = '<icicle/>'
+    guest.install_cpus = 1
+    guest.install_memory = 1024
+    guest.jeos_flatten = False
+    return guest
+
+def test_install_guest():
+    guest = _mock_guest()
+    libvirt_xml, icicle_xml = oz.Batch.install_guest(guest, False, False, False,
+                                                     True, 1200)
+    assert(libvirt_xml == '<domain/>')
+    assert(icicle_xml == '<icicle/>')
+    assert([call[0] for call in guest.method_calls] == ['check_for_guest_conflict',
+                                                        'check_space',
+                                                        'generate_install_media',
+                                                        'generate_diskimage',
+                                                        'install',
+                                                        'cleanup_install',
+                                                        'generate_icicle'])
+    guest.install.assert_called_once_with(1200, False)
+
+def test_install_guest_failed_install():
+    guest = _mock_guest()
+    guest.install.side_effect = oz.OzException.OzException('install failed')
+    pool = oz.Batch.AdmissionPool(4, 4096)
+
+    with pytest.raises(oz.OzException.OzException):
+        oz.Batch.install_guest(guest, cleanup=True, pool=pool)
+    assert(guest.cleanup_old_guest.call_count == 2)
+    assert(guest.cleanup_install.call_count == 1)
+    # the failed build gave its reservation back
+    assert(pool.running == 0)
+    assert(pool.used_cpus == 0)
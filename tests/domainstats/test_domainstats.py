@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+import logging
+import os
+import sys
+
+try:
+    import pytest
+except ImportError:
+    print('Unable to import pytest.  Is pytest installed?')
+    sys.exit(1)
+
+# Find oz
+prefix = '.'
+for i in range(0,3):
+    if os.path.isdir(os.path.join(prefix, 'oz')):
+        sys.path.insert(0, prefix)
+        break
+    else:
+        prefix = '../' + prefix
+
+try:
+    import libvirt
+    import oz.DomainStats
+    import oz.OzException
+except ImportError:
+    print('Unable to import oz.  Is oz installed?')
+    sys.exit(1)
+
+STATS = {
+    'block.count': 2,
+    'block.0.name': 'vda',
+    'block.0.rd.reqs': 10,
+    'block.0.wr.reqs': 5,
+    'block.1.name': 'hdc',
+    'block.1.rd.reqs': 7,
+    'net.count': 1,
+    'net.0.name': 'vnet0',
+    'net.0.rx.bytes': 1000,
+    'net.0.tx.bytes': 24,
+}
+
+# test oz.DomainStats.device_totals
+def test_device_totals():
+    assert(oz.DomainStats.device_totals(STATS, ['vda'], ['vnet0']) == (15, 1024))
+    assert(oz.DomainStats.device_totals(STATS, ['vda', 'hdc'], []) == (22, 0))
+
+def test_device_totals_missing_device():
+    assert(oz.DomainStats.device_totals(STATS, ['vdb'], ['vnet0']) is None)
+    assert(oz.DomainStats.device_totals(STATS, ['vda'], ['vnet1']) is None)
+    assert(oz.DomainStats.device_totals({}, ['vda'], []) is None)
+
+class FakeDomain(object):
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+    def UUIDString(self):
+        return self.uuid
+
+class FakeConnection(object):
+    def __init__(self, gone):
+        self.gone = gone
+        self.calls = []
+
+    def domainListGetStats(self, doms, stats=0, flags=0):
+        self.calls.append([dom.UUIDString() for dom in doms])
+        if any([dom.UUIDString() in self.gone for dom in doms]):
+            raise libvirt.libvirtError('Domain not found')
+        return [(dom, {'block.count': 0, 'uuid': dom.UUIDString()}) for dom in doms]
+
+# test oz.DomainStats.StatsSampler
+def test_sampler_registered_domains_only():
+    conn = FakeConnection([])
+    sampler = oz.DomainStats.StatsSampler(conn)
+    first = FakeDomain('first')
+    sampler.register(first)
+    assert(sampler.sample(first)['uuid'] == 'first')
+    assert(conn.calls == [['first']])
+    # within the interval, the same sample is returned
+    sampler.sample(first)
+    assert(len(conn.calls) == 1)
+    sampler.unregister(first)
+    assert(sampler.domains == {})
+
+def test_sampler_domain_gone():
+    conn = FakeConnection(['gone'])
+    sampler = oz.DomainStats.StatsSampler(conn)
+    alive = FakeDomain('alive')
+    gone = FakeDomain('gone')
+    sampler.register(alive)
+    sampler.register(gone)
+    assert(sampler.sample(alive)['uuid'] == 'alive')
+    assert(sampler.sample(gone) is None)
+
+class FakeActiveDomain(FakeDomain):
+    def __init__(self, uuid):
+        FakeDomain.__init__(self, uuid)
+        self.disk_reqs = 0
+        self.net_bytes = 0
+
+    def blockStats(self, dev):
+        return (self.disk_reqs, 0, 0, 0, 0)
+
+    def interfaceStats(self, dev):
+        return (self.net_bytes, 0, 0, 0, 0, 0, 0, 0)
+
+# test oz.DomainStats.InstallActivity
+def test_install_activity():
+    # without bulk statistics, the devices are queried one by one
+    conn = object()
+    dom = FakeActiveDomain('install')
+    activity = oz.DomainStats.InstallActivity(conn, dom, ['vda'], ['vnet0'], 2)
+    dom.disk_reqs = 10
+    assert(not activity.check())
+    # too little network traffic to count as activity
+    dom.net_bytes = 100
+    assert(not activity.check())
+    assert(activity.countdown == 1)
+    dom.disk_reqs = 11
+    assert(not activity.check())
+    assert(activity.countdown == 2)
+    assert(not activity.check())
+    assert(not activity.check())
+    # the install hung
+    assert(activity.check())
+    assert(activity.saved_exception is None)
+
+def test_install_activity_unknown_error():
+    activity = oz.DomainStats.InstallActivity(object(), FakeActiveDomain('install'),
+                                              ['vda'], ['vnet0'], 2)
+    with pytest.raises(oz.OzException.OzException):
+        activity.raise_error(logging.getLogger('test_install_activity'))
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+
+import hashlib
+import json
+import logging
+import os
+import sys
+
+try:
+    import pytest
+except ImportError:
+    print('Unable to import pytest.  Is pytest installed?')
+    sys.exit(1)
+
+# Find oz
+prefix = '.'
+for i in range(0,3):
+    if os.path.isdir(os.path.join(prefix, 'oz')):
+        sys.path.insert(0, prefix)
+        break
+    else:
+        prefix = '../' + prefix
+
+try:
+    import oz.Download
+    import oz.ozutil
+except ImportError:
+    print('Unable to import oz.  Is oz installed?')
+    sys.exit(1)
+
+# test oz.Download._http_download_ranges
+def _range_http_server(directory):
+    try:
+        import http.server as httpserver
+    except ImportError:
+        import BaseHTTPServer as httpserver
+    import re
+    import threading
+
+    class RangeHandler(httpserver.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, body):
+            data = open(os.path.join(directory, self.path.lstrip('/')), 'rb').read()
+            start = 0
+            end = len(data) - 1
+            match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if match:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = int(match.group(2))
+                self.send_response(206)
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data)))
+            else:
+                self.send_response(200)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(end + 1 - start))
+            self.end_headers()
+            if body:
+                self.wfile.write(data[start:end + 1])
+
+        def do_HEAD(self):
+            self._send(False)
+
+        def do_GET(self):
+            self._send(True)
+
+    server = httpserver.HTTPServer(('127.0.0.1', 0), RangeHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+def test_http_download_file_ranges(tmpdir):
+    with open('/dev/urandom', 'rb') as infd:
+        data = infd.read(1024*1024 + 7)
+    with open(os.path.join(str(tmpdir), 'src'), 'wb') as f:
+        f.write(data)
+
+    server = _range_http_server(str(tmpdir))
+    try:
+        url = 'http://127.0.0.1:%d/src' % (server.server_address[1])
+        dst = os.path.join(str(tmpdir), 'dst')
+        fd = os.open(dst, os.O_RDWR | os.O_CREAT)
+        try:
+            digest = hashlib.sha256()
+            oz.Download._http_download_ranges(url, fd, len(data), 3, False, None,
+                                              segment_size=100*1024,
+                                              digest=digest)
+            assert(os.lseek(fd, 0, os.SEEK_CUR) == len(data))
+            assert(digest.hexdigest() == hashlib.sha256(data).hexdigest())
+        finally:
+            os.close(fd)
+    finally:
+        server.shutdown()
+    assert(open(dst, 'rb').read() == data)
+
+def test_http_download_file_resume(tmpdir):
+    with open('/dev/urandom', 'rb') as infd:
+        data = infd.read(300*1024)
+    with open(os.path.join(str(tmpdir), 'src'), 'wb') as f:
+        f.write(data)
+
+    server = _range_http_server(str(tmpdir))
+    try:
+        url = 'http://127.0.0.1:%d/src' % (server.server_address[1])
+        dst = os.path.join(str(tmpdir), 'dst')
+        manifest = dst + '.part'
+        # pretend that an earlier download got the first two blocks, but the
+        # second one was corrupted on disk afterwards
+        with open(dst, 'wb') as f:
+            f.write(data[:100*1024])
+            f.write(b'\0' * 100*1024)
+        blocks = {'0': hashlib.sha256(data[:100*1024]).hexdigest(),
+                  '1': hashlib.sha256(data[100*1024:200*1024]).hexdigest()}
+        with open(manifest, 'w') as f:
+            json.dump({'url': url, 'size': len(data), 'segment_size': 100*1024,
+                       'validator': None, 'blocks': blocks}, f)
+
+        fd = os.open(dst, os.O_RDWR)
+        try:
+            digest = hashlib.md5()
+            oz.Download._http_download_ranges(url, fd, len(data), 2, False, None,
+                                              segment_size=100*1024,
+                                              manifest=manifest, source=url,
+                                              digest=digest)
+        finally:
+            os.close(fd)
+    finally:
+        server.shutdown()
+    assert(open(dst, 'rb').read() == data)
+    assert(digest.hexdigest() == hashlib.md5(data).hexdigest())
+    assert(not os.path.exists(manifest))
+
+# test oz.Download.get_http_session/configure_http_session
+def test_http_session_shared():
+    session = oz.Download.get_http_session()
+    assert(oz.Download.get_http_session() is session)
+
+    oz.Download.configure_http_session(pool_size=4, retries=1, backoff=0)
+    try:
+        new_session = oz.Download.get_http_session()
+        assert(new_session is not session)
+        adapter = new_session.get_adapter('http://example.com/')
+        assert(adapter.max_retries.total == 1)
+        assert(isinstance(new_session.get_adapter('file:///tmp'), oz.ozutil.LocalFileAdapter))
+    finally:
+        oz.Download.configure_http_session(pool_size=10, retries=3, backoff=0.5)
+
+# test oz.Download.configure_from_config
+def test_configure_from_config():
+    try:
+        import configparser
+    except ImportError:
+        import ConfigParser as configparser
+    config = configparser.ConfigParser()
+    config.add_section('download')
+    config.set('download', 'workers', '12')
+    config.set('download', 'retries', '1')
+    try:
+        assert(oz.Download.configure_from_config(config) == 12)
+        adapter = oz.Download.get_http_session().get_adapter('http://example.com/')
+        assert(adapter.max_retries.total == 1)
+        # every worker gets a pooled connection
+        assert(adapter._pool_maxsize == 12)
+    finally:
+        oz.Download.configure_http_session(pool_size=10, retries=3, backoff=0.5)
+
+# test oz.Download.http_download_file without a Content-Length
+def test_http_download_file_chunked(tmpdir):
+    try:
+        import http.server as httpserver
+    except ImportError:
+        import BaseHTTPServer as httpserver
+    import threading
+
+    data = b'0123456789' * 1000
+
+    class ChunkedHandler(httpserver.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for start in range(0, len(data), 4096):
+                chunk = data[start:start + 4096]
+                self.wfile.write(b'%x\r\n' % len(chunk) + chunk + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+
+    server = httpserver.HTTPServer(('127.0.0.1', 0), ChunkedHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:%d/media.iso' % server.server_address[1]
+        dst = os.path.join(str(tmpdir), 'dst')
+        fd = os.open(dst, os.O_RDWR | os.O_CREAT)
+        try:
+            digest = hashlib.sha256()
+            oz.Download.http_download_file(url, fd, True, logging.getLogger(),
+                                           digest=digest)
+        finally:
+            os.close(fd)
+    finally:
+        server.shutdown()
+    assert(open(dst, 'rb').read() == data)
+    assert(digest.hexdigest() == hashlib.sha256(data).hexdigest())
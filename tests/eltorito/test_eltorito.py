@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+import os
+import struct
+import sys
+
+try:
+    import pytest
+except ImportError:
+    print('Unable to import pytest.  Is pytest installed?')
+    sys.exit(1)
+
+# Find oz
+prefix = '.'
+for i in range(0,3):
+    if os.path.isdir(os.path.join(prefix, 'oz')):
+        sys.path.insert(0, prefix)
+        break
+    else:
+        prefix = '../' + prefix
+
+try:
+    import oz.ElTorito
+    import oz.OzException
+except ImportError:
+    print('Unable to import oz.  Is oz installed?')
+    sys.exit(1)
+
+SECTOR = 2048
+
+def _validation_entry(platform):
+    entry = struct.pack('<BBH24sHBB', 1, platform, 0, b'oz test', 0, 0x55, 0xaa)
+    words = struct.unpack('<16H', entry)
+    checksum = (0x10000 - (sum(words) & 0xffff)) & 0xffff
+    return entry[:28] + struct.pack('<H', checksum) + entry[30:]
+
+def _boot_entry(indicator, media, count, lba):
+    return struct.pack('<BBHBBHL20s', indicator, media, 0, 0, 0, count, lba, b'')
+
+def _make_iso(path, efi=True, corrupt=False):
+    """
+    Build an image with an El Torito catalog at sector 20 holding an x86
+    no-emulation entry (4 virtual sectors at sector 21) and, optionally, an
+    EFI section whose entry (sector count 1) points at a FAT image of 3
+    sectors at sector 22.
+    """
+    sectors = {}
+    sectors[16] = struct.pack('=B5sB', 1, b'CD001', 1)
+    sectors[17] = (struct.pack('=B5sB32s32s', 0, b'CD001', 1, b'EL TORITO SPECIFICATION', b'') +
+                   struct.pack('<L', 20))
+    sectors[18] = struct.pack('=B5sB', 255, b'CD001', 1)
+
+    catalog = _validation_entry(0) + _boot_entry(0x88, 0, 4, 21)
+    if efi:
+        catalog += struct.pack('<BBH28s', 0x91, 0xef, 1, b'')
+        catalog += _boot_entry(0x88, 0, 1, 22)
+    if corrupt:
+        catalog = catalog[:4] + b'X' + catalog[5:]
+    sectors[20] = catalog
+
+    bios = b'B' * 2048
+    sectors[21] = bios
+    fat = bytearray(SECTOR * 3)
+    struct.pack_into('<H', fat, 11, 512)
+    struct.pack_into('<H', fat, 19, 12)
+    fat[510:512] = b'\x55\xaa'
+    fat = bytes(fat)
+    for i in range(3):
+        sectors[22 + i] = fat[i * SECTOR:(i + 1) * SECTOR]
+
+    with open(path, 'wb') as f:
+        for sector in range(max(sectors) + 1):
+            f.write(sectors.get(sector, b'').ljust(SECTOR, b'\0'))
+
+    return bios, fat
+
+def test_eltorito_entries(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    bios, fat = _make_iso(isoname)
+    with oz.ElTorito.BootCatalog(isoname) as catalog:
+        assert(len(catalog.entries) == 2)
+        default = catalog.entries[0]
+        assert(default.platform == oz.ElTorito.PLATFORM_X86)
+        assert(default.bootable)
+        assert(default.media == oz.ElTorito.MEDIA_NO_EMULATION)
+        assert(default.size == 4 * 512)
+        efi = catalog.find(oz.ElTorito.PLATFORM_EFI)
+        assert(efi is catalog.entries[1])
+        # the real size comes from the FAT boot sector
+        assert(efi.size == 12 * 512)
+        assert(catalog.find(oz.ElTorito.PLATFORM_MAC) is None)
+
+        outfile = os.path.join(str(tmpdir), 'boot.bin')
+        catalog.extract(default, outfile)
+        assert(open(outfile, 'rb').read() == bios)
+        catalog.extract(efi, outfile)
+        assert(open(outfile, 'rb').read() == fat[:12 * 512])
+
+def test_eltorito_no_sections(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    _make_iso(isoname, efi=False)
+    with oz.ElTorito.BootCatalog(isoname) as catalog:
+        assert(len(catalog.entries) == 1)
+
+def test_eltorito_bad_checksum(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    _make_iso(isoname, corrupt=True)
+    with pytest.raises(oz.OzException.OzException):
+        oz.ElTorito.BootCatalog(isoname)
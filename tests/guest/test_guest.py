@@ -1,5 +1,7 @@
 #!/usr/bin/python
 
+import asyncio
+import concurrent.futures
 import sys
 import getpass
 try:
@@ -12,6 +14,8 @@ except:
     from io import StringIO
 import logging
 import os
+import socket
+import threading
 try:
     from unittest import mock
 except ImportError:
@@ -29,6 +33,7 @@ for i in range(0,3):
 try:
     import oz.TDL
     import oz.GuestFactory
+    import oz.OzException
 except ImportError as e:
     print(e)
     print('Unable to import oz.  Is oz installed or in your PYTHONPATH?')
@@ -662,3 +667,54 @@ def test_modify_libvirt_xml_diskimage_too_many_drivers():
             # Replace various smaller items as they are auto generated
             test_xml = handle.read() % (guest.uuid, route, guest.listen_port, guest.diskimage)
             guest._modify_libvirt_xml_diskimage(test_xml, guest.diskimage, 'qcow2')
+
+def test_async_install():
+    guest = setup_guest(tdlxml)
+
+    async def _build():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            with mock.patch.object(guest, 'install', return_value='<domain/>') as install:
+                xml = await guest.async_install(executor, 1200, True)
+        install.assert_called_once_with(1200, True)
+        return xml
+
+    assert asyncio.run(_build()) == '<domain/>'
+
+def test_async_install_no_executor():
+    guest = setup_guest(tdlxml)
+
+    with pytest.raises(oz.OzException.OzException):
+        asyncio.run(guest.async_install(None, 1200, True))
+
+def test_async_wait_for_guest_boot():
+    guest = setup_guest(tdlxml)
+
+    # stands in for the TCP chardev of qemu that the guest announces itself on
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', guest.listen_port))
+    server.listen(1)
+
+    def _announce():
+        conn, addr = server.accept()
+        conn.sendall(b'garbage!127.0.0.1,' + str(guest.uuid).encode('utf-8') + b'!')
+        conn.close()
+
+    announcer = threading.Thread(target=_announce)
+    announcer.start()
+
+    async def _boot():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            # the blocking method hands the wait over to the event loop
+            with mock.patch.object(guest, '_async_wait_for_guest_boot',
+                                   wraps=guest._async_wait_for_guest_boot) as native:
+                addr = await guest._run_blocking(executor, guest._wait_for_guest_boot,
+                                                 mock.Mock())
+            assert(native.call_count == 1)
+        return addr
+
+    try:
+        assert(asyncio.run(_boot()) == '127.0.0.1')
+    finally:
+        announcer.join()
+        server.close()
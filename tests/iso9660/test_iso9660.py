@@ -0,0 +1,286 @@
+#!/usr/bin/python
+
+import os
+import stat
+import struct
+import sys
+
+try:
+    import pytest
+except ImportError:
+    print('Unable to import pytest.  Is pytest installed?')
+    sys.exit(1)
+
+# Find oz
+prefix = '.'
+for i in range(0,3):
+    if os.path.isdir(os.path.join(prefix, 'oz')):
+        sys.path.insert(0, prefix)
+        break
+    else:
+        prefix = '../' + prefix
+
+try:
+    import oz.ISO9660
+    import oz.OzException
+except ImportError:
+    print('Unable to import oz.  Is oz installed?')
+    sys.exit(1)
+
+SECTOR = 2048
+
+def _both16(value):
+    return struct.pack('<H', value) + struct.pack('>H', value)
+
+def _both32(value):
+    return struct.pack('<L', value) + struct.pack('>L', value)
+
+def _record(name, lba, size, flags=0, su=b''):
+    body = _both32(lba) + _both32(size) + b'\0' * 7 + struct.pack('=BBB', flags, 0, 0) + _both16(1) + struct.pack('=B', len(name)) + name
+    if len(name) % 2 == 0:
+        body += b'\0'
+    body += su
+    rec = struct.pack('=BB', len(body) + 2, 0) + body
+    if len(rec) % 2:
+        rec = struct.pack('=B', len(rec) + 1) + rec[1:] + b'\0'
+    return rec
+
+def _susp(signature, body):
+    return signature + struct.pack('=BB', len(body) + 4, 1) + body
+
+def _rr(name=None, mode=None, symlink=None, sp=False):
+    su = b''
+    if sp:
+        su += _susp(b'SP', b'\xbe\xef\x00')
+    if mode is not None:
+        su += _susp(b'PX', _both32(mode) + _both32(1) + _both32(0) + _both32(0))
+    if name is not None:
+        su += _susp(b'NM', b'\0' + name)
+    if symlink is not None:
+        components = b''
+        for component in symlink:
+            components += struct.pack('=BB', 0, len(component)) + component
+        su += _susp(b'SL', b'\0' + components)
+    return su
+
+def _volume_descriptor(desc_type, root, escapes=b''):
+    desc = struct.pack('=B5sB', desc_type, b'CD001', 1)
+    desc = desc.ljust(88, b'\0') + escapes
+    desc = desc.ljust(156, b'\0') + root
+    return desc.ljust(SECTOR, b'\0')
+
+def _make_iso(path, rock_ridge=False, joliet=False, udf=False):
+    """
+    Build a tiny ISO with the tree:
+      /ISOLINUX/ISOLINUX.CFG;1  (Rock Ridge: isolinux/isolinux.cfg)
+      /README.TXT;1             (Rock Ridge: ReadMe.txt, mode 0444)
+      /LINK.;1                  (Rock Ridge only: link -> isolinux/isolinux.cfg)
+    README.TXT is stored as a multi-extent file of two extents.
+    """
+    root_lba, sub_lba, cfg_lba, readme1_lba, readme2_lba = 20, 21, 22, 23, 24
+    jroot_lba, jsub_lba = 25, 26
+    cfg = b'default linux\n'
+    readme1 = b'A' * SECTOR
+    readme2 = b'the end\n'
+
+    def rr(**kwargs):
+        return _rr(**kwargs) if rock_ridge else b''
+
+    sub = (_record(b'\0', sub_lba, SECTOR, 2, rr(mode=0o40555)) +
+           _record(b'\1', root_lba, SECTOR, 2) +
+           _record(b'ISOLINUX.CFG;1', cfg_lba, len(cfg), 0, rr(name=b'isolinux.cfg', mode=0o100444)))
+    root = (_record(b'\0', root_lba, SECTOR, 2, rr(sp=True, mode=0o40555)) +
+            _record(b'\1', root_lba, SECTOR, 2) +
+            _record(b'ISOLINUX', sub_lba, SECTOR, 2, rr(name=b'isolinux', mode=0o40555)) +
+            _record(b'README.TXT;1', readme1_lba, len(readme1), 0x80, rr(name=b'ReadMe.txt', mode=0o100444)) +
+            _record(b'README.TXT;1', readme2_lba, len(readme2), 0, rr(name=b'ReadMe.txt', mode=0o100444)))
+    if rock_ridge:
+        root += _record(b'LINK.;1', 0, 0, 0, rr(name=b'link', mode=0o120777, symlink=[b'isolinux', b'isolinux.cfg']))
+
+    def joliet_name(name):
+        return name.encode('utf-16-be')
+    jsub = (_record(b'\0', jsub_lba, SECTOR, 2) + _record(b'\1', jroot_lba, SECTOR, 2) +
+            _record(joliet_name(u'IsoLinux.cfg;1'), cfg_lba, len(cfg)))
+    jroot = (_record(b'\0', jroot_lba, SECTOR, 2) + _record(b'\1', jroot_lba, SECTOR, 2) +
+             _record(joliet_name(u'IsoLinux'), jsub_lba, SECTOR, 2) +
+             _record(joliet_name(u'Read Me.txt;1'), readme1_lba, len(readme1), 0x80) +
+             _record(joliet_name(u'Read Me.txt;1'), readme2_lba, len(readme2)))
+
+    sectors = {}
+    sectors[16] = _volume_descriptor(1, _record(b'\0', root_lba, SECTOR, 2))
+    next_desc = 17
+    if joliet:
+        sectors[next_desc] = _volume_descriptor(2, _record(b'\0', jroot_lba, SECTOR, 2), b'%/E')
+        next_desc += 1
+    sectors[next_desc] = _volume_descriptor(255, b'')
+    if udf:
+        for i, identifier in enumerate([b'BEA01', b'NSR02', b'TEA01']):
+            sectors[next_desc + 1 + i] = struct.pack('=B5sB', 0, identifier, 1)
+    sectors[root_lba] = root
+    sectors[sub_lba] = sub
+    sectors[cfg_lba] = cfg
+    sectors[readme1_lba] = readme1
+    sectors[readme2_lba] = readme2
+    sectors[jroot_lba] = jroot
+    sectors[jsub_lba] = jsub
+
+    with open(path, 'wb') as f:
+        for sector in range(max(sectors) + 1):
+            f.write(sectors.get(sector, b'').ljust(SECTOR, b'\0'))
+
+    return cfg, readme1 + readme2
+
+def test_iso9660_plain(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    cfg, readme = _make_iso(isoname)
+    with oz.ISO9660.ISO9660(isoname) as iso:
+        assert(not iso.rock_ridge)
+        assert(not iso.joliet)
+        assert(not iso.udf)
+        assert(iso.listdir('/') == ['isolinux', 'readme.txt'])
+        assert(iso.isdir('isolinux'))
+        assert(iso.exists('/isolinux/isolinux.cfg'))
+        assert(not iso.exists('isolinux/vmlinuz'))
+        assert(iso.read('isolinux/isolinux.cfg') == cfg)
+        assert(iso.read('readme.txt') == readme)
+        assert(iso.lookup('readme.txt').size == len(readme))
+
+def test_iso9660_rock_ridge(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    cfg, readme = _make_iso(isoname, rock_ridge=True, joliet=True)
+    with oz.ISO9660.ISO9660(isoname) as iso:
+        assert(iso.rock_ridge)
+        assert(not iso.joliet)
+        assert(iso.listdir('/') == ['ReadMe.txt', 'isolinux', 'link'])
+        assert(iso.read('ReadMe.txt') == readme)
+        assert(iso.lookup('link').symlink == 'isolinux/isolinux.cfg')
+        assert(stat.S_IMODE(iso.lookup('isolinux/isolinux.cfg').mode) == 0o444)
+        assert(list(iso.walk()) == [('', ['isolinux'], ['ReadMe.txt', 'link']),
+                                    ('isolinux', [], ['isolinux.cfg'])])
+
+def test_iso9660_joliet(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    cfg, readme = _make_iso(isoname, joliet=True)
+    with oz.ISO9660.ISO9660(isoname) as iso:
+        assert(iso.joliet)
+        assert(iso.listdir('/') == ['IsoLinux', 'Read Me.txt'])
+        assert(iso.read('IsoLinux/IsoLinux.cfg') == cfg)
+        assert(iso.read('Read Me.txt') == readme)
+
+def test_iso9660_udf(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    _make_iso(isoname, udf=True)
+    with oz.ISO9660.ISO9660(isoname) as iso:
+        assert(iso.udf)
+
+def test_iso9660_extract(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    cfg, readme = _make_iso(isoname, rock_ridge=True)
+    dest = os.path.join(str(tmpdir), 'contents')
+    with oz.ISO9660.ISO9660(isoname) as iso:
+        iso.extract('/', dest)
+    assert(sorted(os.listdir(dest)) == ['ReadMe.txt', 'isolinux', 'link'])
+    assert(open(os.path.join(dest, 'isolinux', 'isolinux.cfg'), 'rb').read() == cfg)
+    assert(open(os.path.join(dest, 'ReadMe.txt'), 'rb').read() == readme)
+    assert(os.readlink(os.path.join(dest, 'link')) == 'isolinux/isolinux.cfg')
+    # everything must come out writable, so it can be modified and removed
+    assert(os.stat(os.path.join(dest, 'isolinux')).st_mode & stat.S_IWUSR)
+    assert(os.stat(os.path.join(dest, 'ReadMe.txt')).st_mode & stat.S_IWUSR)
+
+def test_iso9660_extract_missing(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    _make_iso(isoname)
+    with oz.ISO9660.ISO9660(isoname) as iso:
+        with pytest.raises(oz.OzException.OzException):
+            iso.extract('isolinux/vmlinuz', os.path.join(str(tmpdir), 'vmlinuz'))
+
+def test_iso9660_not_iso(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    with open(isoname, 'wb') as f:
+        f.write(b'\0' * SECTOR * 20)
+    with pytest.raises(oz.OzException.OzException):
+        oz.ISO9660.ISO9660(isoname)
+
+def test_iso9660_three_extents(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    root_lba = 20
+    parts = [b'A' * SECTOR, b'B' * SECTOR, b'the end\n']
+    root = (_record(b'\0', root_lba, SECTOR, 2) + _record(b'\1', root_lba, SECTOR, 2) +
+            _record(b'BIG.BIN;1', 21, len(parts[0]), 0x80) +
+            _record(b'BIG.BIN;1', 22, len(parts[1]), 0x80) +
+            _record(b'BIG.BIN;1', 23, len(parts[2])))
+    sectors = {16: _volume_descriptor(1, _record(b'\0', root_lba, SECTOR, 2)),
+               17: _volume_descriptor(255, b''),
+               root_lba: root, 21: parts[0], 22: parts[1], 23: parts[2]}
+    with open(isoname, 'wb') as f:
+        for sector in range(max(sectors) + 1):
+            f.write(sectors.get(sector, b'').ljust(SECTOR, b'\0'))
+
+    with oz.ISO9660.ISO9660(isoname) as iso:
+        assert(iso.listdir('/') == ['big.bin'])
+        assert(iso.lookup('big.bin').size == len(b''.join(parts)))
+        assert(iso.read('big.bin') == b''.join(parts))
+
+def _write(tmpdir, name, data):
+    path = os.path.join(str(tmpdir), name)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+def test_iso9660_patch_rock_ridge(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    cfg_unused, readme = _make_iso(isoname, rock_ridge=True, joliet=True)
+    newcfg = _write(tmpdir, 'isolinux.cfg', b'default customiso\n')
+    ks = _write(tmpdir, 'ks.cfg', b'install\n')
+
+    with oz.ISO9660.ISO9660Patcher(isoname) as patcher:
+        assert(patcher.can_patch('isolinux/isolinux.cfg'))
+        assert(patcher.can_patch('ks.cfg'))
+        assert(not patcher.can_patch('missing/ks.cfg'))
+        assert(not patcher.can_patch('readme.txt'))
+        assert(not patcher.can_patch('isolinux'))
+        patcher.patch('isolinux/isolinux.cfg', newcfg)
+        patcher.patch('ks.cfg', ks)
+        patcher.commit()
+
+    with oz.ISO9660.ISO9660(isoname) as iso:
+        assert(iso.rock_ridge)
+        assert(iso.listdir('/') == ['ReadMe.txt', 'isolinux', 'ks.cfg', 'link'])
+        assert(iso.read('isolinux/isolinux.cfg') == b'default customiso\n')
+        assert(iso.read('ks.cfg') == b'install\n')
+        assert(iso.read('ReadMe.txt') == readme)
+
+    # the Joliet tree has to see the same changes
+    with open(isoname, 'rb') as f:
+        data = f.read()
+    volume_size = struct.unpack_from('<L', data, 16 * SECTOR + 80)[0]
+    assert(volume_size * SECTOR == len(data))
+    os.unlink(isoname)
+    _make_iso(isoname, joliet=True)
+    with oz.ISO9660.ISO9660Patcher(isoname) as patcher:
+        patcher.patch('isolinux/isolinux.cfg', newcfg)
+        patcher.patch('ks.cfg', ks)
+        patcher.commit()
+    with oz.ISO9660.ISO9660(isoname) as iso:
+        assert(iso.joliet)
+        assert(iso.listdir('/') == ['IsoLinux', 'Read Me.txt', 'ks.cfg'])
+        assert(iso.read('IsoLinux/IsoLinux.cfg') == b'default customiso\n')
+        assert(iso.read('ks.cfg') == b'install\n')
+
+def test_iso9660_patch_grow_directory(tmpdir):
+    isoname = os.path.join(str(tmpdir), 'test.iso')
+    cfg, readme = _make_iso(isoname, rock_ridge=True)
+    names = ['extra-file-number-%02d.cfg' % i for i in range(60)]
+    with oz.ISO9660.ISO9660Patcher(isoname) as patcher:
+        for name in names:
+            patcher.patch(name, _write(tmpdir, name, name.encode('ascii')))
+        patcher.commit()
+
+    with oz.ISO9660.ISO9660(isoname) as iso:
+        # the root directory no longer fits in its sector, so it moved
+        assert(iso.root.extents[0][0] != 20 * SECTOR)
+        assert(iso.listdir('/') == sorted(['ReadMe.txt', 'isolinux', 'link'] + names))
+        for name in names:
+            assert(iso.read(name) == name.encode('ascii'))
+        assert(iso.read('isolinux/isolinux.cfg') == cfg)
+        assert(iso.read('ReadMe.txt') == readme)
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+
+import os
+import sys
+
+try:
+    import pytest
+except ImportError:
+    print('Unable to import pytest.  Is pytest installed?')
+    sys.exit(1)
+
+# Find oz
+prefix = '.'
+for i in range(0,3):
+    if os.path.isdir(os.path.join(prefix, 'oz')):
+        sys.path.insert(0, prefix)
+        break
+    else:
+        prefix = '../' + prefix
+
+try:
+    import oz.ISOTree
+except ImportError:
+    print('Unable to import oz.  Is oz installed?')
+    sys.exit(1)
+
+# test oz.ISOTree.snapshot/changes
+def test_changes(tmpdir):
+    contents = str(tmpdir)
+    os.makedirs(os.path.join(contents, 'isolinux'))
+    os.makedirs(os.path.join(contents, 'images', 'pxeboot'))
+    for path in ['isolinux/isolinux.cfg', 'isolinux/vmlinuz', 'images/pxeboot/initrd.img']:
+        with open(os.path.join(contents, path), 'w') as f:
+            f.write('original')
+    before = oz.ISOTree.snapshot(contents)
+
+    os.unlink(os.path.join(contents, 'isolinux', 'isolinux.cfg'))
+    with open(os.path.join(contents, 'isolinux', 'isolinux.cfg'), 'w') as f:
+        f.write('default customiso\n')
+    with open(os.path.join(contents, 'ks.cfg'), 'w') as f:
+        f.write('text\n')
+    os.unlink(os.path.join(contents, 'images', 'pxeboot', 'initrd.img'))
+    os.rmdir(os.path.join(contents, 'images', 'pxeboot'))
+    os.rmdir(os.path.join(contents, 'images'))
+
+    changes = oz.ISOTree.changes(contents, before)
+    assert(changes == ['-rm_r', '/images',
+                       '-map', os.path.join(contents, 'isolinux', 'isolinux.cfg'), '/isolinux/isolinux.cfg',
+                       '-map', os.path.join(contents, 'ks.cfg'), '/ks.cfg'])
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+
+import logging
+import os
+import sys
+import threading
+
+try:
+    import pytest
+except ImportError:
+    print('Unable to import pytest.  Is pytest installed?')
+    sys.exit(1)
+
+# Find oz
+prefix = '.'
+for i in range(0,3):
+    if os.path.isdir(os.path.join(prefix, 'oz')):
+        sys.path.insert(0, prefix)
+        break
+    else:
+        prefix = '../' + prefix
+
+try:
+    import oz.Locking
+    import oz.ozutil
+except ImportError:
+    print('Unable to import oz.  Is oz installed?')
+    sys.exit(1)
+
+# test oz.Locking.lock_file
+def test_lock_file_shared(tmpdir):
+    fname = os.path.join(str(tmpdir), 'media.iso')
+    (fd1, outdir) = oz.Locking.open_locked_file(fname, shared=True)
+    (fd2, outdir) = oz.Locking.open_locked_file(fname, shared=True)
+    try:
+        # readers don't exclude each other, but do exclude a writer, even
+        # in the same process
+        assert(not oz.Locking.lock_file(fd1, blocking=False))
+        assert(oz.Locking.lock_file(fd1, shared=True, blocking=False))
+    finally:
+        os.close(fd2)
+    assert(oz.Locking.lock_file(fd1, blocking=False))
+    os.close(fd1)
+
+# test oz.Locking.lock_file_for_writing
+def test_lock_file_for_writing_other_writer(tmpdir):
+    fname = os.path.join(str(tmpdir), 'media.iso')
+    # another build is writing the file
+    (fd1, outdir) = oz.Locking.open_locked_file(fname)
+    fd2 = os.open(fname, os.O_RDWR)
+
+    def _writer():
+        oz.ozutil.write_bytes_to_fd(fd1, b'media')
+        oz.Locking.lock_file(fd1, shared=True)
+
+    thread = threading.Timer(0.3, _writer)
+    try:
+        thread.start()
+        # once the writer is done, we are told about the write instead of
+        # getting the exclusive lock, and hold a shared lock
+        assert(not oz.Locking.lock_file_for_writing(fd2, logging.getLogger(), fname))
+        thread.join()
+        assert(os.fstat(fd2).st_size == 5)
+        assert(not oz.Locking.lock_file(fd1, blocking=False))
+    finally:
+        os.close(fd1)
+        os.close(fd2)
+
+def test_lock_file_for_writing_readers(tmpdir):
+    fname = os.path.join(str(tmpdir), 'media.iso')
+    (fd1, outdir) = oz.Locking.open_locked_file(fname, shared=True)
+    (fd2, outdir) = oz.Locking.open_locked_file(fname, shared=True)
+
+    thread = threading.Timer(0.3, os.close, (fd1,))
+    try:
+        thread.start()
+        # a reader that goes away without writing is waited out
+        assert(oz.Locking.lock_file_for_writing(fd2, logging.getLogger(), fname))
+        thread.join()
+    finally:
+        os.close(fd2)
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+
+import hashlib
+import os
+import sys
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+try:
+    import pytest
+except ImportError:
+    print('Unable to import pytest.  Is pytest installed?')
+    sys.exit(1)
+
+# Find oz
+prefix = '.'
+for i in range(0,3):
+    if os.path.isdir(os.path.join(prefix, 'oz')):
+        sys.path.insert(0, prefix)
+        break
+    else:
+        prefix = '../' + prefix
+
+try:
+    import oz.Media
+    import oz.ozutil
+except ImportError:
+    print('Unable to import oz.  Is oz installed?')
+    sys.exit(1)
+
+# test oz.Media.get_media_index_entry/update_media_index_entry
+def test_media_index_entry(tmpdir):
+    index = os.path.join(str(tmpdir), 'media-index.json')
+    media = os.path.join(str(tmpdir), 'media.iso')
+    with open(media, 'wb') as f:
+        f.write(b'media')
+
+    assert(oz.Media.get_media_index_entry(index, media, os.stat(media)) is None)
+
+    oz.Media.update_media_index_entry(index, media, os.stat(media),
+                                      {'hashname': 'sha256', 'digest': 'abcd',
+                                       'csum_url': 'http://example.com/SHA256SUMS'})
+    oz.Media.update_media_index_entry(index, media, os.stat(media),
+                                      {'url': 'http://example.com/media.iso',
+                                       'etag': '"1234"'})
+    entry = oz.Media.get_media_index_entry(index, media, os.stat(media))
+    assert(entry['hashname'] == 'sha256')
+    assert(entry['digest'] == 'abcd')
+    assert(entry['csum_url'] == 'http://example.com/SHA256SUMS')
+    assert(entry['etag'] == '"1234"')
+
+def test_media_index_entry_changed_file(tmpdir):
+    index = os.path.join(str(tmpdir), 'media-index.json')
+    media = os.path.join(str(tmpdir), 'media.iso')
+    with open(media, 'wb') as f:
+        f.write(b'media')
+
+    oz.Media.update_media_index_entry(index, media, os.stat(media),
+                                      {'hashname': 'md5', 'digest': 'abcd'})
+    with open(media, 'ab') as f:
+        f.write(b'more')
+    assert(oz.Media.get_media_index_entry(index, media, os.stat(media)) is None)
+
+    # an update for the new version of the file must not keep stale fields
+    oz.Media.update_media_index_entry(index, media, os.stat(media),
+                                      {'etag': '"5678"'})
+    entry = oz.Media.get_media_index_entry(index, media, os.stat(media))
+    assert(entry['etag'] == '"5678"')
+    assert('digest' not in entry)
+
+def test_media_index_entry_corrupt_index(tmpdir):
+    index = os.path.join(str(tmpdir), 'media-index.json')
+    media = os.path.join(str(tmpdir), 'media.iso')
+    with open(media, 'wb') as f:
+        f.write(b'media')
+    with open(index, 'w') as f:
+        f.write('{not json')
+
+    assert(oz.Media.get_media_index_entry(index, media, os.stat(media)) is None)
+    oz.Media.update_media_index_entry(index, media, os.stat(media),
+                                      {'hashname': 'sha1', 'digest': 'abcd'})
+    assert(oz.Media.get_media_index_entry(index, media, os.stat(media)) is not None)
+
+# test oz.Media.MediaCache.get_original_media
+def _mock_tdl():
+    tdl = mock.Mock()
+    tdl.iso_md5_url = None
+    tdl.iso_sha1_url = None
+    tdl.iso_sha256_url = None
+    return tdl
+
+def test_get_original_media(tmpdir):
+    src = os.path.join(str(tmpdir), 'upstream.iso')
+    with open(src, 'wb') as f:
+        f.write(b'original media')
+    cached = os.path.join(str(tmpdir), 'cached.iso')
+    media = oz.Media.MediaCache(_mock_tdl(), str(tmpdir), 1)
+
+    fd = os.open(cached, os.O_RDWR | os.O_CREAT)
+    try:
+        media.get_original_media('file://' + src, fd, str(tmpdir), False,
+                                 cached)
+    finally:
+        os.close(fd)
+    assert(open(cached, 'rb').read() == b'original media')
+    assert(not os.path.exists(cached + '.part'))
+    entry = oz.Media.get_media_index_entry(media.index, cached, os.stat(cached))
+    assert(entry['url'] == 'file://' + src)
+
+def test_get_original_media_checksum(tmpdir):
+    src = os.path.join(str(tmpdir), 'upstream.iso')
+    with open(src, 'wb') as f:
+        f.write(b'original media')
+    csum = os.path.join(str(tmpdir), 'MD5SUMS')
+    with open(csum, 'w') as f:
+        f.write('%s  upstream.iso\n' % (hashlib.md5(b'original media').hexdigest()))
+    cached = os.path.join(str(tmpdir), 'cached.iso')
+    tdl = _mock_tdl()
+    tdl.iso_md5_url = 'file://' + csum
+    tdl.distro, tdl.update, tdl.arch = 'Fedora', '38', 'x86_64'
+    media = oz.Media.MediaCache(tdl, str(tmpdir), 1)
+
+    fd = os.open(cached, os.O_RDWR | os.O_CREAT)
+    try:
+        media.get_original_media('file://' + src, fd, str(tmpdir), False,
+                                 cached)
+    finally:
+        os.close(fd)
+    entry = oz.Media.get_media_index_entry(media.index, cached, os.stat(cached))
+    assert(entry['hashname'] == 'md5')
+    # the SHA256 is taken while downloading, along with the checksum
+    assert(entry['sha256'] == hashlib.sha256(b'original media').hexdigest())
+
+# test oz.Media.modified_media_key
+def test_modified_media_key(tmpdir, monkeypatch):
+    auto = os.path.join(str(tmpdir), 'auto.ks')
+    with open(auto, 'w') as f:
+        f.write('text\n')
+    guest = mock.Mock()
+    guest.auto = auto
+    guest.url = 'http://example.com/media.iso'
+    guest.tdl.isoextras = []
+    for attr in ['distro', 'update', 'arch', 'installtype', 'rootpw', 'key',
+                 'kernel_param']:
+        setattr(guest.tdl, attr, attr)
+    key = oz.Media.modified_media_key(guest)
+    assert(key == oz.Media.modified_media_key(guest))
+
+    # the code that masters the ISO is part of the key
+    hashed = []
+    real_hash_path = oz.ozutil.hash_path
+    def _hash_path(path, digest=None):
+        hashed.append(os.path.basename(path))
+        return real_hash_path(path, digest)
+    monkeypatch.setattr(oz.ozutil, 'hash_path', _hash_path)
+    oz.Media.modified_media_key(guest)
+    for name in ['ElTorito.py', 'ISO9660.py', 'ISOTree.py', 'Media.py',
+                 'ozutil.py']:
+        assert(name in hashed)
+
+# test oz.Media.MediaCache.cache_modified_media/modified_media_cached
+def test_modified_media_cache(tmpdir):
+    orig = os.path.join(str(tmpdir), 'orig.iso')
+    with open(orig, 'wb') as f:
+        f.write(b'original media')
+    output = os.path.join(str(tmpdir), 'output.iso')
+    with open(output, 'wb') as f:
+        f.write(b'modified media')
+    cache = os.path.join(str(tmpdir), 'modified-0123456789abcdef.iso')
+    media = oz.Media.MediaCache(_mock_tdl(), str(tmpdir), 1)
+
+    assert(not media.modified_media_cached(cache, orig))
+    fd = os.open(orig, os.O_RDONLY)
+    try:
+        media.cache_modified_media(output, cache, orig, fd)
+    finally:
+        os.close(fd)
+    assert(open(cache, 'rb').read() == b'modified media')
+    assert(os.stat(cache).st_ino != os.stat(output).st_ino)
+    assert(media.modified_media_cached(cache, orig))
+
+    # media made from a different original can't be used
+    with open(orig, 'ab') as f:
+        f.write(b'changed')
+    assert(not media.modified_media_cached(cache, orig))
+
+    # and if the original is gone, there is nothing to show that the media
+    # came from what the URL refers to now
+    os.unlink(orig)
+    assert(not media.modified_media_cached(cache, orig))
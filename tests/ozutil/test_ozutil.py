@@ -1,7 +1,16 @@
 #!/usr/bin/python
 
+import asyncio
+import errno
+import hashlib
+import io
+import logging
 import sys
 import os
+import stat
+import tarfile
+import threading
+import time
 
 try:
     import pytest
@@ -147,6 +156,48 @@ def test_copy_sparse_zero_blocks(tmpdir):
     oz.ozutil.copyfile_sparse(srcname, dstname)
     assert(os.stat(dstname).st_size == 32*1024*3)
 
+def test_copy_sparse_holes(tmpdir, monkeypatch):
+    # make sure we take the extent walking path even on filesystems that
+    # can reflink
+    monkeypatch.setattr(oz.ozutil, 'reflink_fd', lambda src_fd, dest_fd: False)
+    with open('/dev/urandom', 'rb') as infd:
+        data1 = infd.read(64*1024)
+        data2 = infd.read(64*1024)
+
+    srcname = os.path.join(str(tmpdir), 'src')
+    with open(srcname, 'wb') as outfd:
+        outfd.write(data1)
+        outfd.seek(4*1024*1024, os.SEEK_CUR)
+        outfd.write(data2)
+        outfd.truncate(64*1024*2 + 8*1024*1024)
+    dstname = os.path.join(str(tmpdir), 'dst')
+    oz.ozutil.copyfile_sparse(srcname, dstname)
+
+    expected = data1 + b'\0'*4*1024*1024 + data2 + b'\0'*4*1024*1024
+    assert(open(dstname, 'rb').read() == expected)
+    assert(os.stat(dstname).st_blocks <= os.stat(srcname).st_blocks)
+
+def test_copy_sparse_zero_blocks_userspace(tmpdir):
+    with open('/dev/urandom', 'rb') as infd:
+        data = infd.read(32*1024)
+
+    srcname = os.path.join(str(tmpdir), 'src')
+    with open(srcname, 'wb') as outfd:
+        outfd.write(data)
+        outfd.write(b'\0'*1024*1024)
+    dstname = os.path.join(str(tmpdir), 'dst')
+    src_fd = os.open(srcname, os.O_RDONLY)
+    dst_fd = os.open(dstname, os.O_WRONLY | os.O_CREAT)
+    try:
+        oz.ozutil._copy_sparse_blocks(src_fd, dst_fd, 0, 32*1024 + 1024*1024, 32*1024)
+        os.ftruncate(dst_fd, 32*1024 + 1024*1024)
+    finally:
+        os.close(src_fd)
+        os.close(dst_fd)
+    assert(open(dstname, 'rb').read() == data + b'\0'*1024*1024)
+    # the zeros must have been skipped rather than written
+    assert(os.stat(dstname).st_blocks * 512 < 1024*1024)
+
 def test_copy_sparse_src_not_exists(tmpdir):
     srcname = os.path.join(str(tmpdir), 'src')
     dstname = os.path.join(str(tmpdir), 'dst')
@@ -436,3 +487,312 @@ def test_md5sum_regular_no_space(tmpdir):
         f.write('6e812e782e52b536c0307bb26b3c244e_*Fedora-11-i386-DVD.iso\n')
 
     oz.ozutil.get_md5sum_from_file(src, 'Fedora-11-i386-DVD.iso')
+
+# test oz.ozutil.pwrite_bytes_to_fd
+def test_pwrite_bytes_to_fd(tmpdir):
+    fullname = os.path.join(str(tmpdir), 'pwrite')
+    fd = os.open(fullname, os.O_RDWR | os.O_CREAT)
+    try:
+        assert(oz.ozutil.pwrite_bytes_to_fd(fd, b'world', 6) == 5)
+        assert(oz.ozutil.pwrite_bytes_to_fd(fd, b'hello ', 0) == 6)
+        # pwrite must not move the file offset
+        assert(os.lseek(fd, 0, os.SEEK_CUR) == 0)
+    finally:
+        os.close(fd)
+    assert(open(fullname, 'rb').read() == b'hello world')
+
+# test oz.ozutil.http_download_file
+def test_http_download_file_local(tmpdir):
+    src = os.path.join(str(tmpdir), 'src')
+    with open(src, 'wb') as f:
+        f.write(b'local data')
+    dst = os.path.join(str(tmpdir), 'dst')
+    fd = os.open(dst, os.O_RDWR | os.O_CREAT)
+    try:
+        digest = hashlib.sha1()
+        oz.ozutil.http_download_file('file://' + src, fd, False, None, 4,
+                                     digest=digest)
+    finally:
+        os.close(fd)
+    assert(open(dst, 'rb').read() == b'local data')
+    assert(digest.hexdigest() == hashlib.sha1(b'local data').hexdigest())
+
+def test_http_download_file_local_offset(tmpdir):
+    src = os.path.join(str(tmpdir), 'src')
+    with open(src, 'wb') as f:
+        f.write(b'local data')
+    dst = os.path.join(str(tmpdir), 'dst')
+    fd = os.open(dst, os.O_RDWR | os.O_CREAT)
+    try:
+        os.write(fd, b'header ')
+        oz.ozutil.http_download_file('file://' + src, fd, False, None)
+        assert(os.lseek(fd, 0, os.SEEK_CUR) == len(b'header local data'))
+    finally:
+        os.close(fd)
+    assert(open(dst, 'rb').read() == b'header local data')
+
+def test_http_download_file_local_no_copy_file_range(tmpdir, monkeypatch):
+    def _fail(*args):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+    if hasattr(os, 'copy_file_range'):
+        monkeypatch.setattr(os, 'copy_file_range', _fail)
+    monkeypatch.setattr(oz.ozutil, 'reflink_fd', lambda src_fd, dest_fd: False)
+
+    data = b'0123456789' * 100000
+    src = os.path.join(str(tmpdir), 'src')
+    with open(src, 'wb') as f:
+        f.write(data)
+    dst = os.path.join(str(tmpdir), 'dst')
+    fd = os.open(dst, os.O_RDWR | os.O_CREAT)
+    try:
+        oz.ozutil.http_download_file('file://' + src, fd, False, None)
+    finally:
+        os.close(fd)
+    assert(open(dst, 'rb').read() == data)
+
+# test the conditional HEAD support in oz.ozutil.LocalFileAdapter
+def test_http_get_header_not_modified(tmpdir):
+    media = os.path.join(str(tmpdir), 'media.iso')
+    with open(media, 'wb') as f:
+        f.write(b'media')
+
+    url = 'file://' + media
+    info = oz.ozutil.http_get_header(url)
+    assert(info['HTTP-Code'] == 200)
+    last_modified = info['Last-Modified']
+
+    info = oz.ozutil.http_get_header(url, headers={'If-Modified-Since': last_modified})
+    assert(info['HTTP-Code'] == 304)
+
+    st = os.stat(media)
+    os.utime(media, (st.st_atime, st.st_mtime + 3600))
+    info = oz.ozutil.http_get_header(url, headers={'If-Modified-Since': last_modified})
+    assert(info['HTTP-Code'] == 200)
+
+# test oz.ozutil.hash_path
+def test_hash_path(tmpdir):
+    tree = os.path.join(str(tmpdir), 'tree')
+    os.makedirs(os.path.join(tree, 'sub'))
+    with open(os.path.join(tree, 'sub', 'file'), 'wb') as f:
+        f.write(b'contents')
+    assert(oz.ozutil.hash_path(os.path.join(tree, 'sub', 'file')) == hashlib.sha256(b'contents').hexdigest())
+
+    first = oz.ozutil.hash_path(tree)
+    assert(oz.ozutil.hash_path(tree) == first)
+
+    os.rename(os.path.join(tree, 'sub', 'file'), os.path.join(tree, 'sub', 'renamed'))
+    assert(oz.ozutil.hash_path(tree) != first)
+    os.rename(os.path.join(tree, 'sub', 'renamed'), os.path.join(tree, 'sub', 'file'))
+    assert(oz.ozutil.hash_path(tree) == first)
+
+    with open(os.path.join(tree, 'sub', 'file'), 'ab') as f:
+        f.write(b'more')
+    assert(oz.ozutil.hash_path(tree) != first)
+
+# test oz.ozutil.clone_file
+def test_clone_file(tmpdir):
+    src = os.path.join(str(tmpdir), 'src')
+    dest = os.path.join(str(tmpdir), 'dest')
+    with open(src, 'wb') as f:
+        f.write(b'cached media')
+    # a hardlink to src left behind by an earlier run
+    os.link(src, dest)
+
+    oz.ozutil.clone_file(src, dest)
+    # dest was replaced, not written into, and doesn't share the inode
+    assert(not os.path.samefile(src, dest))
+    assert(open(dest, 'rb').read() == b'cached media')
+    with open(dest, 'wb') as f:
+        f.write(b'written by the guest')
+    assert(open(src, 'rb').read() == b'cached media')
+
+def _make_readonly_tree(tmpdir):
+    tree = os.path.join(str(tmpdir), 'isocontent')
+    os.makedirs(os.path.join(tree, 'isolinux', 'deep'))
+    with open(os.path.join(tree, 'isolinux', 'isolinux.cfg'), 'w') as f:
+        f.write('default linux\n')
+    outside = os.path.join(str(tmpdir), 'outside')
+    os.makedirs(outside)
+    with open(os.path.join(outside, 'keep'), 'w') as f:
+        f.write('keep\n')
+    os.symlink(outside, os.path.join(tree, 'isolinux', 'link'))
+    for path in [os.path.join(tree, 'isolinux', 'isolinux.cfg'),
+                 os.path.join(tree, 'isolinux', 'deep'),
+                 os.path.join(tree, 'isolinux'), tree]:
+        os.chmod(path, 0o555)
+    return tree, outside
+
+# test oz.ozutil.rmtree_and_sync
+def test_rmtree_and_sync_readonly(tmpdir):
+    tree, outside = _make_readonly_tree(tmpdir)
+    assert(oz.ozutil.rmtree_and_sync(tree) is None)
+    assert(not os.path.exists(tree))
+    # the symlink was removed, not followed
+    assert(os.path.exists(os.path.join(outside, 'keep')))
+    assert(stat.S_IMODE(os.stat(outside).st_mode) != 0o777)
+
+def test_rmtree_and_sync_background(tmpdir):
+    tree, outside = _make_readonly_tree(tmpdir)
+    thread = oz.ozutil.rmtree_and_sync(tree, background=True)
+    # the path is free as soon as the call returns
+    assert(not os.path.exists(tree))
+    thread.join()
+    assert(os.listdir(str(tmpdir)) == ['outside'])
+    assert(os.path.exists(os.path.join(outside, 'keep')))
+
+    assert(oz.ozutil.rmtree_and_sync(tree, background=True) is None)
+
+def test_rmtree_and_sync_background_failure(tmpdir, monkeypatch):
+    tree, outside = _make_readonly_tree(tmpdir)
+    def _fail(directory):
+        raise OSError(errno.EIO, os.strerror(errno.EIO))
+    monkeypatch.setattr(oz.ozutil, '_remove_tree', _fail)
+    logger = logging.getLogger('test_rmtree_and_sync_background_failure')
+    errors = []
+    monkeypatch.setattr(logger, 'error', lambda msg, *args: errors.append(msg % args))
+    oz.ozutil.rmtree_and_sync(tree, background=True, logger=logger).join()
+    assert(len(errors) == 1)
+    trash = [name for name in os.listdir(str(tmpdir)) if name.endswith('.removing')]
+    assert(len(trash) == 1)
+
+    # the next cleanup picks up what was left behind
+    monkeypatch.undo()
+    threads = oz.ozutil.remove_stale_trees(str(tmpdir), logger)
+    assert(len(threads) == 1)
+    threads[0].join()
+    assert(os.listdir(str(tmpdir)) == ['outside'])
+
+def test_remove_stale_trees_in_progress(tmpdir, monkeypatch):
+    tree = os.path.join(str(tmpdir), 'isocontent')
+    os.makedirs(os.path.join(tree, 'isolinux'))
+    started = threading.Event()
+    release = threading.Event()
+    real_remove_tree = oz.ozutil._remove_tree
+    def _slow(directory):
+        started.set()
+        release.wait(5)
+        real_remove_tree(directory)
+    monkeypatch.setattr(oz.ozutil, '_remove_tree', _slow)
+
+    thread = oz.ozutil.rmtree_and_sync(tree, background=True)
+    assert(started.wait(5))
+    # a tree that is being removed is left alone
+    assert(oz.ozutil.remove_stale_trees(str(tmpdir), logging.getLogger()) == [])
+    release.set()
+    thread.join()
+    assert(os.listdir(str(tmpdir)) == [])
+
+# test oz.ozutil.extract_writable_tar
+def test_extract_writable_tar(tmpdir):
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w') as tar:
+        info = tarfile.TarInfo('isolinux')
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o555
+        tar.addfile(info)
+        info = tarfile.TarInfo('isolinux/isolinux.cfg')
+        info.mode = 0o444
+        data = b'default linux\n'
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    archive.seek(0)
+
+    dest = os.path.join(str(tmpdir), 'contents')
+    os.makedirs(dest)
+    oz.ozutil.extract_writable_tar(archive, dest)
+    cfg = os.path.join(dest, 'isolinux', 'isolinux.cfg')
+    assert(open(cfg, 'rb').read() == b'default linux\n')
+    assert(stat.S_IMODE(os.stat(cfg).st_mode) == 0o644)
+    assert(stat.S_IMODE(os.stat(os.path.dirname(cfg)).st_mode) == 0o755)
+
+# test oz.ozutil.filesystem_space
+def test_filesystem_space(tmpdir):
+    existing = str(tmpdir)
+    missing = os.path.join(existing, 'not', 'there', 'yet')
+    space = oz.ozutil.filesystem_space([('download', existing, 100),
+                                        ('extract', missing, 50)])
+    # the missing path is accounted to the filesystem it would be on
+    assert(len(space) == 1)
+    (path, needed, available) = space[0]
+    assert(path == existing)
+    assert(needed == 150)
+    devdata = os.statvfs(existing)
+    assert(available == devdata.f_frsize * devdata.f_bavail)
+    assert(oz.ozutil.filesystem_id(missing) == os.stat(existing).st_dev)
+
+# test oz.ozutil.check_space_plan
+def test_check_space_plan(tmpdir):
+    path = str(tmpdir)
+    devdata = os.statvfs(path)
+    free = devdata.f_frsize * devdata.f_bavail
+    logger = logging.getLogger('test_check_space_plan')
+
+    assert(oz.ozutil.check_space_plan([('download', path, 100, False),
+                                       ('disk image', path, free * 2, True)],
+                                      logger) == [])
+    short = oz.ozutil.check_space_plan([('download', path, free * 2, False)],
+                                       logger)
+    assert(len(short) == 1)
+    assert(short[0].startswith(path))
+
+# test oz.ozutil.timed_loop
+def test_timed_loop_event():
+    calls = []
+    def _cb(arg):
+        calls.append(arg)
+        return False
+
+    event = threading.Event()
+    timer = threading.Timer(0.2, event.set)
+    timer.start()
+    start = time.time()
+    # the loop ends as soon as the event is set, not at the timeout
+    assert(oz.ozutil.timed_loop(30, _cb, "Waiting for event", 'arg', event))
+    assert(time.time() - start < 5)
+    assert(calls == ['arg'])
+    timer.join()
+
+# test oz.ozutil.async_timed_loop
+def test_async_timed_loop_event():
+    calls = []
+    async def _cb(arg):
+        calls.append(arg)
+        return False
+
+    async def _wait():
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        # the event is set from another thread, like libvirt events are
+        timer = threading.Timer(0.2, loop.call_soon_threadsafe, [event.set])
+        timer.start()
+        try:
+            return await oz.ozutil.async_timed_loop(30, _cb, "Waiting for event", 'arg', event)
+        finally:
+            timer.join()
+
+    start = time.time()
+    assert(asyncio.run(_wait()))
+    assert(time.time() - start < 5)
+    assert(calls == ['arg'])
+
+def test_async_timed_loop_cb():
+    async def _cb(arg):
+        return True
+
+    assert(asyncio.run(oz.ozutil.async_timed_loop(30, _cb, "Waiting for callback")))
+
+# test oz.ozutil.async_subprocess_check_output
+def test_async_subprocess_check_output():
+    printed = []
+    stdout, stderr, retcode = asyncio.run(oz.ozutil.async_subprocess_check_output(['sh', '-c', 'echo out; echo err >&2'],
+                                                                                  printfn=printed.append))
+    assert(stdout == 'out\n')
+    assert(stderr == 'err\n')
+    assert(retcode == 0)
+    assert(sorted(printed) == ['err\n', 'out\n'])
+
+def test_async_subprocess_check_output_fail():
+    with pytest.raises(oz.ozutil.SubprocessException) as excinfo:
+        asyncio.run(oz.ozutil.async_subprocess_check_output(['sh', '-c', 'echo oops >&2; exit 3']))
+    assert(excinfo.value.retcode == 3)
+    assert('oops' in str(excinfo.value))